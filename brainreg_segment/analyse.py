@@ -0,0 +1,299 @@
+"""
+Analyse the saved regions and tracks of many brainreg directories, without
+napari (e.g. to re-run analyses after an atlas update).
+"""
+import json
+import argparse
+import multiprocessing
+
+import pandas as pd
+
+from glob import glob
+from pathlib import Path
+from functools import partial
+from concurrent.futures import ProcessPoolExecutor, as_completed
+
+from brainreg_segment.paths import Paths
+from brainreg_segment.regions.IO import load_image
+from brainreg_segment.regions.analysis import analyse_regions
+from brainreg_segment.tracks.analysis import fit_tracks
+from brainreg_segment.layout.gui_constants import (
+    CALCULATE_VOLUMES_DEFAULT,
+    FIT_DEGREE_DEFAULT,
+    IMAGE_FILE_EXT,
+    ROLL_UP_VOLUMES_DEFAULT,
+    SPLINE_POINTS_DEFAULT,
+    SPLINE_SMOOTHING_DEFAULT,
+    SUMMARISE_TRACK_DEFAULT,
+    SUMMARIZE_VOLUMES_DEFAULT,
+    TRACK_FILE_EXT,
+)
+
+# Files saved by brainreg
+BRAINREG_METADATA_FILE = "brainreg.json"
+REGISTERED_ATLAS_FILE = "registered_atlas.tiff"
+REGISTERED_HEMISPHERES_FILE = "registered_hemispheres.tiff"
+
+
+def get_parser():
+    parser = argparse.ArgumentParser(
+        description="Analyse the saved regions and tracks of brainreg "
+        "directories, without opening napari"
+    )
+    parser.add_argument(
+        "brainreg_directories",
+        nargs="+",
+        type=Path,
+        help="brainreg output directories",
+    )
+    parser.add_argument(
+        "--sample-space",
+        dest="standard_space",
+        action="store_false",
+        help="Analyse the segmentation done in sample space (rather than "
+        "standard space)",
+    )
+    parser.add_argument(
+        "--no-regions",
+        dest="regions",
+        action="store_false",
+        help="Don't analyse regions",
+    )
+    parser.add_argument(
+        "--no-tracks",
+        dest="tracks",
+        action="store_false",
+        help="Don't analyse tracks",
+    )
+    parser.add_argument(
+        "--no-volumes",
+        dest="volumes",
+        action="store_false",
+        default=CALCULATE_VOLUMES_DEFAULT,
+        help="Don't calculate the volume of each region in each brain area",
+    )
+    parser.add_argument(
+        "--no-summarise-volumes",
+        dest="summarise_volumes",
+        action="store_false",
+        default=SUMMARIZE_VOLUMES_DEFAULT,
+        help="Don't summarise each region",
+    )
+    parser.add_argument(
+        "--roll-up",
+        dest="roll_up",
+        action="store_true",
+        default=ROLL_UP_VOLUMES_DEFAULT,
+        help="Also report region volumes within every ancestor of the brain "
+        "areas in the atlas hierarchy",
+    )
+    parser.add_argument(
+        "--no-summarise-tracks",
+        dest="summarise_track",
+        action="store_false",
+        default=SUMMARISE_TRACK_DEFAULT,
+        help="Don't save the brain area of each point of each track",
+    )
+    parser.add_argument(
+        "--spline-points",
+        type=int,
+        default=SPLINE_POINTS_DEFAULT,
+        help="Number of points of each fitted track",
+    )
+    parser.add_argument(
+        "--fit-degree",
+        type=int,
+        default=FIT_DEGREE_DEFAULT,
+        help="Degree of the spline fitted to each track",
+    )
+    parser.add_argument(
+        "--spline-smoothing",
+        type=float,
+        default=SPLINE_SMOOTHING_DEFAULT,
+        help="Smoothing of the spline fitted to each track",
+    )
+    parser.add_argument(
+        "--image-file-extension",
+        default=IMAGE_FILE_EXT,
+        help="File extension of the saved regions",
+    )
+    parser.add_argument(
+        "--n-processes",
+        type=int,
+        default=None,
+        help="Number of brains analysed at once (default: one per CPU)",
+    )
+    return parser
+
+
+def main():
+    args = vars(get_parser().parse_args())
+    brainreg_directories = args.pop("brainreg_directories")
+    n_processes = args.pop("n_processes")
+
+    failed = []
+    for brainreg_directory, error in analyse_brains(
+        brainreg_directories, n_processes=n_processes, **args
+    ):
+        if error is None:
+            print(f"Analysed {brainreg_directory}")
+        else:
+            print(f"Could not analyse {brainreg_directory}: {error}")
+            failed.append(brainreg_directory)
+    if failed:
+        raise SystemExit(f"{len(failed)} brain(s) could not be analysed")
+
+
+def analyse_brains(brainreg_directories, n_processes=None, **kwargs):
+    """
+    Analyse many brains, in a pool of processes
+    :param brainreg_directories: List of brainreg output directories
+    :param n_processes: Number of brains analysed at once. If 1, they are
+    analysed in this process. If None, one per CPU.
+    :param kwargs: Passed to analyse_brain
+    :return: Generator of (brainreg_directory, error) tuples, as each brain
+    is analysed, where error is None if the analysis succeeded
+    """
+    analyse = partial(analyse_brain_safely, **kwargs)
+    if n_processes == 1:
+        for brainreg_directory in brainreg_directories:
+            yield analyse(brainreg_directory)
+        return
+
+    # Not forked, so as not to copy the state (e.g. threads) of the caller
+    context = multiprocessing.get_context("spawn")
+    with ProcessPoolExecutor(
+        max_workers=n_processes, mp_context=context
+    ) as executor:
+        futures = [
+            executor.submit(analyse, brainreg_directory)
+            for brainreg_directory in brainreg_directories
+        ]
+        for future in as_completed(futures):
+            yield future.result()
+
+
+def analyse_brain_safely(brainreg_directory, **kwargs):
+    """
+    Analyse a brain, catching any error so other brains can still be
+    analysed
+    :return: Tuple (brainreg_directory, error), where error is None if the
+    analysis succeeded
+    """
+    try:
+        analyse_brain(brainreg_directory, **kwargs)
+    except Exception as error:
+        return brainreg_directory, f"{type(error).__name__}: {error}"
+    return brainreg_directory, None
+
+
+def analyse_brain(
+    brainreg_directory,
+    standard_space=True,
+    regions=True,
+    tracks=True,
+    volumes=CALCULATE_VOLUMES_DEFAULT,
+    summarise_volumes=SUMMARIZE_VOLUMES_DEFAULT,
+    roll_up=ROLL_UP_VOLUMES_DEFAULT,
+    summarise_track=SUMMARISE_TRACK_DEFAULT,
+    spline_points=SPLINE_POINTS_DEFAULT,
+    fit_degree=FIT_DEGREE_DEFAULT,
+    spline_smoothing=SPLINE_SMOOTHING_DEFAULT,
+    image_file_extension=IMAGE_FILE_EXT,
+    track_file_extension=TRACK_FILE_EXT,
+):
+    """
+    Analyse the saved regions and tracks of a brain, as the "Analyse
+    regions" and "Analyse tracks" buttons do
+    :param brainreg_directory: brainreg output directory
+    :param standard_space: Whether to analyse the segmentation done in
+    standard space (otherwise sample space)
+    :param regions: Whether to analyse regions
+    :param tracks: Whether to analyse tracks
+    :param volumes: Calculate the volume of each region in each brain area
+    :param summarise_volumes: Summarise each region
+    :param roll_up: Also report region volumes within every ancestor of the
+    brain areas
+    :param summarise_track: Save the brain area of each point of each track
+    :param spline_points: Number of points of each fitted track
+    :param fit_degree: Degree of the spline fitted to each track
+    :param spline_smoothing: Smoothing of the spline fitted to each track
+    :param image_file_extension: File extension of the saved regions
+    :param track_file_extension: File extension of the saved tracks
+    """
+    brainreg_directory = Path(brainreg_directory)
+    paths = Paths(brainreg_directory, standard_space=standard_space)
+    if not paths.segmentation_directory.exists():
+        raise FileNotFoundError(
+            f"No segmentation found in {paths.segmentation_directory}"
+        )
+    atlas = load_atlas(brainreg_directory)
+
+    if regions:
+        label_files = sorted(
+            glob(str(paths.regions_directory) + "/*" + image_file_extension)
+        )
+        if label_files:
+            if standard_space:
+                annotation = atlas.annotation
+                hemispheres = atlas.hemispheres
+            else:
+                annotation = load_image(
+                    brainreg_directory / REGISTERED_ATLAS_FILE
+                )
+                hemispheres = load_image(
+                    brainreg_directory / REGISTERED_HEMISPHERES_FILE
+                )
+            analyse_regions(
+                [
+                    (Path(label_file).stem, load_image(label_file, lazy=True))
+                    for label_file in label_files
+                ],
+                annotation,
+                atlas,
+                hemispheres,
+                paths.regions_directory,
+                output_csv_file=paths.region_summary_csv,
+                volumes=volumes,
+                summarise=summarise_volumes,
+                roll_up=roll_up,
+            )
+
+    if tracks:
+        track_files = sorted(
+            glob(str(paths.tracks_directory) + "/*" + track_file_extension)
+        )
+        track_points = [
+            (Path(track_file).stem, pd.read_hdf(track_file).to_numpy())
+            for track_file in track_files
+        ]
+        track_points = [
+            (name, points) for name, points in track_points if len(points)
+        ]
+        if track_points:
+            fit_tracks(
+                track_points,
+                atlas,
+                paths.tracks_directory,
+                spline_points=spline_points,
+                fit_degree=fit_degree,
+                spline_smoothing=spline_smoothing,
+                summarise_track=summarise_track,
+            )
+
+
+def load_atlas(brainreg_directory):
+    """
+    Load the atlas a brain was registered to
+    :param brainreg_directory: brainreg output directory
+    :return: brainglobe atlas class
+    """
+    from bg_atlasapi import BrainGlobeAtlas
+
+    with open(Path(brainreg_directory) / BRAINREG_METADATA_FILE) as f:
+        metadata = json.load(f)
+    return BrainGlobeAtlas(metadata["atlas"])
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,307 @@
+import numpy as np
+
+from pathlib import Path
+from scipy import sparse
+
+# Ancestor indices and structure tables, keyed by atlas name and version
+_ancestor_indices = {}
+_structure_tables = {}
+
+# Version of the format of cached structure tables
+STRUCTURE_TABLE_VERSION = 1
+
+
+class AncestorIndex:
+    """
+    Maps each structure of an atlas to itself and all of its ancestors,
+    so that values of structures can be summed up the hierarchy in a
+    single (sparse) matrix product.
+
+    :param atlas_structures: bg_atlasapi structures dictionary
+    """
+
+    def __init__(self, atlas_structures):
+        self.structure_ids = np.array(sorted(atlas_structures.keys()))
+
+        rows = []
+        columns = []
+        for column, structure_id in enumerate(self.structure_ids):
+            path = atlas_structures[structure_id]["structure_id_path"]
+            rows.extend(np.searchsorted(self.structure_ids, path))
+            columns.extend([column] * len(path))
+
+        # [i, j] is 1 if structure i is structure j, or one of its ancestors
+        self.matrix = sparse.csr_matrix(
+            (np.ones(len(rows), dtype=np.int64), (rows, columns)),
+            shape=(len(self.structure_ids),) * 2,
+        )
+
+    def index_of(self, structure_ids):
+        """
+        Find the position of structures within the index
+        :param structure_ids: Array of atlas structure IDs
+        :return: Tuple (index, found) of arrays. found is False for IDs
+        that are not in the atlas.
+        """
+        return search_sorted_ids(self.structure_ids, structure_ids)
+
+    def roll_up(self, structure_ids, *values):
+        """
+        Sum values of structures (e.g. voxel counts) into all of their
+        ancestors.
+        :param structure_ids: Array of atlas structure IDs. IDs that are not
+        in the atlas are ignored.
+        :param values: One or more arrays of values, one per structure
+        :return: Tuple (structure_ids, *rolled_up_values) for every structure
+        with a nonzero value
+        """
+        index, found = self.index_of(structure_ids)
+        stacked = np.zeros(
+            (len(self.structure_ids), len(values)),
+            dtype=np.result_type(*values),
+        )
+        np.add.at(stacked, index[found], np.column_stack(values)[found])
+        rolled_up = self.matrix @ stacked
+        nonzero = rolled_up.any(axis=1)
+        return (self.structure_ids[nonzero],) + tuple(rolled_up[nonzero].T)
+
+
+class StructureTable:
+    """
+    Metadata of every structure of an atlas (acronym, name, parent and depth
+    in the hierarchy) as arrays, so that an array of structure IDs can be
+    mapped to e.g. names in a single gather.
+
+    Atlas structure IDs are sparse (Allen IDs go up to ~600 million), so the
+    arrays are indexed by position within the sorted structure IDs (found
+    with searchsorted), rather than by ID.
+
+    :param structure_ids: Sorted array of atlas structure IDs
+    :param acronyms: Array of the acronym of each structure
+    :param names: Array of the name of each structure
+    :param parents: Array of the ID of the parent of each structure (-1 for
+    the root)
+    :param depths: Array of the depth of each structure in the hierarchy
+    (0 for the root)
+    """
+
+    def __init__(self, structure_ids, acronyms, names, parents, depths):
+        self.structure_ids = np.asarray(structure_ids)
+        # object arrays, so gathered values are python strings
+        self.acronyms = np.asarray(acronyms).astype(object)
+        self.names = np.asarray(names).astype(object)
+        self.parents = np.asarray(parents)
+        self.depths = np.asarray(depths)
+
+    @classmethod
+    def from_structures(cls, atlas_structures):
+        """
+        :param atlas_structures: bg_atlasapi structures dictionary
+        :return: StructureTable
+        """
+        structure_ids = np.array(sorted(atlas_structures.keys()), dtype=int)
+        structures = [atlas_structures[i] for i in structure_ids.tolist()]
+        paths = [
+            structure.get("structure_id_path", [structure_id])
+            for structure_id, structure in zip(structure_ids, structures)
+        ]
+        return cls(
+            structure_ids,
+            [structure.get("acronym", "") for structure in structures],
+            [structure["name"] for structure in structures],
+            np.array([path[-2] if len(path) > 1 else -1 for path in paths]),
+            np.array([len(path) - 1 for path in paths]),
+        )
+
+    @classmethod
+    def load(cls, filename):
+        """
+        :param filename: .npz file saved by StructureTable.save
+        :return: StructureTable
+        """
+        with np.load(filename) as table:
+            if int(table["version"]) != STRUCTURE_TABLE_VERSION:
+                raise ValueError("Unknown structure table version")
+            return cls(
+                table["structure_ids"],
+                table["acronyms"],
+                table["names"],
+                table["parents"],
+                table["depths"],
+            )
+
+    def save(self, filename):
+        """
+        Save the table to a .npz file. The file is written under a temporary
+        name first, so an interrupted save doesn't leave an incomplete table.
+        :param filename: .npz file
+        """
+        filename = Path(filename)
+        filename.parent.mkdir(parents=True, exist_ok=True)
+        temporary_file = filename.with_suffix(".tmp")
+        with open(temporary_file, "wb") as f:
+            np.savez(
+                f,
+                version=STRUCTURE_TABLE_VERSION,
+                structure_ids=self.structure_ids,
+                acronyms=self.acronyms.astype(str),
+                names=self.names.astype(str),
+                parents=self.parents,
+                depths=self.depths,
+            )
+        temporary_file.replace(filename)
+
+    def index_of(self, structure_ids):
+        """
+        Find the position of structures within the table
+        :param structure_ids: Array of atlas structure IDs
+        :return: Tuple (index, found) of arrays. found is False for IDs
+        that are not in the atlas.
+        """
+        return search_sorted_ids(self.structure_ids, structure_ids)
+
+
+def search_sorted_ids(sorted_ids, structure_ids):
+    """
+    Find the position of structure IDs within a sorted array of IDs
+    :param sorted_ids: Sorted array of atlas structure IDs
+    :param structure_ids: Array of atlas structure IDs
+    :return: Tuple (index, found) of arrays. found is False for IDs that
+    are not in sorted_ids (and their index should not be used).
+    """
+    structure_ids = np.asarray(structure_ids)
+    index = np.searchsorted(sorted_ids, structure_ids)
+    index = np.minimum(index, len(sorted_ids) - 1)
+    found = sorted_ids[index] == structure_ids
+    return index, found
+
+
+class RegionInfo:
+    """
+    Looks up the brain region info shown when hovering over an atlas, e.g.
+    "Primary motor area | Layer 5 | Left". The structure part of the info is
+    formatted once per structure, so each lookup only indexes the
+    annotation and hemispheres images, and the info for the last voxel is
+    reused while the cursor stays within it.
+
+    :param annotation: Atlas annotation image
+    :param hemispheres: Hemispheres image
+    :param atlas_structures: bg_atlasapi structures dictionary
+    :param left_hemisphere_value: Value encoded in hemispheres image
+    :param right_hemisphere_value: Value encoded in hemispheres image
+    """
+
+    def __init__(
+        self,
+        annotation,
+        hemispheres,
+        atlas_structures,
+        left_hemisphere_value=1,
+        right_hemisphere_value=2,
+    ):
+        self.annotation = annotation
+        self.hemispheres = hemispheres
+        self.structure_info = {
+            int(structure_id): " | ".join(
+                part.strip().capitalize()
+                for part in structure["name"].split(",")
+            )
+            for structure_id, structure in atlas_structures.items()
+        }
+        # 0 is "Null" region
+        self.structure_info.pop(0, None)
+        self.hemisphere_info = {
+            left_hemisphere_value: " | Left",
+            right_hemisphere_value: " | Right",
+        }
+        self._last_voxel = None
+        self._last_info = ""
+
+    def at(self, voxel):
+        """
+        :param voxel: Tuple of (integer) coordinates in the annotation image
+        :return: Region info string, or "" if outside the atlas
+        """
+        if voxel == self._last_voxel:
+            return self._last_info
+
+        info = ""
+        if len(voxel) == self.annotation.ndim and all(
+            0 <= i < size for i, size in zip(voxel, self.annotation.shape)
+        ):
+            structure_info = self.structure_info.get(
+                int(self.annotation[voxel])
+            )
+            if structure_info is not None:
+                info = structure_info + self.hemisphere_info.get(
+                    int(self.hemispheres[voxel]), ""
+                )
+
+        self._last_voxel = voxel
+        self._last_info = info
+        return info
+
+    def at_position(self, atlas_layer, position):
+        """
+        :param atlas_layer: napari layer of the annotation image
+        :param position: Cursor position in world coordinates (e.g. of a
+        napari mouse event)
+        :return: Region info string, or "" if outside the atlas
+        """
+        voxel = np.round(atlas_layer.world_to_data(position)).astype(int)
+        return self.at(tuple(voxel.tolist()))
+
+
+def get_ancestor_index(atlas):
+    """
+    Get the ancestor index of an atlas, building it only the first time it
+    is requested for each atlas name and version.
+    :param atlas: brainglobe atlas class
+    :return: AncestorIndex
+    """
+    if not hasattr(atlas, "atlas_name"):
+        # not a brainglobe atlas, so it can't be identified to be reused
+        return AncestorIndex(atlas.structures)
+
+    key = (atlas.atlas_name, atlas.metadata["version"])
+    if key not in _ancestor_indices:
+        _ancestor_indices[key] = AncestorIndex(atlas.structures)
+    return _ancestor_indices[key]
+
+
+def get_structure_table(atlas, cache_file=None):
+    """
+    Get the structure table of an atlas. It is only built the first time it
+    is requested for each atlas name and version, and is cached on disk
+    (by default in the brainreg-segment cache directory, next to the
+    atlases), so it is only built once per atlas.
+    :param atlas: brainglobe atlas class
+    :param cache_file: .npz file the table is cached in. If None, the
+    default is used.
+    :return: StructureTable
+    """
+    if not hasattr(atlas, "atlas_name"):
+        # not a brainglobe atlas, so it can't be identified to be cached
+        return StructureTable.from_structures(atlas.structures)
+
+    key = (atlas.atlas_name, atlas.metadata["version"])
+    if key not in _structure_tables:
+        if cache_file is None:
+            from brainreg_segment.cache import get_structure_table_cache_file
+
+            cache_file = get_structure_table_cache_file(atlas)
+
+        table = None
+        if Path(cache_file).exists():
+            try:
+                table = StructureTable.load(cache_file)
+            except (OSError, ValueError, KeyError):
+                print(f"Could not load structure table from {cache_file}")
+        if table is None:
+            table = StructureTable.from_structures(atlas.structures)
+            try:
+                table.save(cache_file)
+            except OSError:
+                print(f"Could not cache structure table to {cache_file}")
+        _structure_tables[key] = table
+    return _structure_tables[key]
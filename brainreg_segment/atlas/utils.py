@@ -1,6 +1,15 @@
 import re
+import configparser
+
+from bg_atlasapi import config
 from bg_atlasapi.list_atlases import utils, descriptors
 
+from brainreg_segment.cache import (
+    ATLAS_LIST_CACHE_TTL,
+    load_cached_atlas_list,
+    save_atlas_list_to_cache,
+)
+
 
 def lateralise_atlas_image(
     masked_atlas_annotations,
@@ -25,18 +34,60 @@ def lateralise_atlas_image(
     return annotation_left, annotation_right
 
 
-def get_available_atlases():
+def get_available_atlases(fetch=True, ttl=ATLAS_LIST_CACHE_TTL):
     """
-    Get the available brainglobe atlases
+    Get the available brainglobe atlases. The list is cached, and only
+    fetched again once the cache is older than ttl. If it can't be fetched
+    (e.g. offline), the cached list is used however old it is, or if there
+    is none, the atlases already downloaded.
+    :param fetch: If False, never fetch the list (i.e. don't use the network)
+    :param ttl: Maximum age of the cached list (in seconds) before it is
+    fetched again
+    :return: Dict of available atlases (["name":version])
+    """
+    available_atlases, age = load_cached_atlas_list()
+    if available_atlases is not None and (not fetch or age < ttl):
+        return available_atlases
+
+    if fetch:
+        try:
+            return fetch_available_atlases()
+        except (OSError, configparser.Error, KeyError):
+            print("Could not fetch the list of available atlases")
+
+    if available_atlases is not None:
+        return available_atlases
+    return get_downloaded_atlases()
+
+
+def fetch_available_atlases():
+    """
+    Fetch the available brainglobe atlases, and cache the list
     :return: Dict of available atlases (["name":version])
     """
     available_atlases = utils.conf_from_url(
         descriptors.remote_url_base.format("last_versions.conf")
     )
     available_atlases = dict(available_atlases["atlases"])
+    save_atlas_list_to_cache(available_atlases)
     return available_atlases
 
 
+def get_downloaded_atlases():
+    """
+    Get the brainglobe atlases downloaded to the brainglobe directory
+    :return: Dict of downloaded atlases (["name":version])
+    """
+    downloaded_atlases = {}
+    for atlas_directory in sorted(
+        config.get_brainglobe_dir().glob("*_*_*_v*")
+    ):
+        if atlas_directory.is_dir():
+            name, version = atlas_directory.name.rsplit("_v", 1)
+            downloaded_atlases[name] = version
+    return downloaded_atlases
+
+
 def structure_from_viewer(status, atlas_layer, atlas):
     """
     Get brain region info from mouse position in napari viewer.
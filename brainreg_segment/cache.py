@@ -0,0 +1,97 @@
+import json
+import time
+
+from bg_atlasapi import config
+
+from brainreg_segment.image.utils import get_image_hash
+
+# Seconds before the cached list of available atlases is fetched again
+ATLAS_LIST_CACHE_TTL = 24 * 60 * 60
+
+
+def get_cache_directory():
+    """
+    Get the directory used to cache data between sessions (within the
+    brainglobe directory)
+    :return: pathlib.Path
+    """
+    return config.get_brainglobe_dir() / "brainreg-segment"
+
+
+def get_surface_points_cache_file(
+    atlas, image, standard_space=True, value=0, surface_only=False
+):
+    """
+    Get the file used to cache the points of the brain surface (see
+    image.utils.create_KDTree_from_image).
+
+    Annotations in standard space are identified by the atlas name, version
+    and shape. Sample space annotations also depend on the registration, so
+    are identified by a hash of their contents.
+
+    :param atlas: brainglobe atlas class
+    :param image: Atlas annotations image
+    :param standard_space: Whether the annotations are in standard space
+    :param value: Value of image used as points
+    :param surface_only: Whether only the points bordering other values are
+    used
+    :return: pathlib.Path
+    """
+    shape = "x".join(str(s) for s in image.shape)
+    name = f"{atlas.atlas_name}_v{atlas.metadata['version']}_{shape}"
+    if not standard_space:
+        name = f"{name}_{get_image_hash(image)}"
+    if surface_only:
+        name = f"{name}_surface"
+    return get_cache_directory() / "surface_points" / f"{name}_{value}.npy"
+
+
+def get_structure_table_cache_file(atlas):
+    """
+    Get the file used to cache the structure table of an atlas (see
+    atlas.structures.get_structure_table)
+    :param atlas: brainglobe atlas class
+    :return: pathlib.Path
+    """
+    name = f"{atlas.atlas_name}_v{atlas.metadata['version']}"
+    return get_cache_directory() / "structures" / f"{name}.npz"
+
+
+def get_atlas_list_cache_file():
+    return get_cache_directory() / "available_atlases.json"
+
+
+def load_cached_atlas_list(cache_file=None):
+    """
+    Load the cached list of available atlases (see
+    atlas.utils.get_available_atlases)
+    :param cache_file: Cache file. If None, the default is used.
+    :return: Tuple (atlases, age), where atlases is a dict of available
+    atlases (["name":version]) and age is the age of the cache in seconds.
+    If there is no (valid) cache, atlases is None.
+    """
+    if cache_file is None:
+        cache_file = get_atlas_list_cache_file()
+    try:
+        with open(cache_file) as f:
+            cached = json.load(f)
+        return dict(cached["atlases"]), time.time() - cached["time"]
+    except (OSError, ValueError, KeyError, TypeError):
+        return None, None
+
+
+def save_atlas_list_to_cache(atlases, cache_file=None):
+    """
+    Cache the list of available atlases. The file is written under a
+    temporary name first, so an interrupted save doesn't leave an
+    incomplete cache.
+    :param atlases: Dict of available atlases (["name":version])
+    :param cache_file: Cache file. If None, the default is used.
+    """
+    if cache_file is None:
+        cache_file = get_atlas_list_cache_file()
+    cache_file.parent.mkdir(parents=True, exist_ok=True)
+    temporary_file = cache_file.with_suffix(".tmp")
+    with open(temporary_file, "w") as f:
+        json.dump({"time": time.time(), "atlases": atlases}, f, indent=4)
+    temporary_file.replace(cache_file)
@@ -1,14 +1,157 @@
+import hashlib
+
 import numpy as np
-from scipy.spatial import cKDTree
+from pathlib import Path
+
+# Number of planes (along the first axis) of an image that are processed at
+# once, to limit memory use with large (e.g. dask or zarr backed) images
+CHUNK_SIZE = 64
 
 
-def create_KDTree_from_image(image, value=0):
+def create_KDTree_from_image(
+    image, value=0, surface_only=False, cache_file=None
+):
     """
     Create a KDTree of points equalling a given value
     :param image: Image to be converted to points
     :param value: Value of image to be used
+    :param surface_only: If True, only use the points that border (share a
+    face with) a point of another value. Querying from within a region of
+    another value finds the same nearest point as when using all points
+    (see get_nearest_point for other query points).
+    :param cache_file: If not None, the points are saved to this (.npy)
+    file, and loaded (memory-mapped) from it if it already exists
     :return: scipy.spatial.cKDTree object
     """
+    from scipy.spatial import cKDTree
 
-    list_points = np.argwhere((image == value))
+    if cache_file is not None and Path(cache_file).exists():
+        list_points = np.load(Path(cache_file), mmap_mode="r")
+    else:
+        if surface_only:
+            list_points = np.argwhere(get_surface(image, value=value))
+        else:
+            list_points = np.argwhere((image == value))
+        if cache_file is not None:
+            save_points_to_cache(list_points, cache_file)
     return cKDTree(list_points)
+
+
+def get_nearest_point(tree, image, point, value=0):
+    """
+    Find the nearest point of an image equalling a given value, using a KDTree
+    of only the points that border another value (see
+    create_KDTree_from_image). If the voxel nearest to the query point
+    equals the value, it is the nearest point. Otherwise, the nearest point
+    borders another value, so is found from the tree. The result is the
+    same as querying a tree of all the points equalling the value.
+    :param tree: scipy.spatial.cKDTree from create_KDTree_from_image
+    :param image: Image the tree was created from
+    :param point: Query point (in voxel coordinates, may be outside the image)
+    :param value: Value the tree was created with
+    :return: numpy array of the coordinates of the nearest point
+    """
+    voxel = np.clip(np.round(point), 0, np.array(image.shape) - 1).astype(int)
+    if image[tuple(voxel)] == value:
+        return voxel.astype(tree.data.dtype)
+    _, index = tree.query(point)
+    return tree.data[index]
+
+
+def get_surface(image, value=0):
+    """
+    Find the points of an image equalling a given value, that border (share a
+    face with) a point of another value
+    :param image: Image
+    :param value: Value of image to be used
+    :return: Boolean numpy array
+    """
+    from scipy import ndimage
+
+    other = image != value
+    neighbours = ndimage.generate_binary_structure(image.ndim, 1)
+    return ndimage.binary_dilation(other, structure=neighbours) & ~other
+
+
+def save_points_to_cache(points, cache_file):
+    """
+    Save points to a .npy file. The file is written under a temporary name
+    first, so an interrupted save doesn't leave an incomplete cache.
+    :param points: numpy array of points
+    :param cache_file: .npy file to save to
+    """
+    cache_file = Path(cache_file)
+    cache_file.parent.mkdir(parents=True, exist_ok=True)
+    temporary_file = cache_file.with_suffix(".tmp")
+    with open(temporary_file, "wb") as f:
+        np.save(f, points)
+    temporary_file.replace(cache_file)
+
+
+def chunk_slices(image, chunk_size=CHUNK_SIZE):
+    """
+    Split the first axis of an image into chunks
+    :param image: Image (any array with a shape)
+    :param chunk_size: Number of planes in each chunk
+    :return: Generator of slice objects, one per chunk
+    """
+    for start in range(0, image.shape[0], chunk_size):
+        yield slice(start, start + chunk_size)
+
+
+def is_empty(image, chunk_size=CHUNK_SIZE):
+    """
+    Check whether an image has no nonzero values, one chunk at a time
+    :param image: Image (numpy, dask, zarr or other array)
+    :param chunk_size: Number of planes in each chunk
+    :return: True if the image is empty
+    """
+    for chunk in chunk_slices(image, chunk_size):
+        if np.asarray(image[chunk]).any():
+            return False
+    return True
+
+
+def get_bounding_box(image, chunk_size=CHUNK_SIZE):
+    """
+    Find the bounding box of the nonzero values of an image, one chunk at a
+    time
+    :param image: Image (numpy, dask, zarr or other array)
+    :param chunk_size: Number of planes in each chunk
+    :return: Tuple of slice objects, or None if the image is empty
+    """
+    planes = np.zeros(image.shape[0], dtype=bool)
+    projection = np.zeros(image.shape[1:], dtype=bool)
+    for chunk in chunk_slices(image, chunk_size):
+        data = np.asarray(image[chunk])
+        chunk_planes = data.reshape(len(data), -1).any(axis=1)
+        planes[chunk] = chunk_planes
+        if chunk_planes.any():
+            projection |= data[chunk_planes].any(axis=0)
+
+    if not planes.any():
+        return None
+    bounding_box = []
+    for axis_nonzero in [planes] + [
+        projection.any(
+            axis=tuple(i for i in range(projection.ndim) if i != axis)
+        )
+        for axis in range(projection.ndim)
+    ]:
+        indices = np.flatnonzero(axis_nonzero)
+        bounding_box.append(slice(indices[0], indices[-1] + 1))
+    return tuple(bounding_box)
+
+
+def get_image_hash(image, chunk_size=CHUNK_SIZE):
+    """
+    Hash the contents of an image, one chunk at a time
+    :param image: Image (numpy, dask, zarr or other array)
+    :param chunk_size: Number of planes to hash at once
+    :return: Hexadecimal string
+    """
+    image_hash = hashlib.blake2b(digest_size=16)
+    image_hash.update(str((image.shape, str(image.dtype))).encode())
+    for chunk in chunk_slices(image, chunk_size):
+        image_hash.update(np.ascontiguousarray(image[chunk]).data)
+    return image_hash.hexdigest()
@@ -0,0 +1,371 @@
+import json
+import os
+import shutil
+import struct
+import itertools
+
+import numpy as np
+
+from pathlib import Path
+from concurrent.futures import ThreadPoolExecutor
+
+from brainreg_segment.manifest import connect_undo_redo
+
+# Size (in voxels, along each axis) of the blocks of labels layers that are
+# journaled when any voxel within them is painted
+JOURNAL_BLOCK_SIZE = 64
+
+# Each record is the length of its (JSON) header and of its data, the header,
+# then the data
+RECORD_LENGTHS = struct.Struct("<II")
+
+
+class Journal:
+    """
+    Append-only log of changes to label and track layers, so that unsaved
+    segmentation can be recovered after a crash.
+
+    Painting a labels layer marks the blocks of the layer that it touches
+    (found from the napari paint event) as changed, as does undoing or
+    redoing a change, and changing the data of a layer marks the whole layer
+    as changed. Each autosave then appends only
+    the changed blocks, and changed tracks (which are small, so are journaled
+    in full), to the journal. Only copying the changed data is done by the
+    caller, the journal is written in a background thread.
+
+    :param journal_file: Journal file (created when first written to)
+    :param block_size: Size of the journaled blocks of labels layers
+    """
+
+    def __init__(self, journal_file, block_size=JOURNAL_BLOCK_SIZE):
+        self.journal_file = Path(journal_file)
+        self.block_size = block_size
+        # Changed layers and blocks, keyed by the id of the layer
+        self._changed_layers = {}
+        self._changed_blocks = {}
+        # Positions (in bytes written since the journal was opened, only
+        # used by the background thread) of the end of the journal, and of
+        # the start of the journal file, which moves as records are removed
+        self._end = (
+            self.journal_file.stat().st_size
+            if self.journal_file.exists()
+            else 0
+        )
+        self._start = 0
+        self._executor = ThreadPoolExecutor(max_workers=1)
+
+    def watch(self, layer):
+        """
+        Record changes to a napari labels or points layer
+        :param layer: napari layer
+        """
+        layer.events.data.connect(lambda event: self.mark_changed(layer))
+        if hasattr(layer.events, "paint"):
+            layer.events.paint.connect(
+                lambda event: self.mark_painted(layer, event.value)
+            )
+        connect_undo_redo(
+            layer, lambda method_name: self.mark_undone(layer, method_name)
+        )
+
+    def mark_changed(self, layer):
+        """
+        Mark the whole of a layer as changed
+        :param layer: napari layer
+        """
+        self._changed_layers[id(layer)] = layer
+
+    def mark_painted(self, layer, paint_history):
+        """
+        Mark the blocks of a labels layer touched by a paint event as changed
+        :param layer: napari labels layer
+        :param paint_history: Value of the napari paint event
+        """
+        _, blocks = self._changed_blocks.setdefault(id(layer), (layer, set()))
+        for atom in paint_history:
+            bounding_box = get_painted_bounding_box(atom)
+            if bounding_box is None:
+                self.mark_changed(layer)
+            else:
+                blocks.update(get_blocks(bounding_box, self.block_size))
+
+    def mark_undone(self, layer, method_name):
+        """
+        Mark the blocks of a labels layer changed by undo or redo as changed.
+        These are found from the napari undo history if possible, otherwise
+        the whole layer is marked as changed.
+        :param layer: napari labels layer
+        :param method_name: "undo" or "redo"
+        """
+        # Undone changes are moved to the redo history, and vice versa
+        history = getattr(
+            layer,
+            "_redo_history" if method_name == "undo" else "_undo_history",
+            None,
+        )
+        if history is None:
+            self.mark_changed(layer)
+        elif len(history):
+            try:
+                changes = list(history[-1])
+            except TypeError:
+                self.mark_changed(layer)
+            else:
+                self.mark_painted(layer, changes)
+
+    def autosave(self, label_layers, track_layers):
+        """
+        Append the changes to the given layers since the last autosave to the
+        journal (in a background thread). Changes to other layers are ignored.
+        :param label_layers: List of napari labels layers
+        :param track_layers: List of napari points layers
+        """
+        changed_layers = self._changed_layers
+        changed_blocks = self._changed_blocks
+        self._changed_layers = {}
+        self._changed_blocks = {}
+
+        records = []
+        for layer in label_layers:
+            if id(layer) in changed_layers:
+                records.append(labels_record(layer, (0,) * layer.ndim))
+            elif id(layer) in changed_blocks:
+                for block in sorted(changed_blocks[id(layer)][1]):
+                    start = tuple(i * self.block_size for i in block)
+                    records.append(
+                        labels_record(layer, start, self.block_size)
+                    )
+        for layer in track_layers:
+            if id(layer) in changed_layers:
+                records.append(points_record(layer))
+
+        if records:
+            self._executor.submit(self._append, records)
+
+    def checkpoint(self):
+        """
+        Mark the end of the journal (e.g. when the layers start being
+        saved), once any pending autosave has been written
+        :return: Future of the position of the checkpoint, to be passed to
+        clear
+        """
+        return self._executor.submit(lambda: self._end)
+
+    def clear(self, checkpoint=None):
+        """
+        Remove the records before a checkpoint (e.g. once the layers have been
+        saved, keeping changes autosaved while they were being saved), or
+        empty the journal, once any pending autosave has been written
+        :param checkpoint: Future returned by checkpoint, or None to remove
+        all records
+        """
+        self._executor.submit(self._remove_records, checkpoint)
+
+    def wait(self):
+        """
+        Wait until all pending autosaves have been written
+        """
+        self._executor.submit(lambda: None).result()
+
+    def close(self):
+        self._executor.shutdown(wait=True)
+
+    def _append(self, records):
+        self._end += append_records(self.journal_file, records)
+
+    def _remove_records(self, checkpoint):
+        position = self._end if checkpoint is None else checkpoint.result()
+        if position <= self._start:
+            return
+        if position >= self._end:
+            remove_journal(self.journal_file)
+        else:
+            remove_journal_start(self.journal_file, position - self._start)
+        self._start = position
+
+
+def get_painted_bounding_box(atom):
+    """
+    Find the bounding box of one change in a napari paint event. Depending on
+    the version of napari, a change has a slice_key attribute, or is a tuple
+    of (indices, old values, new value).
+    :return: Tuple of slice objects, or None if not recognised
+    """
+    slice_key = getattr(atom, "slice_key", None)
+    if slice_key is not None:
+        return tuple(slice_key)
+    try:
+        indices = [np.asarray(axis_indices) for axis_indices in atom[0]]
+    except (TypeError, IndexError, KeyError):
+        return None
+    if not indices or not all(axis_indices.size for axis_indices in indices):
+        return None
+    return tuple(
+        slice(int(axis_indices.min()), int(axis_indices.max()) + 1)
+        for axis_indices in indices
+    )
+
+
+def get_blocks(bounding_box, block_size):
+    """
+    Find the blocks (of a regular grid) that a bounding box overlaps
+    :param bounding_box: Tuple of slice objects
+    :param block_size: Size of the blocks
+    :return: Iterator of tuples of block indices
+    """
+    return itertools.product(
+        *[
+            range(
+                axis_slice.start // block_size,
+                (axis_slice.stop - 1) // block_size + 1,
+            )
+            for axis_slice in bounding_box
+        ]
+    )
+
+
+def labels_record(layer, start, block_size=None):
+    """
+    Make a journal record of a block of a labels layer
+    :param layer: napari labels layer
+    :param start: Position of the block within the layer
+    :param block_size: Size of the block, or None for the whole layer
+    :return: Tuple of (header, data)
+    """
+    shape = layer.data.shape
+    block = tuple(
+        slice(i, None if block_size is None else i + block_size) for i in start
+    )
+    data = np.array(layer.data[block])
+    header = {
+        "type": "labels",
+        "name": layer.name,
+        "shape": list(shape),
+        "dtype": data.dtype.str,
+        "start": list(start),
+        "block_shape": list(data.shape),
+    }
+    return header, data
+
+
+def points_record(layer):
+    """
+    Make a journal record of (all the points of) a points layer
+    :param layer: napari points layer
+    :return: Tuple of (header, data)
+    """
+    data = np.array(layer.data, dtype=np.float64)
+    header = {
+        "type": "points",
+        "name": layer.name,
+        "dtype": data.dtype.str,
+        "block_shape": list(data.shape),
+    }
+    return header, data
+
+
+def append_records(journal_file, records):
+    """
+    Append records to a journal, and make sure they are written to disk
+    :param journal_file: Journal file
+    :param records: List of (header, data) tuples
+    :return: Number of bytes appended
+    """
+    journal_file.parent.mkdir(parents=True, exist_ok=True)
+    with open(journal_file, "ab") as f:
+        start = f.tell()
+        for header, data in records:
+            header = json.dumps(header).encode()
+            data = np.ascontiguousarray(data).tobytes()
+            f.write(RECORD_LENGTHS.pack(len(header), len(data)))
+            f.write(header)
+            f.write(data)
+        f.flush()
+        os.fsync(f.fileno())
+        return f.tell() - start
+
+
+def remove_journal(journal_file):
+    if journal_file.exists():
+        journal_file.unlink()
+
+
+def remove_journal_start(journal_file, size):
+    """
+    Remove the start of a journal. The rest is written under a temporary
+    name first, so an interruption doesn't lose it.
+    :param journal_file: Journal file
+    :param size: Number of bytes to remove (the start of a record)
+    """
+    temporary_file = journal_file.with_suffix(".tmp")
+    with open(journal_file, "rb") as f, open(temporary_file, "wb") as rest:
+        f.seek(size)
+        shutil.copyfileobj(f, rest)
+        rest.flush()
+        os.fsync(rest.fileno())
+    temporary_file.replace(journal_file)
+
+
+def read_journal(journal_file):
+    """
+    Read the records of a journal. An incomplete final record (e.g. if
+    writing it was interrupted) is ignored.
+    :param journal_file: Journal file
+    :return: Generator of (header, data) tuples
+    """
+    with open(journal_file, "rb") as f:
+        while True:
+            lengths = f.read(RECORD_LENGTHS.size)
+            if len(lengths) < RECORD_LENGTHS.size:
+                return
+            header_length, data_length = RECORD_LENGTHS.unpack(lengths)
+            header = f.read(header_length)
+            data = f.read(data_length)
+            if len(header) < header_length or len(data) < data_length:
+                return
+            header = json.loads(header)
+            data = np.frombuffer(data, dtype=header["dtype"]).reshape(
+                header["block_shape"]
+            )
+            yield header, data
+
+
+def recover_journal(journal_file):
+    """
+    Replay a journal, to find the changes to each layer since it was last
+    saved
+    :param journal_file: Journal file
+    :return: Tuple of dictionaries, keyed by layer name. The first of the
+    changes to labels layers, as (shape, dtype, blocks), where blocks is a
+    list of (position, data) in the order they should be applied. The second
+    of the points of points layers.
+    """
+    labels = {}
+    points = {}
+    if not Path(journal_file).exists():
+        return labels, points
+
+    for header, data in read_journal(journal_file):
+        if header["type"] == "labels":
+            shape = tuple(header["shape"])
+            if (
+                header["name"] not in labels
+                or labels[header["name"]][0] != shape
+            ):
+                labels[header["name"]] = (shape, data.dtype, [])
+            labels[header["name"]][2].append((tuple(header["start"]), data))
+        elif header["type"] == "points":
+            points[header["name"]] = data
+    return labels, points
+
+
+def apply_blocks(image, blocks):
+    """
+    Apply journaled blocks to an image
+    :param image: Image (modified in place)
+    :param blocks: List of (position, data) tuples
+    """
+    for start, data in blocks:
+        image[
+            tuple(slice(i, i + size) for i, size in zip(start, data.shape))
+        ] = data
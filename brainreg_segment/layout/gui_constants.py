@@ -6,6 +6,9 @@ COLUMN_WIDTH = 150
 DISPLAY_REGION_INFO = (
     True  # Display brain region info string in bottom right corner
 )
+# Minimum time (ms) between updates of the brain region info (about once
+# per frame at 60Hz), however fast the mouse moves
+REGION_INFO_INTERVAL = 16
 
 LOADING_PANEL_ALIGN = (
     "left"  # Alignment of text in pushbuttons in loading panel
@@ -25,9 +28,36 @@ FIT_DEGREE_DEFAULT = 3
 SUMMARISE_TRACK_DEFAULT = True
 CALCULATE_VOLUMES_DEFAULT = True
 SUMMARIZE_VOLUMES_DEFAULT = True
+ROLL_UP_VOLUMES_DEFAULT = False
+
+# Processes used to export regions to brainrender (None: one per CPU)
+EXPORT_N_WORKERS = None
+# Format of exported region meshes (".obj", or ".ply" for binary PLY)
+REGION_MESH_EXT = ".obj"
+# Marching cubes step size of exported region meshes, and of any additional,
+# coarser meshes (levels of detail), e.g. (2, 4)
+REGION_MESH_STEP_SIZE = 1
+REGION_MESH_LOD_STEP_SIZES = ()
+
+# Whether saved regions and tracks are loaded in the background when opening
+# a brainreg directory, so they can be segmented straight away
+LOAD_IN_BACKGROUND = False
+# Number of region files read at once when loading in the background
+# (None for the ThreadPoolExecutor default)
+LOAD_N_THREADS = None
+
+# Seconds between autosaves of changes to regions and tracks (None: never)
+AUTOSAVE_INTERVAL = 60
 
 TRACK_FILE_EXT = ".points"
+# Format of saved regions (".tiff", ".zarr" for compressed, chunked arrays,
+# or ".npz" for a sparse format), and the compression of .tiff files
+# (e.g. "zlib")
 IMAGE_FILE_EXT = ".tiff"
+IMAGE_COMPRESSION = None
+# Whether saved regions are read from disk only as they are viewed. Lazily
+# loaded regions can't be edited.
+LOAD_REGIONS_LAZILY = False
 BOUNDARIES_STRING = "Boundaries"
 
 # ORIENTATIONS = [
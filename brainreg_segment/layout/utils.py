@@ -2,8 +2,6 @@
 # import napari
 from napari.viewer import Viewer
 
-import bg_space as bg
-
 # from brainreg_segment.layout.gui_constants import ORIENTATIONS
 
 from qtpy.QtWidgets import QMessageBox
@@ -44,6 +42,8 @@ def disable_napari_key_bindings():
 
 def get_dims_from_origins(origins):
     """ From a list of BG space abbreviations (e.g. ["asl","sla","lsa"]) get correct axes for display in Napari """
+    import bg_space as bg
+
     all_dims = []
     for o in range(len(origins)):
         sc = bg.AnatomicalSpace(origins[0])
@@ -0,0 +1,173 @@
+import json
+import weakref
+
+from pathlib import Path
+from functools import partial
+
+from brainreg_segment.image.utils import get_image_hash
+
+# Each directory of saved layers has a manifest of the files in it, with a
+# hash of the layer data that was saved, so unchanged layers aren't saved again
+MANIFEST_FILE_NAME = "manifest.json"
+
+# Keys (in the layer metadata) marking that changes to the layer data are
+# tracked, and of the hash of the layer data when it was last loaded or saved
+# (removed whenever the layer data is changed)
+TRACKED_KEY = "brainreg_segment_track_changes"
+SAVED_HASH_KEY = "brainreg_segment_saved_hash"
+
+# Functions called when each layer is changed by undo or redo
+_undo_redo_callbacks = weakref.WeakKeyDictionary()
+
+
+def track_changes(layer):
+    """
+    Forget that a layer is saved whenever its data is changed
+    :param layer: napari labels or points layer
+    """
+    # Painting a labels layer changes the data in place, so if this version
+    # of napari has no paint event, changes can't be tracked
+    if (
+        hasattr(layer, "paint")
+        and getattr(layer.events, "paint", None) is None
+    ):
+        return
+
+    def mark_changed(event=None):
+        mark_unsaved(layer)
+
+    layer.events.data.connect(mark_changed)
+    if hasattr(layer.events, "paint"):
+        layer.events.paint.connect(mark_changed)
+    connect_undo_redo(layer, mark_changed)
+    layer.metadata[TRACKED_KEY] = True
+
+
+def connect_undo_redo(layer, callback):
+    """
+    Call a function whenever a napari labels layer is changed by undo or
+    redo. Unlike painting, these emit no event of their own (set_data is
+    also emitted whenever the layer is redrawn), so the undo and redo
+    methods of the layer are wrapped. They are only wrapped once, however
+    many functions are connected.
+    :param layer: napari labels (or other) layer. Layers without undo and
+    redo are ignored.
+    :param callback: Called with "undo" or "redo", after the layer is
+    changed
+    """
+    callbacks = _undo_redo_callbacks.get(layer)
+    if callbacks is None:
+        callbacks = _undo_redo_callbacks[layer] = []
+        for method_name in ("undo", "redo"):
+            method = getattr(layer, method_name, None)
+            if method is not None:
+                setattr(
+                    layer,
+                    method_name,
+                    partial(call_undo_redo, method, method_name, callbacks),
+                )
+    callbacks.append(callback)
+
+
+def call_undo_redo(method, method_name, callbacks):
+    method()
+    for callback in callbacks:
+        callback(method_name)
+
+
+def mark_unsaved(layer):
+    """
+    Forget that a layer is saved, e.g. if its data is changed without an event
+    :param layer: napari labels or points layer
+    """
+    layer.metadata.pop(SAVED_HASH_KEY, None)
+
+
+def load_manifest(directory):
+    """
+    :param directory: Directory of saved layers
+    :return: Dictionary of manifest entries, keyed by file name
+    """
+    manifest_file = Path(directory) / MANIFEST_FILE_NAME
+    if not manifest_file.exists():
+        return {}
+    with open(manifest_file) as f:
+        return json.load(f)
+
+
+def save_manifest(directory, manifest):
+    with open(Path(directory) / MANIFEST_FILE_NAME, "w") as f:
+        json.dump(manifest, f, indent=4)
+
+
+def is_saved(layer, filename, manifest):
+    """
+    Check whether a layer is already saved (unchanged) in a file. The layer
+    data is only hashed if it may have changed since it was last loaded or
+    saved.
+    :param layer: napari labels or points layer
+    :param filename: File the layer is saved to
+    :param manifest: Manifest of the directory of the file
+    :return: Tuple (saved, hash), where hash is the hash of the layer data,
+    or None if it wasn't needed
+    """
+    entry = manifest.get(Path(filename).name)
+    if entry is None or not is_unchanged_on_disk(filename, entry):
+        return False, None
+    if layer.metadata.get(SAVED_HASH_KEY) == entry["hash"]:
+        return True, entry["hash"]
+
+    layer_hash = get_image_hash(layer.data)
+    return layer_hash == entry["hash"], layer_hash
+
+
+def record_saved(layer, filename, manifest, layer_hash=None):
+    """
+    Add a newly saved file to the manifest
+    :param layer: napari labels or points layer that was saved
+    :param filename: File the layer was saved to
+    :param manifest: Manifest of the directory of the file
+    :param layer_hash: Hash of the layer data, if already calculated
+    """
+    if layer_hash is None:
+        layer_hash = get_image_hash(layer.data)
+    manifest[Path(filename).name] = dict(
+        hash=layer_hash, **get_file_stats(filename)
+    )
+    if layer.metadata.get(TRACKED_KEY):
+        layer.metadata[SAVED_HASH_KEY] = layer_hash
+
+
+def record_loaded(layer, filename):
+    """
+    Record that a layer was loaded from a file, so that it isn't saved again
+    unless it is changed
+    :param layer: napari labels or points layer
+    :param filename: File the layer was loaded from
+    """
+    entry = load_manifest(Path(filename).parent).get(Path(filename).name)
+    if (
+        entry is not None
+        and is_unchanged_on_disk(filename, entry)
+        and layer.metadata.get(TRACKED_KEY)
+    ):
+        layer.metadata[SAVED_HASH_KEY] = entry["hash"]
+
+
+def get_file_stats(filename):
+    """
+    Get the size and modification time of a file (or directory, e.g. .zarr)
+    """
+    stat = Path(filename).stat()
+    return {"size": stat.st_size, "mtime_ns": stat.st_mtime_ns}
+
+
+def is_unchanged_on_disk(filename, entry):
+    """
+    Check whether a file exists, and hasn't been changed since it was added
+    to the manifest
+    """
+    return Path(filename).exists() and get_file_stats(filename) == {
+        "size": entry["size"],
+        "mtime_ns": entry["mtime_ns"],
+    }
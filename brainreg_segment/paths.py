@@ -25,6 +25,7 @@ class Paths:
         self.region_summary_csv = self.regions_directory / "summary.csv"
 
         self.tracks_directory = self.join_seg_files("tracks")
+        self.journal_file = self.join_seg_files("autosave.journal")
 
     def join_seg_files(self, filename):
         return self.segmentation_directory / filename
@@ -1,7 +1,12 @@
 from napari_plugin_engine import napari_hook_implementation
-from brainreg_segment.segment import SegmentationWidget
 
 
 @napari_hook_implementation
 def napari_experimental_provide_dock_widget():
+    # Only imported when napari asks for the widget, so that discovering the
+    # plugin doesn't import the widget's dependencies. Within the widget,
+    # heavy dependencies (e.g. bg_atlasapi, pandas, scikit-image) are also
+    # only imported by the functions that use them.
+    from brainreg_segment.segment import SegmentationWidget
+
     return SegmentationWidget, {"name": "Manual segmentation"}
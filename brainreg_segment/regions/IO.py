@@ -1,11 +1,43 @@
-import imio
+import zarr
+import shutil
+import tifffile
+import multiprocessing
 import numpy as np
 
 from pathlib import Path
+from functools import partial
+from concurrent.futures import ProcessPoolExecutor, as_completed
+from scipy import ndimage
 from skimage import measure
 
 from imlib.general.pathlib import append_to_pathlib_stem
 
+from brainreg_segment.manifest import (
+    is_saved,
+    load_manifest,
+    record_saved,
+    save_manifest,
+)
+
+from brainreg_segment.image.utils import (
+    CHUNK_SIZE,
+    chunk_slices,
+    get_bounding_box,
+    is_empty,
+)
+
+# Background voxels (per step of marching cubes) kept around an object when it
+# is cropped for meshing. Two keep the gradients at the surface, and so the
+# normals, the same as when meshing the whole image.
+CROP_PADDING = 2
+
+# Number of vertices, normals or faces written to a mesh file at once
+MESH_WRITE_CHUNK = 100_000
+
+# Size of the chunks of regions saved as .zarr, in the last two dimensions
+# (the first is the number of planes written at once)
+ZARR_CHUNK_SIDE = 256
+
 
 def convert_obj_to_br(verts, faces, voxel_size):
     if voxel_size != 1:
@@ -16,15 +48,135 @@ def convert_obj_to_br(verts, faces, voxel_size):
 
 
 def extract_and_save_object(
-    image, output_file_name, voxel_size, threshold=0, step_size=1
+    image,
+    output_file_name,
+    voxel_size,
+    threshold=0,
+    step_size=1,
+    lod_step_sizes=(),
+    offset=None,
 ):
-    verts, faces, normals, values = measure.marching_cubes(
-        image, threshold, step_size=step_size
+    """
+    Mesh an object with marching cubes, and save it as .obj (or binary .ply)
+    :param image: Image of the object
+    :param output_file_name: Where to save the mesh
+    :param voxel_size: Size of the voxels (to scale the mesh)
+    :param threshold: Value that the object is above
+    :param step_size: Step size (in voxels) of marching cubes
+    :param lod_step_sizes: Step sizes of additional, coarser meshes (levels
+    of detail). These are saved with the step size appended to the file name
+    (e.g. "region_step4.obj"), and skipped if the object is too small to be
+    found with that step size.
+    :param offset: Position of the image within a larger image (e.g. if it
+    has been cropped), that the mesh is positioned in
+    """
+    image = np.asarray(image)
+    bounding_box = find_object(image, threshold=threshold)
+
+    verts, faces, normals, values = mesh_object(
+        image,
+        bounding_box,
+        threshold=threshold,
+        step_size=step_size,
+        offset=offset,
+    )
+    save_mesh((verts, faces, normals, values), output_file_name, voxel_size)
+
+    for lod_step_size in lod_step_sizes:
+        filename = get_lod_file_name(output_file_name, lod_step_size)
+        try:
+            mesh = mesh_object(
+                image,
+                bounding_box,
+                threshold=threshold,
+                step_size=lod_step_size,
+                offset=offset,
+            )
+        except RuntimeError:
+            print(f"No surface found with step size {lod_step_size}")
+            continue
+        save_mesh(mesh, filename, voxel_size)
+
+
+def get_lod_file_name(filename, step_size):
+    return append_to_pathlib_stem(Path(filename), f"_step{step_size}")
+
+
+def mesh_object(image, bounding_box, threshold=0, step_size=1, offset=None):
+    """
+    Run marching cubes on the (padded) bounding box of an object
+    :param image: Image of the object
+    :param bounding_box: Bounding box of the object (from find_object)
+    :param threshold: Value that the object is above
+    :param step_size: Step size (in voxels) of marching cubes
+    :param offset: Position of the image within a larger image
+    :return: Output of skimage.measure.marching_cubes, with the vertices in
+    the coordinates of the whole (or larger) image
+    """
+    bounding_box = pad_bounding_box(
+        bounding_box, image.shape, step_size=step_size
     )
-    verts, faces = convert_obj_to_br(verts, faces, voxel_size)
-    marching_cubes_to_obj(
-        (verts, faces, normals, values), str(output_file_name)
+    verts, faces, normals, values = measure.marching_cubes(
+        image[bounding_box], threshold, step_size=step_size
     )
+    verts += np.array([s.start for s in bounding_box], dtype=verts.dtype)
+    if offset is not None:
+        verts += np.array(offset, dtype=verts.dtype)
+    return verts, faces, normals, values
+
+
+def save_mesh(marching_cubes_out, output_file_name, voxel_size):
+    """
+    Save the output of marching cubes for brainrender, as binary PLY if the
+    file name ends in .ply, otherwise as .obj
+    """
+    verts, faces, normals, values = marching_cubes_out
+    if Path(output_file_name).suffix == ".ply":
+        marching_cubes_to_ply(
+            (verts * voxel_size, faces, normals, values), output_file_name
+        )
+    else:
+        verts, faces = convert_obj_to_br(verts, faces, voxel_size)
+        marching_cubes_to_obj(
+            (verts, faces, normals, values), str(output_file_name)
+        )
+
+
+def find_object(image, threshold=0):
+    """
+    Find the bounding box of all values of an image above a threshold
+    :param image: Image
+    :param threshold: Value that the object is above
+    :return: Tuple of slice objects, or None if there are no such values
+    """
+    above_threshold = np.asarray(image) > threshold
+    objects = ndimage.find_objects(above_threshold.view(np.uint8))
+    return objects[0] if objects else None
+
+
+def pad_bounding_box(bounding_box, shape, step_size=1, padding=CROP_PADDING):
+    """
+    Pad a bounding box (within the image shape) for meshing. The start is
+    aligned to the step size, so that marching cubes samples the same voxels
+    as it would across the whole image.
+    :param bounding_box: Tuple of slice objects (e.g. from
+    scipy.ndimage.find_objects). If None, the whole image is used.
+    :param shape: Shape of the image
+    :param step_size: Step size (in voxels) of marching cubes
+    :param padding: Number of steps to pad by, on each side
+    :return: Tuple of slice objects
+    """
+    if bounding_box is None:
+        return tuple(slice(0, length) for length in shape)
+
+    padding = padding * step_size
+    padded = []
+    for axis_slice, length in zip(bounding_box, shape):
+        start = max(axis_slice.start - padding, 0)
+        start = start - start % step_size
+        stop = min(axis_slice.stop + padding, length)
+        padded.append(slice(start, stop))
+    return tuple(padded)
 
 
 def marching_cubes_to_obj(marching_cubes_out, output_file):
@@ -36,16 +188,66 @@ def marching_cubes_to_obj(marching_cubes_out, output_file):
 
     verts, faces, normals, _ = marching_cubes_out
     with open(output_file, "w") as f:
-        for item in verts:
-            f.write(f"v {item[0]} {item[1]} {item[2]}\n")
-        for item in normals:
-            f.write(f"vn {item[0]} {item[1]} {item[2]}\n")
-        for item in faces:
-            f.write(
-                f"f {item[0]}//{item[0]} {item[1]}//{item[1]} "
-                f"{item[2]}//{item[2]}\n"
-            )
-        f.close()
+        write_rows(f, "v %s %s %s\n", verts)
+        write_rows(f, "vn %s %s %s\n", normals)
+        write_rows(f, "f %s//%s %s//%s %s//%s\n", faces[:, [0, 0, 1, 1, 2, 2]])
+
+
+def write_rows(file, row_format, array, chunk_size=MESH_WRITE_CHUNK):
+    """
+    Write each row of a 2D array to a text file, formatting many rows at
+    once. Each value is formatted as str() would, but only once per unique
+    value, as mesh coordinates repeat a lot.
+    :param file: Open (text) file object
+    :param row_format: printf-style format string for one row, with one %s
+    per column
+    :param array: 2D numpy array
+    :param chunk_size: Number of rows written at once
+    """
+    if not len(array):
+        return
+    unique, inverse = np.unique(array, return_inverse=True)
+    strings = np.array([str(value) for value in unique.tolist()], dtype=object)
+    strings = strings[inverse.reshape(array.shape)]
+    for start in range(0, len(strings), chunk_size):
+        chunk = strings[start : start + chunk_size]
+        file.write((row_format * len(chunk)) % tuple(chunk.ravel().tolist()))
+
+
+def marching_cubes_to_ply(marching_cubes_out, output_file):
+    """
+    Saves the output of skimage.measure.marching_cubes as a (binary, little
+    endian) .ply file, which is much smaller and faster to read and write
+    than an .obj file
+    :param marching_cubes_out: tuple
+    :param output_file: str
+    """
+    verts, faces, normals, _ = marching_cubes_out
+    vertex_data = np.empty(len(verts), dtype="<f4, <f4, <f4, <f4, <f4, <f4")
+    vertex_data.view("<f4").reshape(-1, 6)[:] = np.hstack((verts, normals))
+    face_data = np.empty(len(faces), dtype="u1, <i4, <i4, <i4")
+    face_data["f0"] = 3
+    for i in range(3):
+        face_data[f"f{i + 1}"] = faces[:, i]
+
+    header = (
+        "ply\n"
+        "format binary_little_endian 1.0\n"
+        f"element vertex {len(verts)}\n"
+        "property float x\n"
+        "property float y\n"
+        "property float z\n"
+        "property float nx\n"
+        "property float ny\n"
+        "property float nz\n"
+        f"element face {len(faces)}\n"
+        "property list uchar int vertex_indices\n"
+        "end_header\n"
+    )
+    with open(output_file, "wb") as f:
+        f.write(header.encode("ascii"))
+        f.write(vertex_data.tobytes())
+        f.write(face_data.tobytes())
 
 
 def volume_to_vector_array_to_obj_file(
@@ -55,21 +257,20 @@ def volume_to_vector_array_to_obj_file(
     step_size=1,
     threshold=0,
     deal_with_regions_separately=False,
+    lod_step_sizes=(),
+    n_workers=1,
 ):
     if deal_with_regions_separately:
-        for label_id in np.unique(image):
-            if label_id != 0:
-                filename = append_to_pathlib_stem(
-                    Path(output_path), "_" + str(label_id)
-                )
-                image = image == label_id
-                extract_and_save_object(
-                    image,
-                    filename,
-                    voxel_size,
-                    threshold=threshold,
-                    step_size=step_size,
-                )
+        exports = get_label_exports(
+            image,
+            output_path,
+            voxel_size,
+            step_size=step_size,
+            threshold=threshold,
+            lod_step_sizes=lod_step_sizes,
+        )
+        for _ in run_exports(exports, n_workers=n_workers):
+            pass
     else:
         extract_and_save_object(
             image,
@@ -77,24 +278,244 @@ def volume_to_vector_array_to_obj_file(
             voxel_size,
             threshold=threshold,
             step_size=step_size,
+            lod_step_sizes=lod_step_sizes,
+        )
+
+
+def get_label_exports(
+    image,
+    output_path,
+    voxel_size,
+    step_size=1,
+    threshold=0,
+    lod_step_sizes=(),
+):
+    """
+    List the meshes to export for each label value of an image, each
+    cropped to the bounding box of the label. The bounding boxes of all
+    labels are found in a single pass over the image.
+    :param image: Image of (non-negative, integer) labels
+    :param output_path: File name, to which "_<label value>" is appended
+    :return: List of (label value, function) tuples. Each function (which
+    can be sent to another process) exports one label.
+    """
+    image = np.asarray(image)
+    exports = []
+    for label_id, bounding_box in enumerate(ndimage.find_objects(image), 1):
+        if bounding_box is None:
+            continue
+        crop = get_export_crop(
+            bounding_box,
+            image.shape,
+            step_size=step_size,
+            lod_step_sizes=lod_step_sizes,
+        )
+        export = partial(
+            extract_and_save_object,
+            image[crop] == label_id,
+            append_to_pathlib_stem(Path(output_path), "_" + str(label_id)),
+            voxel_size,
+            threshold=threshold,
+            step_size=step_size,
+            lod_step_sizes=lod_step_sizes,
+            offset=[axis_slice.start for axis_slice in crop],
         )
+        exports.append((label_id, export))
+    return exports
 
 
-def save_label_layers(regions_directory, label_layers):
+def get_export_crop(bounding_box, shape, step_size=1, lod_step_sizes=()):
+    """
+    Pad the bounding box of an object, so that the object can be cropped to
+    it before being sent to be exported. The crop includes the padding and
+    alignment (see pad_bounding_box) of every level of detail.
+    :param bounding_box: Tuple of slice objects, or None for the whole image
+    :param shape: Shape of the image
+    :param step_size: Step size (in voxels) of marching cubes
+    :param lod_step_sizes: Step sizes of any levels of detail
+    :return: Tuple of slice objects
+    """
+    step_sizes = (step_size,) + tuple(lod_step_sizes)
+    alignment = np.lcm.reduce(step_sizes)
+    padding = -(-CROP_PADDING * max(step_sizes) // alignment)
+    return pad_bounding_box(
+        bounding_box, shape, step_size=alignment, padding=padding
+    )
+
+
+def run_exports(exports, n_workers=None):
+    """
+    Run exports, in a pool of processes
+    :param exports: List of (name, function) tuples
+    :param n_workers: Maximum number of processes. If None, one per CPU.
+    If 1, the exports are run in this process.
+    :return: Generator of (number of exports run, total number of exports,
+    name) tuples, one as each export finishes
+    """
+    if n_workers == 1:
+        for n_exported, (name, export) in enumerate(exports, 1):
+            export()
+            yield n_exported, len(exports), name
+        return
+
+    # Meshing holds the GIL, so use processes rather than threads
+    with ProcessPoolExecutor(
+        max_workers=n_workers, mp_context=multiprocessing.get_context("spawn")
+    ) as executor:
+        futures = {executor.submit(export): name for name, export in exports}
+        for n_exported, future in enumerate(as_completed(futures), 1):
+            future.result()
+            yield n_exported, len(futures), futures[future]
+
+
+def save_label_layers(
+    regions_directory, label_layers, image_extension=".tiff", compression=None
+):
+    """
+    Saves the segmented regions to file, skipping any that are already saved
+    (unchanged) according to the manifest of the regions directory
+    """
     print(f"Saving regions to: {regions_directory}")
     regions_directory.mkdir(parents=True, exist_ok=True)
+    manifest = load_manifest(regions_directory)
     for label_layer in label_layers:
-        save_regions_to_file(label_layer, regions_directory)
+        filename = regions_directory / (label_layer.name + image_extension)
+        saved, layer_hash = is_saved(label_layer, filename, manifest)
+        if saved:
+            continue
+
+        filename = save_regions_to_file(
+            label_layer,
+            regions_directory,
+            image_extension=image_extension,
+            compression=compression,
+        )
+        if filename is not None:
+            record_saved(label_layer, filename, manifest, layer_hash)
+    save_manifest(regions_directory, manifest)
 
 
 def export_label_layers(
-    regions_directory, label_layers, voxel_size, obj_ext=".obj"
+    regions_directory,
+    label_layers,
+    voxel_size,
+    obj_ext=".obj",
+    deal_with_regions_separately=False,
+    step_size=1,
+    lod_step_sizes=(),
+    n_workers=None,
+):
+    for _ in iter_export_label_layers(
+        regions_directory,
+        label_layers,
+        voxel_size,
+        obj_ext=obj_ext,
+        deal_with_regions_separately=deal_with_regions_separately,
+        step_size=step_size,
+        lod_step_sizes=lod_step_sizes,
+        n_workers=n_workers,
+    ):
+        pass
+
+
+def iter_export_label_layers(
+    regions_directory,
+    label_layers,
+    voxel_size,
+    obj_ext=".obj",
+    deal_with_regions_separately=False,
+    step_size=1,
+    lod_step_sizes=(),
+    n_workers=None,
 ):
+    """
+    Export regions as .obj for brainrender, meshing the regions in a pool
+    of processes
+    :param regions_directory: Where to save the files to
+    :param label_layers: napari labels layers (with segmented regions)
+    :param voxel_size: Size of the voxels (to scale the meshes)
+    :param obj_ext: File extension of the meshes, ".obj", or ".ply" for
+    (smaller, faster) binary PLY files
+    :param deal_with_regions_separately: If True, export each label value
+    of each layer to a separate file
+    :param step_size: Step size (in voxels) of marching cubes. Larger steps
+    give coarser meshes, with roughly step_size ** 2 times fewer triangles.
+    :param lod_step_sizes: Step sizes of additional, coarser meshes (levels
+    of detail) to save for each region, e.g. (2, 4). These are saved as
+    e.g. "region_step4.obj".
+    :param n_workers: Maximum number of processes. If None, one per CPU.
+    If 1, regions are exported in this process.
+    :return: Generator of (number of regions exported, total number of
+    regions, name) tuples, one as each region is exported
+    """
     print(f"Exporting regions to: {regions_directory}")
     regions_directory.mkdir(parents=True, exist_ok=True)
+
+    exports = get_region_exports(
+        regions_directory,
+        label_layers,
+        voxel_size,
+        obj_ext=obj_ext,
+        deal_with_regions_separately=deal_with_regions_separately,
+        step_size=step_size,
+        lod_step_sizes=lod_step_sizes,
+    )
+    yield from run_exports(exports, n_workers=n_workers)
+
+
+def get_region_exports(
+    regions_directory,
+    label_layers,
+    voxel_size,
+    obj_ext=".obj",
+    deal_with_regions_separately=False,
+    step_size=1,
+    lod_step_sizes=(),
+):
+    """
+    List the meshes to export for each (non-empty) labels layer. Each
+    region is cropped to its bounding box first, so that only the crop is
+    sent to another process.
+    :return: List of (name, function) tuples. Each function (which can be
+    sent to another process) exports one region.
+    """
+    exports = []
     for label_layer in label_layers:
+        image = np.asarray(label_layer.data)
+        if is_empty(image):
+            continue
+
         filename = regions_directory / (label_layer.name + obj_ext)
-        export_regions_to_file(label_layer.data, filename, voxel_size)
+        if deal_with_regions_separately:
+            label_exports = get_label_exports(
+                image,
+                filename,
+                voxel_size,
+                step_size=step_size,
+                lod_step_sizes=lod_step_sizes,
+            )
+            exports.extend(
+                (f"{label_layer.name}_{label_id}", export)
+                for label_id, export in label_exports
+            )
+        else:
+            crop = get_export_crop(
+                find_object(image),
+                image.shape,
+                step_size=step_size,
+                lod_step_sizes=lod_step_sizes,
+            )
+            export = partial(
+                extract_and_save_object,
+                image[crop],
+                filename,
+                voxel_size,
+                step_size=step_size,
+                lod_step_sizes=lod_step_sizes,
+                offset=[axis_slice.start for axis_slice in crop],
+            )
+            exports.append((label_layer.name, export))
+    return exports
 
 
 def save_regions_to_file(
@@ -102,26 +523,237 @@ def save_regions_to_file(
     destination_directory,
     ignore_empty=True,
     image_extension=".tiff",
+    chunk_size=CHUNK_SIZE,
+    compression=None,
 ):
     """
-    Saves the segmented regions to file (as .tiff)
+    Saves the segmented regions to file (as .tiff or .zarr)
     :param label_layer: napari labels layer (with segmented regions)
     :param destination_directory: Where to save files to
     :param ignore_empty: If True, don't attempt to save empty images
     :param image_extension: File extension fo the image files
+    :param chunk_size: Number of planes to convert and write at once
+    :param compression: Compression of .tiff files (e.g. "zlib"), or None
+    :return: The saved file, or None if the regions are empty
+    """
+    return save_region(
+        label_layer.name,
+        label_layer.data,
+        destination_directory,
+        ignore_empty=ignore_empty,
+        image_extension=image_extension,
+        chunk_size=chunk_size,
+        compression=compression,
+    )
+
+
+def save_region(
+    name,
+    data,
+    destination_directory,
+    ignore_empty=True,
+    image_extension=".tiff",
+    chunk_size=CHUNK_SIZE,
+    compression=None,
+):
+    """
+    Saves an image of segmented regions to file, as it would be saved from
+    a labels layer of the same name (see save_regions_to_file for the
+    other parameters)
+    :param name: Name of the region
+    :param data: Image of the region
+    :return: The saved file, or None if the regions are empty
     """
-    data = label_layer.data
     if ignore_empty:
-        if data.sum() == 0:
+        if is_empty(data, chunk_size=chunk_size):
             return
 
-    name = label_layer.name
-
     filename = destination_directory / (name + image_extension)
-    imio.to_tiff(data.astype(np.int16), filename)
+    save_image(data, filename, chunk_size=chunk_size, compression=compression)
+    return filename
+
+
+def save_image(
+    data, filename, dtype=np.int16, chunk_size=CHUNK_SIZE, compression=None
+):
+    """
+    Saves an image as a .zarr array if the file name ends in .zarr, in a
+    sparse format if it ends in .npz, otherwise as a tiff stack. The image is
+    written under a temporary name first, so it can be saved over the file
+    it was (lazily) loaded from.
+    :param data: Image (numpy, dask, zarr or other array)
+    :param filename: Where to save the image
+    :param dtype: Data type of the saved image
+    :param chunk_size: Number of planes to convert and write at once
+    :param compression: Compression of .tiff files (e.g. "zlib"), or None.
+    .zarr arrays are always compressed.
+    """
+    filename = Path(filename)
+    temporary_file = filename.with_name(filename.name + ".tmp")
+    if filename.suffix == ".zarr":
+        save_image_to_zarr(
+            data, temporary_file, dtype=dtype, chunk_size=chunk_size
+        )
+    elif filename.suffix == ".npz":
+        save_image_sparse(
+            data, temporary_file, dtype=dtype, chunk_size=chunk_size
+        )
+    else:
+        save_image_in_chunks(
+            data,
+            temporary_file,
+            dtype=dtype,
+            chunk_size=chunk_size,
+            compression=compression,
+        )
+
+    if filename.is_dir():
+        shutil.rmtree(filename)
+    temporary_file.replace(filename)
+
+
+def save_image_in_chunks(
+    data, filename, dtype=np.int16, chunk_size=CHUNK_SIZE, compression=None
+):
+    """
+    Saves an image as a tiff stack, converting and writing one chunk of
+    planes at a time, so that the image does not need to fit in memory
+    :param data: Image (numpy, dask, zarr or other array)
+    :param filename: Where to save the image
+    :param dtype: Data type of the saved image
+    :param chunk_size: Number of planes to convert and write at once
+    :param compression: Compression (e.g. "zlib"), or None
+    """
+
+    def planes():
+        for chunk in chunk_slices(data, chunk_size):
+            yield from np.asarray(data[chunk]).astype(dtype, copy=False)
+
+    tifffile.imwrite(
+        str(filename),
+        planes(),
+        shape=data.shape,
+        dtype=dtype,
+        compression=compression,
+    )
+
+
+def save_image_to_zarr(data, filename, dtype=np.int16, chunk_size=CHUNK_SIZE):
+    """
+    Saves an image as a (compressed, chunked) .zarr array, one chunk of
+    planes at a time. Chunks that are all zero are not written, so mostly
+    empty regions take up little space.
+    :param data: Image (numpy, dask, zarr or other array)
+    :param filename: Where to save the image
+    :param dtype: Data type of the saved image
+    :param chunk_size: Number of planes to convert and write at once
+    """
+    chunks = (chunk_size,) + tuple(
+        min(length, ZARR_CHUNK_SIDE) for length in data.shape[1:]
+    )
+    image = zarr.open(
+        str(filename),
+        mode="w",
+        shape=data.shape,
+        chunks=chunks,
+        dtype=dtype,
+        fill_value=0,
+    )
+    for chunk in chunk_slices(data, chunk_size):
+        image[chunk] = np.asarray(data[chunk]).astype(dtype, copy=False)
+
+
+def save_image_sparse(data, filename, dtype=np.int16, chunk_size=CHUNK_SIZE):
+    """
+    Saves an image in a sparse (.npz) format: the bounding box of the
+    nonzero values, and the runs of nonzero values within it (run-length
+    encoding). The size of the file depends on the painted region, not on
+    the size of the image.
+    :param data: Image (numpy, dask, zarr or other array)
+    :param filename: Where to save the image
+    :param dtype: Data type of the saved image
+    :param chunk_size: Number of planes to read at once, when finding the
+    bounding box
+    """
+    bounding_box = get_bounding_box(data, chunk_size=chunk_size)
+    if bounding_box is None:
+        bounding_box = tuple(slice(0, 0) for _ in data.shape)
+    values = np.asarray(data[bounding_box]).astype(dtype, copy=False).ravel()
+
+    run_starts = np.flatnonzero(np.diff(values)) + 1
+    if values.size:
+        run_starts = np.concatenate(([0], run_starts))
+    run_lengths = np.diff(np.append(run_starts, values.size))
+    run_values = values[run_starts]
+    nonzero = run_values != 0
+
+    with open(filename, "wb") as f:
+        np.savez_compressed(
+            f,
+            shape=np.array(data.shape),
+            start=np.array([s.start for s in bounding_box]),
+            stop=np.array([s.stop for s in bounding_box]),
+            run_starts=run_starts[nonzero],
+            run_lengths=run_lengths[nonzero],
+            run_values=run_values[nonzero],
+        )
+
+
+def load_image_sparse(filename):
+    """
+    Loads an image saved by save_image_sparse
+    :param filename: .npz image file
+    :return: numpy array
+    """
+    with np.load(filename) as f:
+        run_values = f["run_values"]
+        image = np.zeros(tuple(f["shape"]), dtype=run_values.dtype)
+        bounding_box = tuple(
+            slice(start, stop) for start, stop in zip(f["start"], f["stop"])
+        )
+        run_starts = f["run_starts"]
+        run_ends = run_starts + f["run_lengths"]
+
+    # Mark the change in value at the start and end of each run, so that the
+    # cumulative sum fills in each run (integer overflow cancels out)
+    crop_shape = image[bounding_box].shape
+    changes = np.zeros(np.prod(crop_shape) + 1, dtype=run_values.dtype)
+    changes[run_starts] = run_values
+    changes[run_ends] -= run_values
+    image[bounding_box] = np.cumsum(
+        changes[:-1], dtype=run_values.dtype
+    ).reshape(crop_shape)
+    return image
 
 
-def export_regions_to_file(image, filename, voxel_size, ignore_empty=True):
+def load_image(filename, lazy=False):
+    """
+    Loads an image saved by save_image
+    :param filename: .tiff, .zarr or .npz image file
+    :param lazy: If True, return a (read only) zarr array, that is only read
+    from disk as it is indexed. .npz images are always fully loaded.
+    :return: numpy or zarr array
+    """
+    filename = Path(filename)
+    if filename.suffix == ".npz":
+        return load_image_sparse(filename)
+    elif filename.suffix == ".zarr":
+        image = zarr.open(str(filename), mode="r")
+    elif lazy:
+        image = zarr.open(tifffile.imread(filename, aszarr=True), mode="r")
+    else:
+        return tifffile.imread(filename)
+    return image if lazy else image[:]
+
+
+def export_regions_to_file(
+    image,
+    filename,
+    voxel_size,
+    ignore_empty=True,
+    step_size=1,
+    lod_step_sizes=(),
+):
     """
     Export regions as .obj for brainrender
 
@@ -130,4 +762,10 @@ def export_regions_to_file(image, filename, voxel_size, ignore_empty=True):
         if image.sum() == 0:
             return
 
-    volume_to_vector_array_to_obj_file(image, filename, voxel_size=voxel_size)
+    volume_to_vector_array_to_obj_file(
+        image,
+        filename,
+        voxel_size=voxel_size,
+        step_size=step_size,
+        lod_step_sizes=lod_step_sizes,
+    )
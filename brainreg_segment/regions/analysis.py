@@ -2,18 +2,37 @@ import numpy as np
 import pandas as pd
 
 
-from napari.qt.threading import thread_worker
 from skimage.measure import regionprops_table
 
-from imlib.pandas.misc import initialise_df
-from imlib.general.list import unique_elements_lists
+from brainreg_segment.atlas.structures import (
+    StructureTable,
+    get_ancestor_index,
+    get_structure_table,
+)
+from brainreg_segment.image.utils import CHUNK_SIZE, chunk_slices
 
-from brainreg_segment.atlas.utils import lateralise_atlas_image
+# Region properties that can be calculated one chunk at a time
+CHUNKED_PROPERTIES = ("area", "bbox", "centroid")
 
 
-@thread_worker
-def region_analysis(
-    label_layers,
+def region_analysis(label_layers, *args, **kwargs):
+    """
+    Run analyse_regions on napari labels layers, in a napari thread worker
+    (napari is only imported when needed, so analyses can be run without it)
+    :param label_layers: napari labels layers
+    :param args: Passed to analyse_regions
+    :param kwargs: Passed to analyse_regions
+    :return: napari FunctionWorker (not started)
+    """
+    from napari.qt.threading import thread_worker
+
+    return thread_worker(analyse_regions)(
+        get_regions_from_layers(label_layers), *args, **kwargs
+    )
+
+
+def analyse_regions(
+    regions,
     atlas_layer_image,
     atlas,
     hemispheres,
@@ -21,33 +40,84 @@ def region_analysis(
     output_csv_file=None,
     volumes=True,
     summarise=True,
+    roll_up=False,
+    chunk_size=CHUNK_SIZE,
 ):
+    """
+    Analyse regions, and save the results as csv files
+    :param regions: List of (name, image) tuples (see
+    get_regions_from_layers)
+    :param atlas_layer_image: Image of atlas annotations
+    :param atlas: brainglobe atlas class
+    :param hemispheres: Hemispheres image
+    :param regions_directory: Where to save the volumes of each region in
+    each brain area
+    :param output_csv_file: Where to save the summary of all the regions
+    :param volumes: Calculate the volume of each region in each brain area
+    :param summarise: Summarise each region
+    :param roll_up: Also report the volume within every ancestor of the
+    structures in the atlas hierarchy
+    :param chunk_size: Number of planes (along the first axis) to process
+    at once
+    """
     regions_directory.mkdir(parents=True, exist_ok=True)
     if volumes:
         print("Calculating region volume distribution")
         print(f"Saving summary volumes to: {regions_directory}")
-        for label_layer in label_layers:
-            analyse_region_brain_areas(
-                label_layer,
-                atlas_layer_image,
-                hemispheres,
-                regions_directory,
-                atlas,
-            )
+        brain_area_volumes = get_region_brain_area_volumes(
+            regions,
+            atlas_layer_image,
+            hemispheres,
+            atlas,
+            roll_up=roll_up,
+            chunk_size=chunk_size,
+        )
+        for name, df in brain_area_volumes.items():
+            df.to_csv(regions_directory / (name + ".csv"), index=False)
     if summarise:
         if output_csv_file is not None:
             print("Summarising regions")
-            summarise_brain_regions(
-                label_layers, output_csv_file, atlas.resolution
-            )
+            get_regions_summary(
+                regions, atlas.resolution, chunk_size=chunk_size
+            ).to_csv(output_csv_file, index=False)
 
     print("Finished!\n")
 
 
-def summarise_brain_regions(label_layers, filename, atlas_resolution):
+def get_regions_from_layers(label_layers):
+    """
+    :param label_layers: napari labels layers
+    :return: List of (name, image) tuples, as used by the analysis functions
+    """
+    return [
+        (label_layer.name, label_layer.data) for label_layer in label_layers
+    ]
+
+
+def summarise_brain_regions(
+    label_layers, filename, atlas_resolution, chunk_size=CHUNK_SIZE
+):
+    get_regions_summary(
+        get_regions_from_layers(label_layers),
+        atlas_resolution,
+        chunk_size=chunk_size,
+    ).to_csv(filename, index=False)
+
+
+def get_regions_summary(regions, atlas_resolution, chunk_size=CHUNK_SIZE):
+    """
+    Summarise the volume, bounding box and centre of regions
+    :param regions: List of (name, image) tuples
+    :param atlas_resolution: Resolution (in um) of each axis of the images
+    :param chunk_size: Number of planes (along the first axis) to process
+    at once
+    :return: pandas dataframe with one row per label of each region
+    """
     summaries = []
-    for label_layer in label_layers:
-        summaries.append(summarise_single_brain_region(label_layer))
+    for name, image in regions:
+        summaries.append(
+            get_region_summary(name, image, chunk_size=chunk_size)
+        )
 
     result = pd.concat(summaries)
     # TODO: use atlas.space to make these more intuitive
@@ -77,7 +147,7 @@ def summarise_brain_regions(label_layers, filename, atlas_resolution):
                 assert scale > 0
                 result[header] = result[header] * scale
 
-    result.to_csv(filename, index=False)
+    return result
 
 
 def summarise_single_brain_region(
@@ -88,20 +158,129 @@ def summarise_single_brain_region(
         "bbox",
         "centroid",
     ],
+    chunk_size=CHUNK_SIZE,
 ):
-    data = label_layer.data
-    if ignore_empty:
-        if data.sum() == 0:
-            return
-
-    regions_table = regionprops_table(
-        data.astype(np.uint16), properties=properties_to_fetch
+    return get_region_summary(
+        label_layer.name,
+        label_layer.data,
+        ignore_empty=ignore_empty,
+        properties_to_fetch=properties_to_fetch,
+        chunk_size=chunk_size,
     )
-    df = pd.DataFrame.from_dict(regions_table)
-    df.insert(0, "Region", label_layer.name)
+
+
+def get_region_summary(
+    name,
+    data,
+    ignore_empty=True,
+    properties_to_fetch=[
+        "area",
+        "bbox",
+        "centroid",
+    ],
+    chunk_size=CHUNK_SIZE,
+):
+    """
+    Calculate the properties of each label of a region
+    :param name: Name of the region
+    :param data: Image of the region
+    :param ignore_empty: If True, return None if the region is empty
+    :param properties_to_fetch: skimage.measure.regionprops properties
+    :param chunk_size: Number of planes (along the first axis) to process
+    at once (if only "area", "bbox" and "centroid" are fetched)
+    :return: pandas dataframe with one row per label
+    """
+    if set(properties_to_fetch) <= set(CHUNKED_PROPERTIES):
+        df = get_region_properties(
+            data, properties_to_fetch, chunk_size=chunk_size
+        )
+        if ignore_empty and df.empty:
+            return
+    else:
+        if ignore_empty:
+            if data.sum() == 0:
+                return
+        regions_table = regionprops_table(
+            np.asarray(data).astype(np.uint16),
+            properties=properties_to_fetch,
+        )
+        df = pd.DataFrame.from_dict(regions_table)
+
+    df.insert(0, "Region", name)
     return df
 
 
+def get_region_properties(
+    data,
+    properties_to_fetch=CHUNKED_PROPERTIES,
+    chunk_size=CHUNK_SIZE,
+):
+    """
+    Calculate the area, bounding box and centroid of each label in an
+    image, one chunk at a time. The results match those of
+    skimage.measure.regionprops_table.
+
+    :param data: Image of the region(s)
+    :param properties_to_fetch: Any of "area", "bbox" and "centroid"
+    :param chunk_size: Number of planes (along the first axis) to process
+    at once
+    :return: pandas dataframe with one row per label
+    """
+    areas = {}
+    minimums = {}
+    maximums = {}
+    coordinate_sums = {}
+
+    for chunk in chunk_slices(data, chunk_size):
+        image = np.asarray(data[chunk]).astype(np.uint16, copy=False)
+        labels = np.flatnonzero(np.bincount(image.ravel()))
+        for label in labels[labels != 0]:
+            mask = image == label
+            profiles = [
+                mask.sum(axis=tuple(i for i in range(mask.ndim) if i != dim))
+                for dim in range(mask.ndim)
+            ]
+            positions = [np.flatnonzero(profile) for profile in profiles]
+            offsets = [chunk.start] + [0] * (mask.ndim - 1)
+
+            minimum = [p[0] + o for p, o in zip(positions, offsets)]
+            maximum = [p[-1] + 1 + o for p, o in zip(positions, offsets)]
+            coordinate_sum = [
+                np.dot(profile, np.arange(len(profile)) + offset)
+                for profile, offset in zip(profiles, offsets)
+            ]
+
+            if label in areas:
+                areas[label] += profiles[0].sum()
+                minimums[label] = np.minimum(minimums[label], minimum)
+                maximums[label] = np.maximum(maximums[label], maximum)
+                coordinate_sums[label] += coordinate_sum
+            else:
+                areas[label] = profiles[0].sum()
+                minimums[label] = np.array(minimum)
+                maximums[label] = np.array(maximum)
+                coordinate_sums[label] = np.array(coordinate_sum)
+
+    labels = sorted(areas)
+    ndim = len(data.shape)
+    columns = {}
+    if "area" in properties_to_fetch:
+        columns["area"] = [areas[label] for label in labels]
+    if "bbox" in properties_to_fetch:
+        for dim in range(ndim):
+            columns[f"bbox-{dim}"] = [minimums[label][dim] for label in labels]
+        for dim in range(ndim):
+            columns[f"bbox-{dim + ndim}"] = [
+                maximums[label][dim] for label in labels
+            ]
+    if "centroid" in properties_to_fetch:
+        for dim in range(ndim):
+            columns[f"centroid-{dim}"] = [
+                coordinate_sums[label][dim] / areas[label] for label in labels
+            ]
+    return pd.DataFrame(columns)
+
+
 def analyse_region_brain_areas(
     label_layer,
     atlas_layer_data,
@@ -117,148 +296,316 @@ def analyse_region_brain_areas(
 
     :param ignore_empty: If True, don't analyse empty regions
     """
+    analyse_region_brain_areas_batched(
+        [label_layer],
+        atlas_layer_data,
+        hemispheres,
+        destination_directory,
+        atlas,
+        extension=extension,
+        ignore_empty=ignore_empty,
+    )
 
-    data = label_layer.data
-    if ignore_empty:
-        if data.sum() == 0:
-            return
 
-    name = label_layer.name
+def analyse_region_brain_areas_batched(
+    label_layers,
+    atlas_layer_data,
+    hemispheres,
+    destination_directory,
+    atlas,
+    extension=".csv",
+    ignore_empty=True,
+    roll_up=False,
+    chunk_size=CHUNK_SIZE,
+):
+    """
+    Analyse the brain areas of many regions, reading the atlas annotations
+    and hemispheres once for all of them.
+
+    :param label_layers: napari labels layers (with segmented regions)
+    :param atlas_layer_data: Image of atlas annotations
+    :param hemispheres: Hemispheres image
+    :param destination_directory: Where to save the csv files
+    :param atlas: brainglobe atlas class
+    :param extension: File extension of the results
+    :param ignore_empty: If True, don't analyse empty regions
+    :param roll_up: If True, also report the volume within every ancestor
+    of the structures in the atlas hierarchy
+    :param chunk_size: Number of planes (along the first axis) to process
+    at once
+    """
+    brain_area_volumes = get_region_brain_area_volumes(
+        get_regions_from_layers(label_layers),
+        atlas_layer_data,
+        hemispheres,
+        atlas,
+        ignore_empty=ignore_empty,
+        roll_up=roll_up,
+        chunk_size=chunk_size,
+    )
+    for name, df in brain_area_volumes.items():
+        df.to_csv(destination_directory / (name + extension), index=False)
+
 
-    masked_annotations = data.astype(bool) * atlas_layer_data
+def get_region_brain_area_volumes(
+    regions,
+    atlas_layer_data,
+    hemispheres,
+    atlas,
+    ignore_empty=True,
+    roll_up=False,
+    chunk_size=CHUNK_SIZE,
+):
+    """
+    Calculate the volume of many regions within each brain area, reading the
+    atlas annotations and hemispheres once for all of them.
 
-    annotations_left, annotations_right = lateralise_atlas_image(
-        masked_annotations,
+    :param regions: List of (name, image) tuples
+    :param atlas_layer_data: Image of atlas annotations
+    :param hemispheres: Hemispheres image
+    :param atlas: brainglobe atlas class
+    :param ignore_empty: If True, don't analyse empty regions
+    :param roll_up: If True, also report the volume within every ancestor
+    of the structures in the atlas hierarchy
+    :param chunk_size: Number of planes (along the first axis) to process
+    at once
+    :return: Dict of pandas dataframes (see get_structure_volumes_df),
+    keyed by region name
+    """
+    all_counts = get_structure_voxel_counts_batched(
+        [image for _, image in regions],
+        atlas_layer_data,
         hemispheres,
         left_hemisphere_value=atlas.left_hemisphere_value,
         right_hemisphere_value=atlas.right_hemisphere_value,
-    )
-
-    unique_vals_left, counts_left = np.unique(
-        annotations_left, return_counts=True
-    )
-    unique_vals_right, counts_right = np.unique(
-        annotations_right, return_counts=True
+        chunk_size=chunk_size,
     )
     voxel_volume_in_mm = np.prod(atlas.resolution) / (1000 ** 3)
 
-    df = initialise_df(
-        "structure_name",
-        "left_volume_mm3",
-        "left_percentage_of_total",
-        "right_volume_mm3",
-        "right_percentage_of_total",
-        "total_volume_mm3",
-        "percentage_of_total",
-    )
+    brain_area_volumes = {}
+    for (name, _), counts in zip(regions, all_counts):
+        if counts is None:
+            if ignore_empty:
+                continue
+            counts = (np.array([], dtype=int),) * 3
 
-    sampled_structures = unique_elements_lists(
-        list(unique_vals_left) + list(unique_vals_right)
-    )
-    total_volume_region = get_total_volume_regions(
-        unique_vals_left, unique_vals_right, counts_left, counts_right
-    )
+        total_volume_voxels = get_total_volume_voxels(*counts)
+        if roll_up:
+            counts = get_ancestor_index(atlas).roll_up(*counts)
 
-    for atlas_value in sampled_structures:
-        if atlas_value != 0:
-            try:
-                df = add_structure_volume_to_df(
-                    df,
-                    atlas_value,
-                    atlas.structures,
-                    unique_vals_left,
-                    unique_vals_right,
-                    counts_left,
-                    counts_right,
-                    voxel_volume_in_mm,
-                    total_volume_voxels=total_volume_region,
-                )
+        brain_area_volumes[name] = get_structure_volumes_df(
+            *counts,
+            get_structure_table(atlas),
+            voxel_volume_in_mm,
+            total_volume_voxels=total_volume_voxels,
+        )
+    return brain_area_volumes
 
-            except KeyError:
-                print(
-                    f"Value: {atlas_value} is not in the atlas structure"
-                    f" reference file. Not calculating the volume"
+
+def get_structure_voxel_counts_batched(
+    label_images,
+    atlas_layer_data,
+    hemispheres,
+    left_hemisphere_value=1,
+    right_hemisphere_value=2,
+    chunk_size=CHUNK_SIZE,
+):
+    """
+    Count the voxels of many regions within each atlas structure, per
+    hemisphere. The images are processed in chunks of planes, so each chunk
+    of the atlas annotations and hemispheres is read only once.
+
+    :param label_images: List of images of the regions
+    :param atlas_layer_data: Image of atlas annotations
+    :param hemispheres: Hemispheres image
+    :param left_hemisphere_value: Value encoded in hemispheres image
+    :param right_hemisphere_value: Value encoded in hemispheres image
+    :param chunk_size: Number of planes (along the first axis) to process
+    at once
+    :return: List with a tuple (structure_ids, counts_left, counts_right)
+    for each region (see get_structure_voxel_counts), or None if the
+    region is empty.
+    """
+    chunk_counts = [[] for _ in label_images]
+    for chunk in chunk_slices(atlas_layer_data, chunk_size):
+        annotations = np.asarray(atlas_layer_data[chunk])
+        hemisphere_values = np.asarray(hemispheres[chunk])
+
+        for counts, label_image in zip(chunk_counts, label_images):
+            data = np.asarray(label_image[chunk])
+            if data.any():
+                counts.append(
+                    get_structure_voxel_counts(
+                        data,
+                        annotations,
+                        hemisphere_values,
+                        left_hemisphere_value=left_hemisphere_value,
+                        right_hemisphere_value=right_hemisphere_value,
+                    )
                 )
-    filename = destination_directory / (name + extension)
-    df.to_csv(filename, index=False)
 
+    return [
+        merge_structure_voxel_counts(counts) if counts else None
+        for counts in chunk_counts
+    ]
 
-def get_total_volume_regions(
-    unique_vals_left,
-    unique_vals_right,
-    counts_left,
-    counts_right,
+
+def merge_structure_voxel_counts(chunk_counts):
+    """
+    Combine the per-structure voxel counts of several chunks of an image
+    :param chunk_counts: List of tuples (structure_ids, counts_left,
+    counts_right)
+    :return: Tuple (structure_ids, counts_left, counts_right) of numpy arrays
+    """
+    structure_ids, counts_left, counts_right = (
+        np.concatenate(arrays) for arrays in zip(*chunk_counts)
+    )
+    structure_ids, structure_index = np.unique(
+        structure_ids, return_inverse=True
+    )
+    merged_left = np.zeros(len(structure_ids), dtype=counts_left.dtype)
+    merged_right = np.zeros(len(structure_ids), dtype=counts_right.dtype)
+    np.add.at(merged_left, structure_index, counts_left)
+    np.add.at(merged_right, structure_index, counts_right)
+    return structure_ids, merged_left, merged_right
+
+
+def get_structure_voxel_counts(
+    data,
+    atlas_layer_data,
+    hemispheres,
+    left_hemisphere_value=1,
+    right_hemisphere_value=2,
 ):
-    zero_index_left = np.where(unique_vals_left == 0)[0][0]
-    counts_left = list(counts_left)
-    counts_left.pop(zero_index_left)
+    """
+    Count the voxels of a region within each atlas structure, per hemisphere.
+
+    Only the voxels within the region are read from the atlas. Their
+    annotations are mapped to consecutive indices, which are combined with
+    the hemisphere into a single key, so that all counts come from one
+    bincount.
+
+    :param data: Image of the region (nonzero voxels are inside)
+    :param atlas_layer_data: Image of atlas annotations
+    :param hemispheres: Hemispheres image
+    :param left_hemisphere_value: Value encoded in hemispheres image
+    :param right_hemisphere_value: Value encoded in hemispheres image
+    :return: Tuple (structure_ids, counts_left, counts_right) of numpy
+    arrays. structure_ids is sorted, and includes 0 if part of the region
+    is outside the atlas annotations.
+    """
+    mask = data != 0
+    annotations = atlas_layer_data[mask]
+    hemisphere_values = hemispheres[mask]
 
-    zero_index_right = np.where(unique_vals_right == 0)[0][0]
-    counts_right = list(counts_right)
-    counts_right.pop(zero_index_right)
+    in_left = hemisphere_values == left_hemisphere_value
+    in_right = hemisphere_values == right_hemisphere_value
+    lateralised = in_left | in_right
 
-    return sum(counts_left + counts_right)
+    structure_ids, structure_index = np.unique(
+        annotations[lateralised], return_inverse=True
+    )
+    counts = np.bincount(
+        2 * structure_index.ravel() + in_right[lateralised],
+        minlength=2 * len(structure_ids),
+    ).reshape(-1, 2)
+    return structure_ids, counts[:, 0], counts[:, 1]
 
 
-def add_structure_volume_to_df(
-    df,
-    atlas_value,
-    atlas_structures,
-    unique_vals_left,
-    unique_vals_right,
+def get_structure_volumes_df(
+    structure_ids,
     counts_left,
     counts_right,
+    atlas_structures,
     voxel_volume,
     total_volume_voxels=None,
 ):
-    name = atlas_structures[atlas_value]["name"]
-
-    left_volume, left_percentage = get_volume_in_hemisphere(
-        atlas_value,
-        unique_vals_left,
-        counts_left,
-        total_volume_voxels,
-        voxel_volume,
+    """
+    Convert per-structure voxel counts into a table of volumes.
+
+    Structures found in the left hemisphere are listed first, followed by
+    those only found in the right hemisphere. Voxels outside the atlas
+    annotations (structure 0) are excluded from the total volume.
+
+    :param structure_ids: Atlas structure IDs
+    :param counts_left: Number of voxels in each structure (left)
+    :param counts_right: Number of voxels in each structure (right)
+    :param atlas_structures: bg_atlasapi structures dictionary, or
+    StructureTable
+    :param voxel_volume: Volume of a single voxel
+    :param total_volume_voxels: Volume of the region (in voxels) that
+    percentages are relative to. If None, the sum of the counts.
+    :return: pandas dataframe with one row per structure
+    """
+    in_atlas = structure_ids != 0
+    if total_volume_voxels is None:
+        total_volume_voxels = get_total_volume_voxels(
+            structure_ids, counts_left, counts_right
+        )
+
+    order = np.concatenate(
+        (
+            np.flatnonzero(counts_left > 0),
+            np.flatnonzero((counts_left == 0) & (counts_right > 0)),
+        )
     )
-    right_volume, right_percentage = get_volume_in_hemisphere(
-        atlas_value,
-        unique_vals_right,
-        counts_right,
-        total_volume_voxels,
-        voxel_volume,
+    order = order[in_atlas[order]]
+
+    if not isinstance(atlas_structures, StructureTable):
+        atlas_structures = StructureTable.from_structures(atlas_structures)
+    index, in_table = atlas_structures.index_of(structure_ids[order])
+    for structure_id in structure_ids[order[~in_table]]:
+        print(
+            f"Value: {structure_id} is not in the atlas structure"
+            f" reference file. Not calculating the volume"
+        )
+    found = order[in_table]
+    names = list(atlas_structures.names[index[in_table]])
+    counts_left = counts_left[found]
+    counts_right = counts_right[found]
+
+    left_volume = absent_as_zero(counts_left, counts_left * voxel_volume)
+    right_volume = absent_as_zero(counts_right, counts_right * voxel_volume)
+    left_percentage = absent_as_zero(
+        counts_left, 100 * (counts_left / total_volume_voxels)
+    )
+    right_percentage = absent_as_zero(
+        counts_right, 100 * (counts_right / total_volume_voxels)
     )
-    if total_volume_voxels is not None:
-        total_percentage = left_percentage + right_percentage
-    else:
-        total_percentage = 0
 
-    df = df.append(
+    return pd.DataFrame(
         {
-            "structure_name": name,
+            "structure_name": names,
             "left_volume_mm3": left_volume,
             "left_percentage_of_total": left_percentage,
             "right_volume_mm3": right_volume,
             "right_percentage_of_total": right_percentage,
             "total_volume_mm3": left_volume + right_volume,
-            "percentage_of_total": total_percentage,
-        },
-        ignore_index=True,
+            "percentage_of_total": left_percentage + right_percentage,
+        }
     )
-    return df
 
 
-def get_volume_in_hemisphere(
-    atlas_value, unique_vals, counts, total_volume_voxels, voxel_volume
-):
-    try:
-        index = np.where(unique_vals == atlas_value)[0][0]
-        volume = counts[index] * voxel_volume
-        if total_volume_voxels is not None:
-            percentage = 100 * (counts[index] / total_volume_voxels)
-        else:
-            percentage = 0
-    except IndexError:
-        volume = 0
-        percentage = 0
-
-    return volume, percentage
+def get_total_volume_voxels(structure_ids, counts_left, counts_right):
+    """
+    Get the volume of a region (in voxels) within the atlas annotations
+    :param structure_ids: Atlas structure IDs
+    :param counts_left: Number of voxels in each structure (left)
+    :param counts_right: Number of voxels in each structure (right)
+    :return: Number of voxels
+    """
+    in_atlas = structure_ids != 0
+    return counts_left[in_atlas].sum() + counts_right[in_atlas].sum()
+
+
+def absent_as_zero(counts, values):
+    """
+    Keep structures that are absent from a hemisphere as integer zeros
+    (as previously written to csv).
+    :param counts: Number of voxels in each structure
+    :param values: Values derived from the counts
+    :return: numpy object array
+    """
+    values = values.astype(object)
+    values[counts == 0] = 0
+    return values
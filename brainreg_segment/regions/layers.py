@@ -1,8 +1,12 @@
-import tifffile
 import numpy as np
 
 from glob import glob
 from pathlib import Path
+from concurrent.futures import ThreadPoolExecutor, as_completed
+from napari.qt.threading import thread_worker
+
+from brainreg_segment.regions.IO import load_image
+from brainreg_segment.manifest import record_loaded, track_changes
 
 
 def add_new_label_layer(
@@ -25,11 +29,12 @@ def add_new_label_layer(
     :param int brush_size: Default size of the label brush
     :return label_layer: napari labels layer
     """
-    labels = np.empty_like(base_image)
+    labels = np.zeros_like(base_image)
     label_layer = viewer.add_labels(labels, num_colors=num_colors, name=name)
     label_layer.n_dimensional = True
     label_layer.selected_label = selected_label
     label_layer.brush_size = brush_size
+    track_changes(label_layer)
     return label_layer
 
 
@@ -54,30 +59,68 @@ def add_existing_label_layers(
     selected_label=1,
     num_colors=10,
     brush_size=30,
+    lazy=False,
+    labels=None,
 ):
     """
     Loads an existing image as a napari labels layer
     :param viewer: Napari viewer instance
-    :param label_file: Filename of the image to be loaded
+    :param label_file: Filename of the image to be loaded (.tiff or .zarr)
     :param int selected_label: Label ID to be preselected
     :param int num_colors: How many colors (labels)
     :param int brush_size: Default size of the label brush
+    :param lazy: If True, the image is only read from disk as it is viewed,
+    and the layer can't be edited
+    :param labels: The image, if already loaded (e.g. by load_region_files)
     :return label_layer: napari labels layer
     """
     label_file = Path(label_file)
-    labels = tifffile.imread(label_file)
+    if labels is None:
+        labels = load_image(label_file, lazy=lazy)
     label_layer = viewer.add_labels(
         labels, num_colors=num_colors, name=label_file.stem
     )
     label_layer.selected_label = selected_label
     label_layer.brush_size = brush_size
+    if lazy:
+        label_layer.editable = False
+    track_changes(label_layer)
+    record_loaded(label_layer, label_file)
     return label_layer
 
 
+def get_region_files(directory, file_extension):
+    return glob(str(directory) + "/*" + file_extension)
+
+
+@thread_worker
+def load_region_files(label_files, lazy=False, n_threads=None):
+    """
+    Loads saved regions in the background. The files are read concurrently
+    (reading is I/O bound, and tifffile releases the GIL while decoding).
+    :param label_files: List of image files
+    :param lazy: If True, open the images to be read from disk as they are
+    viewed
+    :param n_threads: Number of files to read at once. If None, the
+    ThreadPoolExecutor default is used.
+    :return: Generator of (number loaded, number of files, file, image)
+    tuples, in the order the files finish loading
+    """
+    with ThreadPoolExecutor(max_workers=n_threads) as executor:
+        futures = {
+            executor.submit(load_image, label_file, lazy=lazy): label_file
+            for label_file in label_files
+        }
+        for n, future in enumerate(as_completed(futures), start=1):
+            yield n, len(futures), futures[future], future.result()
+
+
 def add_existing_region_segmentation(
-    directory, viewer, label_layers, file_extension
+    directory, viewer, label_layers, file_extension, lazy=False
 ):
-    label_files = glob(str(directory) + "/*" + file_extension)
+    label_files = get_region_files(directory, file_extension)
     if directory and label_files != []:
         for label_file in label_files:
-            label_layers.append(add_existing_label_layers(viewer, label_file))
+            label_layers.append(
+                add_existing_label_layers(viewer, label_file, lazy=lazy)
+            )
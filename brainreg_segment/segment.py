@@ -12,21 +12,11 @@ from qtpy.QtWidgets import (
     QWidget,
 )
 
-from bg_atlasapi import BrainGlobeAtlas
-
 from brainreg_segment.paths import Paths
 
-from brainreg_segment.regions.IO import (
-    save_label_layers,
-    export_label_layers,
-)
-
-from brainreg_segment.tracks.IO import save_track_layers, export_splines
+from brainreg_segment.journal import Journal, apply_blocks, recover_journal
+from brainreg_segment.manifest import mark_unsaved
 
-from brainreg_segment.atlas.utils import (
-    get_available_atlases,
-    structure_from_viewer,
-)
 from brainreg_segment.layout.utils import display_warning
 
 # LAYOUT HELPERS ################################################################################
@@ -45,6 +35,12 @@ from brainreg_segment.layout.gui_constants import (
     BOUNDARIES_STRING,
     TRACK_FILE_EXT,
     DISPLAY_REGION_INFO,
+    REGION_INFO_INTERVAL,
+    AUTOSAVE_INTERVAL,
+    EXPORT_N_WORKERS,
+    REGION_MESH_EXT,
+    REGION_MESH_STEP_SIZE,
+    REGION_MESH_LOD_STEP_SIZES,
 )
 
 from brainreg_segment.layout.gui_elements import (
@@ -93,6 +89,12 @@ class SegmentationWidget(QWidget):
 
         self.boundaries_string = boundaries_string
         self.directory = ""
+
+        # Autosave
+        self.journal = None
+        self.autosave_timer = QtCore.QTimer()
+        self.autosave_timer.timeout.connect(self.autosave)
+        self.viewer.layers.events.inserted.connect(self.watch_layer)
         # Set up segmentation methods
         self.region_seg = RegionSeg(self)
         self.track_seg = TrackSeg(self)
@@ -100,22 +102,48 @@ class SegmentationWidget(QWidget):
         # Generate main layout
         self.setup_main_layout()
 
+        # Brain region info on mouse over, updated at most once per
+        # REGION_INFO_INTERVAL (the cursor position is taken from the
+        # latest mouse move)
+        self.region_info = None
+        self.hover_position = None
+        self.region_info_timer = QtCore.QTimer()
+        self.region_info_timer.setSingleShot(True)
+        self.region_info_timer.setInterval(REGION_INFO_INTERVAL)
+        self.region_info_timer.timeout.connect(self.display_region_info)
+
         if DISPLAY_REGION_INFO:
 
             @self.viewer.mouse_move_callbacks.append
-            def display_region_info(v, event):
-                """
-                Show brain region info on mouse over in status bar on the right
-                """
+            def hover(v, event):
                 assert self.viewer == v
-                if v.dims.ndisplay == 2:
-                    if len(v.layers) and self.atlas_layer and self.atlas:
-                        _, _, _, region_info = structure_from_viewer(
-                            self.viewer.status, self.atlas_layer, self.atlas
-                        )
-                        self.viewer.help = region_info
-                else:
-                    self.viewer.help = ""
+                self.hover_position = event.position
+                if not self.region_info_timer.isActive():
+                    self.region_info_timer.start()
+
+    def display_region_info(self):
+        """
+        Show brain region info on mouse over in status bar on the right
+        """
+        if self.viewer.dims.ndisplay != 2:
+            self.viewer.help = ""
+        elif self.atlas_layer and self.atlas:
+            if (
+                self.region_info is None
+                or self.region_info.annotation is not self.atlas_layer.data
+            ):
+                from brainreg_segment.atlas.structures import RegionInfo
+
+                self.region_info = RegionInfo(
+                    self.atlas_layer.data,
+                    self.hemispheres_data,
+                    self.atlas.structures,
+                    left_hemisphere_value=self.atlas.left_hemisphere_value,
+                    right_hemisphere_value=self.atlas.right_hemisphere_value,
+                )
+            self.viewer.help = self.region_info.at_position(
+                self.atlas_layer, self.hover_position
+            )
 
     def setup_main_layout(self):
         """
@@ -263,24 +291,43 @@ class SegmentationWidget(QWidget):
     # ATLAS INTERACTION ####################################################
 
     def add_atlas_menu(self, layout):
-        list_of_atlasses = ["Load atlas"]
-        available_atlases = get_available_atlases()
-        for atlas in available_atlases.keys():
-            atlas_desc = f"{atlas} v{available_atlases[atlas]}"
-            list_of_atlasses.append(atlas_desc)
-            atlas_menu, _ = add_combobox(
-                layout,
-                None,
-                list_of_atlasses,
-                2,
-                0,
-                label_stack=True,
-                callback=self.initialise_atlas,
-                width=COLUMN_WIDTH,
-            )
+        from brainreg_segment.atlas.utils import get_available_atlases
+
+        # Use the cached list of atlases, so the widget opens without waiting
+        # for the network, and refresh it in the background
+        atlas_menu, _ = add_combobox(
+            layout,
+            None,
+            get_atlas_menu_items(get_available_atlases(fetch=False)),
+            2,
+            0,
+            label_stack=True,
+            callback=self.initialise_atlas,
+            width=COLUMN_WIDTH,
+        )
 
         self.atlas_menu = atlas_menu
 
+        worker = refresh_available_atlases()
+        worker.returned.connect(self.update_atlas_menu)
+        worker.start()
+
+    def update_atlas_menu(self, available_atlases):
+        items = get_atlas_menu_items(available_atlases)
+        current_items = [
+            self.atlas_menu.itemText(i) for i in range(self.atlas_menu.count())
+        ]
+        if items == current_items:
+            return
+
+        current_item = self.atlas_menu.currentText()
+        self.atlas_menu.blockSignals(True)
+        self.atlas_menu.clear()
+        self.atlas_menu.addItems(items)
+        if current_item in items:
+            self.atlas_menu.setCurrentIndex(items.index(current_item))
+        self.atlas_menu.blockSignals(False)
+
     def initialise_atlas(self):
         atlas_string = self.atlas_menu.currentText()
         atlas_name = atlas_string.split(" ")[0].strip()
@@ -311,9 +358,9 @@ class SegmentationWidget(QWidget):
         # Set window title
         self.viewer.title = f"Atlas: {self.current_atlas_name}"
         self.initialise_segmentation_interface()
+        self.start_journal()
         # Check / load previous regions and tracks
-        self.region_seg.check_saved_region()
-        self.track_seg.check_saved_track()
+        self.load_saved_layers(on_finished=self.recover_autosave)
         self.reset_atlas_menu()
 
     def set_output_directory(self):
@@ -329,8 +376,11 @@ class SegmentationWidget(QWidget):
             self.directory = Path(self.directory)
 
     def load_atlas(self):
+        from bg_atlasapi import BrainGlobeAtlas
+
         atlas = BrainGlobeAtlas(self.current_atlas_name)
         self.atlas = atlas
+        self.hemispheres_data = self.atlas.hemispheres
         self.base_layer = self.viewer.add_image(
             self.atlas.reference,
             name="Reference",
@@ -415,9 +465,137 @@ class SegmentationWidget(QWidget):
             )
             return
 
+        self.start_journal()
+
         # Check / load previous regions and tracks
-        self.region_seg.check_saved_region()
-        self.track_seg.check_saved_track()
+        self.load_saved_layers(on_finished=self.recover_autosave)
+
+    def load_saved_layers(self, on_finished=None):
+        """
+        Load previously saved regions and tracks. If the panels load them in
+        the background, each layer is added as soon as it is loaded, and the
+        viewer can be used in the meantime.
+        :param on_finished: Called once all regions and tracks are loaded
+        """
+        workers = [
+            worker
+            for worker in (
+                self.region_seg.check_saved_region(),
+                self.track_seg.check_saved_track(),
+            )
+            if worker is not None
+        ]
+        if not workers:
+            if on_finished is not None:
+                on_finished()
+            return
+
+        self.status_label.setText("Loading saved regions and tracks...")
+        self.n_loading_workers = len(workers)
+
+        def worker_finished():
+            self.n_loading_workers -= 1
+            if not self.n_loading_workers:
+                self.status_label.setText("Ready")
+                if on_finished is not None:
+                    on_finished()
+
+        for worker in workers:
+            worker.finished.connect(worker_finished)
+            worker.start()
+
+    def start_journal(self):
+        """
+        Start journaling changes to regions and tracks, and autosaving them
+        periodically, so they can be recovered after a crash
+        """
+        self.stop_journal()
+        self.journal = Journal(self.paths.journal_file)
+        if AUTOSAVE_INTERVAL:
+            self.autosave_timer.start(int(AUTOSAVE_INTERVAL * 1000))
+
+    def stop_journal(self):
+        """
+        Stop journaling and autosaving (e.g. before the layers are removed),
+        so that changes aren't autosaved to the journal of other layers
+        """
+        self.autosave_timer.stop()
+        if self.journal is not None:
+            self.journal.close()
+            self.journal = None
+
+    def watch_layer(self, event):
+        layer = event.value
+        if self.journal is not None and isinstance(
+            layer, (napari.layers.Labels, napari.layers.Points)
+        ):
+            self.journal.watch(layer)
+
+    def autosave(self):
+        if self.journal is not None:
+            self.journal.autosave(self.label_layers, self.track_layers)
+
+    def clear_journal(self, journal, checkpoint):
+        """
+        Remove the records of a journal before a checkpoint, if it is still
+        the journal of the current layers
+        """
+        if journal is not None and journal is self.journal:
+            journal.clear(checkpoint)
+
+    def recover_autosave(self):
+        """
+        Apply any changes to regions and tracks that were autosaved, but not
+        saved (e.g. if napari crashed)
+        """
+        from brainreg_segment.regions.layers import add_new_label_layer
+        from brainreg_segment.tracks.layers import add_new_track_layer
+
+        label_changes, track_changes = recover_journal(self.paths.journal_file)
+        if not label_changes and not track_changes:
+            return
+
+        names = ", ".join(sorted({*label_changes, *track_changes}))
+        choice = display_warning(
+            self,
+            "Recover autosaved changes",
+            f"Unsaved changes to {names} were found. Recover them?",
+        )
+        if not choice:
+            print("Discarding autosaved changes")
+            if self.journal is not None:
+                self.journal.clear()
+            return
+
+        print(f"Recovering autosaved changes to {names}")
+        for name, (shape, dtype, blocks) in label_changes.items():
+            label_layer = get_layer(self.label_layers, name, shape=shape)
+            if label_layer is None:
+                label_layer = add_new_label_layer(
+                    self.viewer,
+                    np.zeros(shape, dtype=dtype),
+                    name=name,
+                    brush_size=self.region_seg.brush_size,
+                    num_colors=self.region_seg.num_colors,
+                )
+                self.label_layers.append(label_layer)
+            elif not isinstance(label_layer.data, np.ndarray):
+                # lazily loaded
+                label_layer.data = np.array(label_layer.data)
+                label_layer.editable = True
+            apply_blocks(label_layer.data, blocks)
+            mark_unsaved(label_layer)
+            label_layer.refresh()
+
+        for name, points in track_changes.items():
+            track_layer = get_layer(self.track_layers, name)
+            if track_layer is None:
+                add_new_track_layer(
+                    self.viewer, self.track_layers, self.track_seg.point_size
+                )
+                track_layer = self.track_layers[-1]
+                track_layer.name = name
+            track_layer.data = points
 
     def initialise_loaded_data(self):
         """
@@ -510,6 +688,8 @@ class SegmentationWidget(QWidget):
                 except IndexError:  # no idea why this happens
                     pass
 
+        self.stop_journal()
+
         # There seems to be a napari bug trying to access previously used slider
         # values. Trying to circument for now
         self.viewer.window.qt_viewer.dims._last_used = None
@@ -523,17 +703,28 @@ class SegmentationWidget(QWidget):
             choice = display_warning(
                 self,
                 "About to save files",
-                "Existing files will be will be deleted. Proceed?",
+                "Files of changed regions and tracks will be overwritten. Proceed?",
             )
             if choice:
                 print("Saving")
+                # Changes autosaved while saving may not be saved, so only
+                # the journal up to now is cleared once saved
+                journal = self.journal
+                checkpoint = (
+                    journal.checkpoint() if journal is not None else None
+                )
                 worker = save_all(
                     self.paths.regions_directory,
                     self.paths.tracks_directory,
                     self.label_layers,
                     self.track_layers,
+                    image_file_extension=self.region_seg.image_file_extension,
+                    image_compression=self.region_seg.image_compression,
                     track_file_extension=TRACK_FILE_EXT,
                 )
+                worker.returned.connect(
+                    lambda _: self.clear_journal(journal, checkpoint)
+                )
                 worker.start()
             else:
                 print('Not saving because user chose "Cancel" \n')
@@ -553,11 +744,48 @@ class SegmentationWidget(QWidget):
                 self.track_seg.splines,
                 self.track_seg.spline_names,
                 self.atlas.resolution[0],
+                mesh_extension=REGION_MESH_EXT,
+                mesh_step_size=REGION_MESH_STEP_SIZE,
+                mesh_lod_step_sizes=REGION_MESH_LOD_STEP_SIZES,
+                n_workers=EXPORT_N_WORKERS,
+            )
+            worker.yielded.connect(self.show_export_progress)
+            worker.returned.connect(
+                lambda _: self.status_label.setText("Ready")
             )
             worker.start()
         else:
             print('Not exporting because user chose "Cancel" \n')
 
+    def show_export_progress(self, progress):
+        n_exported, n_total, name = progress
+        self.status_label.setText(
+            f"Exported region {n_exported}/{n_total} ({name})"
+        )
+
+
+def get_atlas_menu_items(available_atlases):
+    return ["Load atlas"] + [
+        f"{atlas} v{version}" for atlas, version in available_atlases.items()
+    ]
+
+
+@thread_worker
+def refresh_available_atlases():
+    from brainreg_segment.atlas.utils import get_available_atlases
+
+    return get_available_atlases()
+
+
+def get_layer(layers, name, shape=None):
+    """
+    Find a layer by name (and optionally, the shape of its data)
+    :return: napari layer, or None if not found
+    """
+    for layer in layers:
+        if layer.name == name and (shape is None or layer.data.shape == shape):
+            return layer
+
 
 @thread_worker
 def export_all(
@@ -567,9 +795,24 @@ def export_all(
     splines,
     spline_names,
     resolution,
+    mesh_extension=".obj",
+    mesh_step_size=1,
+    mesh_lod_step_sizes=(),
+    n_workers=None,
 ):
+    from brainreg_segment.regions.IO import iter_export_label_layers
+    from brainreg_segment.tracks.IO import export_splines
+
     if label_layers:
-        export_label_layers(regions_directory, label_layers, resolution)
+        yield from iter_export_label_layers(
+            regions_directory,
+            label_layers,
+            resolution,
+            obj_ext=mesh_extension,
+            step_size=mesh_step_size,
+            lod_step_sizes=mesh_lod_step_sizes,
+            n_workers=n_workers,
+        )
 
     if splines:
         export_splines(tracks_directory, splines, spline_names, resolution)
@@ -582,11 +825,20 @@ def save_all(
     tracks_directory,
     label_layers,
     points_layers,
+    image_file_extension=".tiff",
+    image_compression=None,
     track_file_extension=".points",
 ):
+    from brainreg_segment.regions.IO import save_label_layers
+    from brainreg_segment.tracks.IO import save_track_layers
 
     if label_layers:
-        save_label_layers(regions_directory, label_layers)
+        save_label_layers(
+            regions_directory,
+            label_layers,
+            image_extension=image_file_extension,
+            compression=image_compression,
+        )
 
     if points_layers:
         save_track_layers(
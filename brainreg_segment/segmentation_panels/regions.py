@@ -10,19 +10,18 @@ from brainreg_segment.layout.gui_elements import (
     add_checkbox,
 )
 
-from brainreg_segment.regions.layers import (
-    add_existing_region_segmentation,
-    add_new_region_layer,
-)
-
-from brainreg_segment.regions.analysis import region_analysis
 from brainreg_segment.layout.gui_constants import (
     COLUMN_WIDTH,
     SEGM_METHODS_PANEL_ALIGN,
     CALCULATE_VOLUMES_DEFAULT,
     SUMMARIZE_VOLUMES_DEFAULT,
+    ROLL_UP_VOLUMES_DEFAULT,
     BRUSH_SIZE,
     IMAGE_FILE_EXT,
+    IMAGE_COMPRESSION,
+    LOAD_REGIONS_LAZILY,
+    LOAD_IN_BACKGROUND,
+    LOAD_N_THREADS,
     NUM_COLORS,
 )
 
@@ -38,8 +37,13 @@ class RegionSeg(QGroupBox):
         parent,
         calculate_volumes_default=CALCULATE_VOLUMES_DEFAULT,
         summarise_volumes_default=SUMMARIZE_VOLUMES_DEFAULT,
+        roll_up_volumes_default=ROLL_UP_VOLUMES_DEFAULT,
         brush_size=BRUSH_SIZE,
         image_file_extension=IMAGE_FILE_EXT,
+        image_compression=IMAGE_COMPRESSION,
+        load_lazily=LOAD_REGIONS_LAZILY,
+        load_in_background=LOAD_IN_BACKGROUND,
+        load_n_threads=LOAD_N_THREADS,
         num_colors=NUM_COLORS,
     ):
 
@@ -48,6 +52,7 @@ class RegionSeg(QGroupBox):
 
         self.calculate_volumes_default = calculate_volumes_default
         self.summarise_volumes_default = summarise_volumes_default
+        self.roll_up_volumes_default = roll_up_volumes_default
 
         # Brushes / ...
         self.brush_size_default = BRUSH_SIZE  # Keep track of default
@@ -56,6 +61,10 @@ class RegionSeg(QGroupBox):
 
         # File formats
         self.image_file_extension = image_file_extension
+        self.image_compression = image_compression
+        self.load_lazily = load_lazily
+        self.load_in_background = load_in_background
+        self.load_n_threads = load_n_threads
 
     def add_region_panel(self, row):
         self.region_panel = QGroupBox("Region analysis")
@@ -65,7 +74,7 @@ class RegionSeg(QGroupBox):
             "Add region",
             region_layout,
             self.add_region,
-            2,
+            3,
             0,
         )
 
@@ -73,7 +82,7 @@ class RegionSeg(QGroupBox):
             "Analyse regions",
             region_layout,
             self.run_region_analysis,
-            2,
+            3,
             1,
         )
 
@@ -91,6 +100,13 @@ class RegionSeg(QGroupBox):
             1,
         )
 
+        self.roll_up_volumes_checkbox = add_checkbox(
+            region_layout,
+            self.roll_up_volumes_default,
+            "Include parent structures",
+            2,
+        )
+
         region_layout.setColumnMinimumWidth(1, COLUMN_WIDTH)
         self.region_panel.setLayout(region_layout)
         self.parent.layout.addWidget(self.region_panel, row, 0, 1, 2)
@@ -126,14 +142,55 @@ class RegionSeg(QGroupBox):
                 )
 
     def check_saved_region(self):
+        """
+        Load any saved regions. If loading in the background, return the
+        (unstarted) worker that does so, which adds each region as it loads.
+        """
+        from brainreg_segment.regions.layers import (
+            add_existing_region_segmentation,
+            get_region_files,
+            load_region_files,
+        )
+
+        if self.load_in_background:
+            label_files = get_region_files(
+                self.parent.paths.regions_directory, self.image_file_extension
+            )
+            if not label_files:
+                return None
+            worker = load_region_files(
+                label_files,
+                lazy=self.load_lazily,
+                n_threads=self.load_n_threads,
+            )
+            worker.yielded.connect(self.add_loaded_region)
+            return worker
+
         add_existing_region_segmentation(
             self.parent.paths.regions_directory,
             self.parent.viewer,
             self.parent.label_layers,
             self.image_file_extension,
+            lazy=self.load_lazily,
+        )
+
+    def add_loaded_region(self, loaded):
+        from brainreg_segment.regions.layers import add_existing_label_layers
+
+        n, n_files, label_file, labels = loaded
+        self.parent.status_label.setText(f"Loaded region {n}/{n_files}")
+        self.parent.label_layers.append(
+            add_existing_label_layers(
+                self.parent.viewer,
+                label_file,
+                lazy=self.load_lazily,
+                labels=labels,
+            )
         )
 
     def add_region(self):
+        from brainreg_segment.regions.layers import add_new_region_layer
+
         print("Adding a new region\n")
         self.region_panel.setVisible(True)  # Should be visible by default!
         add_new_region_layer(
@@ -145,6 +202,8 @@ class RegionSeg(QGroupBox):
         )
 
     def run_region_analysis(self):
+        from brainreg_segment.regions.analysis import region_analysis
+
         if self.parent.label_layers:
             choice = display_warning(
                 self.parent,
@@ -162,6 +221,7 @@ class RegionSeg(QGroupBox):
                     output_csv_file=self.parent.paths.region_summary_csv,
                     volumes=self.calculate_volumes_checkbox.isChecked(),
                     summarise=self.summarise_volumes_checkbox.isChecked(),
+                    roll_up=self.roll_up_volumes_checkbox.isChecked(),
                 )
                 worker.start()
             else:
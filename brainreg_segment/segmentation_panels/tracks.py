@@ -13,14 +13,6 @@ from brainreg_segment.layout.gui_elements import (
     add_float_box,
     add_int_box,
 )
-from brainreg_segment.tracks.layers import (
-    add_new_track_layer,
-    add_existing_track_layers,
-)
-from brainreg_segment.image.utils import create_KDTree_from_image
-
-from brainreg_segment.tracks.analysis import track_analysis
-
 from brainreg_segment.layout.utils import display_warning
 from brainreg_segment.layout.gui_constants import (
     COLUMN_WIDTH,
@@ -32,6 +24,7 @@ from brainreg_segment.layout.gui_constants import (
     SPLINE_SMOOTHING_DEFAULT,
     FIT_DEGREE_DEFAULT,
     SUMMARISE_TRACK_DEFAULT,
+    LOAD_IN_BACKGROUND,
 )
 
 
@@ -51,6 +44,7 @@ class TrackSeg(QGroupBox):
         spline_smoothing_default=SPLINE_SMOOTHING_DEFAULT,
         fit_degree_default=FIT_DEGREE_DEFAULT,
         summarise_track_default=SUMMARISE_TRACK_DEFAULT,
+        load_in_background=LOAD_IN_BACKGROUND,
     ):
 
         super(TrackSeg, self).__init__()
@@ -70,6 +64,7 @@ class TrackSeg(QGroupBox):
 
         # File formats
         self.track_file_extension = track_file_extension
+        self.load_in_background = load_in_background
 
         # Initialise spline and spline names
         self.splines = None
@@ -173,12 +168,26 @@ class TrackSeg(QGroupBox):
                 )
 
     def check_saved_track(self):
+        """
+        Load any saved tracks. If loading in the background, return the
+        (unstarted) worker that does so, which adds each track as it loads.
+        """
+        from brainreg_segment.tracks.layers import (
+            add_existing_track_layers,
+            load_track_files,
+        )
+
         track_files = glob(
             str(self.parent.paths.tracks_directory)
             + "/*"
             + self.track_file_extension
         )
         if self.parent.paths.tracks_directory.exists() and track_files != []:
+            if self.load_in_background:
+                worker = load_track_files(track_files)
+                worker.yielded.connect(self.add_loaded_track)
+                return worker
+
             for track_file in track_files:
                 self.parent.track_layers.append(
                     add_existing_track_layers(
@@ -188,7 +197,19 @@ class TrackSeg(QGroupBox):
                     )
                 )
 
+    def add_loaded_track(self, loaded):
+        from brainreg_segment.tracks.layers import add_existing_track_layers
+
+        track_file, points = loaded
+        self.parent.track_layers.append(
+            add_existing_track_layers(
+                self.parent.viewer, track_file, self.point_size, points=points
+            )
+        )
+
     def add_track(self):
+        from brainreg_segment.tracks.layers import add_new_track_layer
+
         print("Adding a new track\n")
         self.splines = None
         self.spline_names = None
@@ -200,6 +221,8 @@ class TrackSeg(QGroupBox):
         )
 
     def add_surface_points(self):
+        from brainreg_segment.image.utils import get_nearest_point
+
         if self.parent.track_layers:
             print("Adding surface points (this may take a while)")
             if self.tree is None:
@@ -207,22 +230,55 @@ class TrackSeg(QGroupBox):
 
             for track_layer in self.parent.track_layers:
                 try:
-                    _, index = self.tree.query(track_layer.data[0])
+                    surface_point = get_nearest_point(
+                        self.tree,
+                        self.parent.atlas_layer.data,
+                        track_layer.data[0],
+                    )
                 except IndexError:
                     print(
                         f"{track_layer.name} does not appear to hold any data"
                     )
                     continue
-                surface_point = self.tree.data[index]
                 track_layer.data = np.vstack((surface_point, track_layer.data))
             print("Finished!\n")
         else:
             print("No tracks found.")
 
     def create_brain_surface_tree(self):
-        self.tree = create_KDTree_from_image(self.parent.atlas_layer.data)
+        from brainreg_segment.cache import get_surface_points_cache_file
+        from brainreg_segment.image.utils import create_KDTree_from_image
+
+        cache_file = get_surface_points_cache_file(
+            self.parent.atlas,
+            self.parent.atlas_layer.data,
+            standard_space=self.parent.standard_space,
+            surface_only=True,
+        )
+        self.tree = create_KDTree_from_image(
+            self.parent.atlas_layer.data,
+            surface_only=True,
+            cache_file=cache_file,
+        )
+
+    def add_track_fits(self, fits):
+        from brainreg_segment.tracks.analysis import add_spline_layers
+
+        self.splines, self.spline_names = fits
+        add_spline_layers(
+            self.parent.viewer,
+            self.splines,
+            self.spline_names,
+            self.spline_size,
+        )
+        print("Finished!\n")
 
     def run_track_analysis(self):
+        from brainreg_segment.tracks.analysis import (
+            get_tracks_from_layers,
+            track_analysis_worker,
+        )
+
         if self.parent.track_layers:
             choice = display_warning(
                 self.parent,
@@ -231,18 +287,17 @@ class TrackSeg(QGroupBox):
             )
             if choice:
                 print("Running track analysis")
-                self.splines, self.spline_names = track_analysis(
-                    self.parent.viewer,
+                worker = track_analysis_worker(
+                    get_tracks_from_layers(self.parent.track_layers),
                     self.parent.atlas,
                     self.parent.paths.tracks_directory,
-                    self.parent.track_layers,
-                    self.spline_size,
                     spline_points=self.spline_points.value(),
                     fit_degree=self.fit_degree.value(),
                     spline_smoothing=self.spline_smoothing.value(),
                     summarise_track=self.summarise_track_checkbox.isChecked(),
                 )
-                print("Finished!\n")
+                worker.returned.connect(self.add_track_fits)
+                worker.start()
             else:
                 print("Preventing analysis as user chose 'Cancel'")
         else:
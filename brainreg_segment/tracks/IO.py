@@ -1,22 +1,43 @@
 import pandas as pd
 import numpy as np
 
+from brainreg_segment.manifest import (
+    is_saved,
+    load_manifest,
+    record_saved,
+    save_manifest,
+)
+
 
 def save_track_layers(
     tracks_directory,
     points_layers,
     track_file_extension=".points",
 ):
+    """
+    Saves tracks to file, skipping any that are already saved (unchanged)
+    according to the manifest of the tracks directory
+    """
     print(f"Saving tracks to: {tracks_directory}")
     tracks_directory.mkdir(parents=True, exist_ok=True)
+    manifest = load_manifest(tracks_directory)
 
     for points_layer in points_layers:
+        filename = tracks_directory / (
+            points_layer.name + track_file_extension
+        )
+        saved, layer_hash = is_saved(points_layer, filename, manifest)
+        if saved:
+            continue
+
         save_single_track(
             points_layer.data,
             points_layer.name,
             tracks_directory,
             track_file_extension=track_file_extension,
         )
+        record_saved(points_layer, filename, manifest, layer_hash)
+    save_manifest(tracks_directory, manifest)
 
 
 def save_single_track(
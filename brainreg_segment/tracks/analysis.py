@@ -1,5 +1,9 @@
 import pandas as pd
 import numpy as np
+
+from concurrent.futures import ThreadPoolExecutor
+
+from brainreg_segment.atlas.structures import get_structure_table
 from brainreg_segment.tracks.fit import spline_fit
 
 
@@ -13,21 +17,92 @@ def track_analysis(
     fit_degree=3,
     spline_smoothing=0.05,
     summarise_track=True,
+    n_workers=None,
+):
+    splines, spline_names = fit_tracks(
+        get_tracks_from_layers(track_layers),
+        atlas,
+        tracks_directory,
+        spline_points=spline_points,
+        fit_degree=fit_degree,
+        spline_smoothing=spline_smoothing,
+        summarise_track=summarise_track,
+        n_workers=n_workers,
+    )
+    add_spline_layers(viewer, splines, spline_names, napari_spline_size)
+    return splines, spline_names
+
+
+def track_analysis_worker(*args, **kwargs):
+    """
+    Run fit_tracks in a background thread. The (splines, spline_names)
+    tuple is returned, so the layers can be added from the main thread.
+    napari is only imported when needed, so analyses can be run without it.
+    Takes the same arguments as fit_tracks.
+    :return: napari FunctionWorker (not started)
+    """
+    from napari.qt.threading import thread_worker
+
+    return thread_worker(fit_tracks)(*args, **kwargs)
+
+
+def get_tracks_from_layers(track_layers):
+    """
+    Copy the points of the (non-empty) track layers, so they can be analysed
+    while the layers are edited
+    :param track_layers: napari points layers
+    :return: List of (name, points) tuples
+    """
+    return [
+        (track_layer.name, np.array(track_layer.data))
+        for track_layer in track_layers
+        if len(track_layer.data) != 0
+    ]
+
+
+def fit_tracks(
+    tracks,
+    atlas,
+    tracks_directory,
+    spline_points=100,
+    fit_degree=3,
+    spline_smoothing=0.05,
+    summarise_track=True,
+    n_workers=None,
 ):
+    """
+    Fit splines to, and analyse the anatomy of, many tracks concurrently
+    (in a pool of threads)
+
+    :param tracks: List of (name, points) tuples
+    :param atlas: brainglobe atlas class
+    :param tracks_directory: Where to save the results to
+    :param spline_points: How many points used to define each interpolated
+    path
+    :param fit_degree: spline fit degree
+    :param spline_smoothing: spline fit smoothing factor
+    :param summarise_track: If True, save a csv with the atlas region for
+    all parts of each spline fit
+    :param n_workers: Maximum number of threads. If None, chosen by
+    concurrent.futures.ThreadPoolExecutor
+    :return: Tuple (splines, spline_names)
+    """
     tracks_directory.mkdir(parents=True, exist_ok=True)
 
     print(
         f"Fitting splines with {spline_points} segments, of degree "
         f"'{fit_degree}' to the points"
     )
-    splines = []
-    spline_names = []
-
-    for track_layer in track_layers:
-        if len(track_layer.data) != 0:
-            spline = run_track_analysis(
-                track_layer.data,
-                track_layer.name,
+    if summarise_track:
+        # Load the (lazily loaded) annotations once, before using threads
+        atlas.annotation
+
+    with ThreadPoolExecutor(max_workers=n_workers) as executor:
+        futures = [
+            executor.submit(
+                run_track_analysis,
+                points,
+                name,
                 tracks_directory,
                 atlas,
                 summarise_track=summarise_track,
@@ -35,21 +110,32 @@ def track_analysis(
                 spline_points=spline_points,
                 fit_degree=fit_degree,
             )
+            for name, points in tracks
+        ]
+        splines = [future.result() for future in futures]
 
-            splines.append(spline)
+    spline_names = [name for name, _ in tracks]
+    return splines, spline_names
 
-            viewer.add_points(
-                spline,
-                size=napari_spline_size,
-                edge_color="cyan",
-                face_color="cyan",
-                blending="additive",
-                opacity=0.7,
-                name=track_layer.name + "_fit",
-            )
 
-            spline_names.append(track_layer.name)
-    return splines, spline_names
+def add_spline_layers(viewer, splines, spline_names, napari_spline_size):
+    """
+    Add fitted splines to the viewer (must be called from the main thread)
+    :param viewer: napari viewer
+    :param splines: List of numpy arrays defining the spline interpolations
+    :param spline_names: Names of the tracks
+    :param napari_spline_size: Size of the points in the viewer
+    """
+    for spline, name in zip(splines, spline_names):
+        viewer.add_points(
+            spline,
+            size=napari_spline_size,
+            edge_color="cyan",
+            face_color="cyan",
+            blending="additive",
+            opacity=0.7,
+            name=name + "_fit",
+        )
 
 
 def run_track_analysis(
@@ -101,39 +187,41 @@ def analyse_track_anatomy(atlas, spline, file_path):
     :param atlas: brainglobe atlas class
     :param spline: numpy array defining the spline interpolation
     :param file_path: path to save the results to
-    :param bool verbose: Whether to print the progress
     """
-    spline_regions = []
-    for p in spline.tolist():
-        try:
-            spline_regions.append(
-                atlas.structures[atlas.structure_from_coords(p)]
-            )
-        except KeyError:
-            spline_regions.append(None)
+    df = get_track_anatomy(atlas, spline)
+    df.to_csv(file_path, index=False)
 
-    df = pd.DataFrame(
-        columns=["Position", "Region ID", "Region acronym", "Region name"]
+
+def get_track_anatomy(atlas, spline, not_found="Not found in brain"):
+    """
+    For a given spline, find the atlas region that each "segment" is in.
+    All points are looked up in the atlas annotations, and the structure
+    table of the atlas, at once.
+
+    :param atlas: brainglobe atlas class
+    :param spline: numpy array defining the spline interpolation
+    :param not_found: Value used for points outside the atlas structures
+    :return: pandas dataframe with one row per point
+    """
+    annotation = atlas.annotation
+    coords = np.asarray(spline).astype(int)
+    in_image = np.all((coords >= 0) & (coords < annotation.shape), axis=1)
+
+    structure_ids = np.zeros(len(coords), dtype=annotation.dtype)
+    structure_ids[in_image] = annotation[tuple(coords[in_image].T)]
+
+    table = get_structure_table(atlas)
+    index, found = table.index_of(structure_ids)
+    regions = np.full((len(coords), 3), not_found, dtype=object)
+    regions[found, 0] = table.structure_ids[index[found]].tolist()
+    regions[found, 1] = table.acronyms[index[found]]
+    regions[found, 2] = table.names[index[found]]
+
+    return pd.DataFrame(
+        {
+            "Position": np.arange(len(coords)),
+            "Region ID": regions[:, 0],
+            "Region acronym": regions[:, 1],
+            "Region name": regions[:, 2],
+        }
     )
-    for idx, spline_region in enumerate(spline_regions):
-        if spline_region is None:
-            df = df.append(
-                {
-                    "Position": idx,
-                    "Region ID": "Not found in brain",
-                    "Region acronym": "Not found in brain",
-                    "Region name": "Not found in brain",
-                },
-                ignore_index=True,
-            )
-        else:
-            df = df.append(
-                {
-                    "Position": idx,
-                    "Region ID": spline_region["id"],
-                    "Region acronym": spline_region["acronym"],
-                    "Region name": spline_region["name"],
-                },
-                ignore_index=True,
-            )
-    df.to_csv(file_path, index=False)
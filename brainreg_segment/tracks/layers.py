@@ -1,5 +1,8 @@
 import pandas as pd
 from pathlib import Path
+from napari.qt.threading import thread_worker
+
+from brainreg_segment.manifest import record_loaded, track_changes
 
 
 def add_new_track_layer(viewer, track_layers, point_size):
@@ -12,11 +15,13 @@ def add_new_track_layer(viewer, track_layers, point_size):
         name=f"track_{num}",
     )
     new_track_layers.mode = "ADD"
+    track_changes(new_track_layers)
     track_layers.append(new_track_layers)
 
 
-def add_existing_track_layers(viewer, track_file, point_size):
-    points = pd.read_hdf(track_file)
+def add_existing_track_layers(viewer, track_file, point_size, points=None):
+    if points is None:
+        points = pd.read_hdf(track_file)
     new_points_layer = viewer.add_points(
         points,
         n_dimensional=True,
@@ -24,4 +29,17 @@ def add_existing_track_layers(viewer, track_file, point_size):
         name=Path(track_file).stem,
     )
     new_points_layer.mode = "ADD"
+    track_changes(new_points_layer)
+    record_loaded(new_points_layer, track_file)
     return new_points_layer
+
+
+@thread_worker
+def load_track_files(track_files):
+    """
+    Loads saved tracks in the background
+    :param track_files: List of track files
+    :return: Generator of (file, points) tuples, as each is loaded
+    """
+    for track_file in track_files:
+        yield track_file, pd.read_hdf(track_file)
@@ -14,6 +14,7 @@ requirements = [
     "napari-plugin-engine >= 0.1.4",
     "imlib >= 0.0.26",
     "dask >= 2.15.0",
+    "zarr",
     "imio",
     "brainglobe-napari-io",
 ]
@@ -43,6 +44,7 @@ setup(
     entry_points={
         "console_scripts": [
             "brainreg-segment = brainreg_segment.segment:main",
+            "brainreg-segment-analyse = brainreg_segment.analyse:main",
         ],
         "napari.plugin": ["brainreg-segment = brainreg_segment.plugins"],
     },
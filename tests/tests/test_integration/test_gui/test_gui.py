@@ -62,7 +62,7 @@ def test_general(make_test_viewer):
     check_paths(widget)
 
 
-def test_tracks(tmpdir, make_test_viewer, rtol=1e-10):
+def test_tracks(tmpdir, qtbot, make_test_viewer, rtol=1e-10):
     tmp_input_dir = tmpdir / "brainreg_output"
     test_tracks_dir = (
         tmp_input_dir / "manual_segmentation" / "standard_space" / "tracks"
@@ -90,6 +90,7 @@ def test_tracks(tmpdir, make_test_viewer, rtol=1e-10):
 
     # analysis
     widget.track_seg.run_track_analysis()
+    qtbot.waitUntil(lambda: widget.track_seg.splines is not None)
     regions_validate = pd.read_csv(validate_tracks_dir / "test_track.csv")
     regions_test = pd.read_csv(test_tracks_dir / "test_track.csv")
     pd.testing.assert_frame_equal(regions_validate, regions_test)
@@ -0,0 +1,103 @@
+import sys
+import json
+import subprocess
+
+import numpy as np
+
+from pathlib import Path
+from types import SimpleNamespace
+
+from brainreg_segment import analyse
+from brainreg_segment.paths import Paths
+from brainreg_segment.regions import IO as region_IO
+from brainreg_segment.regions.IO import save_image
+from brainreg_segment.tracks.IO import save_single_track
+
+LEFT = 1
+RIGHT = 2
+
+
+def make_atlas():
+    annotation = np.zeros((20, 30, 40), dtype=np.uint32)
+    annotation[2:18, 3:27, 4:36] = 10
+    annotation[5:15, 5:25, 5:35] = 20
+    hemispheres = np.full(annotation.shape, LEFT, dtype=np.uint8)
+    hemispheres[:, :, 20:] = RIGHT
+    structures = {
+        10: {"id": 10, "acronym": "A", "name": "Structure a"},
+        20: {"id": 20, "acronym": "B", "name": "Structure b"},
+    }
+    return SimpleNamespace(
+        annotation=annotation,
+        hemispheres=hemispheres,
+        structures=structures,
+        resolution=(50, 50, 50),
+        left_hemisphere_value=LEFT,
+        right_hemisphere_value=RIGHT,
+    )
+
+
+def make_brainreg_directory(directory):
+    directory.mkdir()
+    with open(directory / analyse.BRAINREG_METADATA_FILE, "w") as f:
+        json.dump({"atlas": "test_atlas"}, f)
+
+    paths = Paths(directory)
+    paths.regions_directory.mkdir(parents=True)
+    region = np.zeros((20, 30, 40), dtype=np.int16)
+    region[6:10, 10:20, 15:25] = 1
+    save_image(region, paths.regions_directory / "region.tiff")
+
+    paths.tracks_directory.mkdir(parents=True)
+    points = np.array([[3, 5, 8], [5, 8, 12], [8, 12, 17], [10, 16, 21]])
+    save_single_track(points, "track", paths.tracks_directory)
+    return paths
+
+
+def test_analyse_brains(tmpdir, monkeypatch):
+    tmpdir = Path(tmpdir)
+    monkeypatch.setattr(analyse, "load_atlas", lambda directory: make_atlas())
+    loaded = []
+
+    def load_image(filename, lazy=False):
+        loaded.append(lazy)
+        return region_IO.load_image(filename, lazy=lazy)
+
+    monkeypatch.setattr(analyse, "load_image", load_image)
+    all_paths = [
+        make_brainreg_directory(tmpdir / f"brain_{i}") for i in range(2)
+    ]
+    (tmpdir / "not_brainreg").mkdir()
+
+    results = dict(
+        analyse.analyse_brains(
+            [paths.brainreg_directory for paths in all_paths]
+            + [tmpdir / "not_brainreg"],
+            n_processes=1,
+            spline_points=10,
+        )
+    )
+
+    assert results[tmpdir / "not_brainreg"] is not None
+    for paths in all_paths:
+        assert results[paths.brainreg_directory] is None
+        assert (paths.regions_directory / "region.csv").exists()
+        assert paths.region_summary_csv.exists()
+        assert (paths.tracks_directory / "track.csv").exists()
+    # regions are read as they are analysed, rather than all loaded at once
+    assert loaded == [True, True]
+
+
+def test_analyse_without_napari():
+    modules = subprocess.run(
+        [
+            sys.executable,
+            "-c",
+            "import sys, brainreg_segment.analyse; "
+            "print(' '.join(sys.modules))",
+        ],
+        capture_output=True,
+        text=True,
+        check=True,
+    ).stdout.split()
+    assert not {"napari", "qtpy", "PyQt5", "PySide2"} & set(modules)
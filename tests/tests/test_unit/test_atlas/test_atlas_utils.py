@@ -1,4 +1,11 @@
+import configparser
+
 import numpy as np
+import pytest
+
+from pathlib import Path
+
+from brainreg_segment import cache
 from brainreg_segment.atlas import utils as atlas_utils
 
 from bg_atlasapi import BrainGlobeAtlas
@@ -16,6 +23,67 @@ def test_get_available_atlases():
     assert float(atlases["mpin_zfish_1um"]) >= 0.4
 
 
+@pytest.fixture
+def offline(tmpdir, monkeypatch):
+    """
+    Use a temporary brainglobe directory, and record attempts to fetch the
+    list of atlases, which fail as if offline
+    """
+    tmpdir = Path(tmpdir)
+    (tmpdir / "allen_mouse_25um_v1.2").mkdir()
+    (tmpdir / "example_mouse_100um_v1.0").mkdir()
+    monkeypatch.setattr(
+        atlas_utils.config, "get_brainglobe_dir", lambda: tmpdir
+    )
+    monkeypatch.setattr(
+        cache, "get_cache_directory", lambda: tmpdir / "brainreg-segment"
+    )
+
+    fetched = []
+
+    def conf_from_url(url):
+        fetched.append(url)
+        raise ConnectionError("offline")
+
+    monkeypatch.setattr(atlas_utils.utils, "conf_from_url", conf_from_url)
+    return fetched
+
+
+def test_get_available_atlases_offline(offline):
+    assert atlas_utils.get_available_atlases() == {
+        "allen_mouse_25um": "1.2",
+        "example_mouse_100um": "1.0",
+    }
+    assert len(offline) == 1
+    assert atlas_utils.get_available_atlases(fetch=False)
+    assert len(offline) == 1
+
+    # an expired cache is still used if the list can't be fetched
+    cache.save_atlas_list_to_cache({"allen_mouse_10um": "1.2"})
+    assert atlas_utils.get_available_atlases(ttl=0) == {
+        "allen_mouse_10um": "1.2"
+    }
+    assert len(offline) == 2
+
+
+def test_get_available_atlases_cached(offline, monkeypatch):
+    conf = configparser.ConfigParser()
+    conf.read_dict({"atlases": {"allen_mouse_10um": "1.2"}})
+    monkeypatch.setattr(
+        atlas_utils.utils,
+        "conf_from_url",
+        lambda url: offline.append(url) or conf,
+    )
+    assert atlas_utils.get_available_atlases() == {"allen_mouse_10um": "1.2"}
+    assert atlas_utils.get_available_atlases() == {"allen_mouse_10um": "1.2"}
+    assert len(offline) == 1
+
+    atlases, age = cache.load_cached_atlas_list()
+    assert atlases == {"allen_mouse_10um": "1.2"}
+    atlas_utils.get_available_atlases(ttl=age / 2)
+    assert len(offline) == 2
+
+
 def test_lateralise_atlas_image():
     atlas = BrainGlobeAtlas(atlas_name)
 
@@ -0,0 +1,200 @@
+import re
+import time
+
+import numpy as np
+import pytest
+
+from pathlib import Path
+from types import SimpleNamespace
+from napari.layers import Labels
+
+from brainreg_segment.atlas import structures as atlas_structures
+
+# root (997) -> a (8) -> b (20), c (30)
+#            -> d (40)
+structures = {
+    997: {"name": "root", "acronym": "root", "structure_id_path": [997]},
+    8: {
+        "name": "a, layer 1",
+        "acronym": "A",
+        "structure_id_path": [997, 8],
+    },
+    20: {"name": "b", "acronym": "B", "structure_id_path": [997, 8, 20]},
+    30: {"name": "c", "acronym": "C", "structure_id_path": [997, 8, 30]},
+    40: {"name": "d", "acronym": "D", "structure_id_path": [997, 40]},
+}
+
+
+def test_roll_up():
+    index = atlas_structures.AncestorIndex(structures)
+    structure_ids, left, right = index.roll_up(
+        np.array([0, 20, 30, 40, 50]),
+        np.array([7, 1, 2, 0, 9]),
+        np.array([7, 3, 0, 4, 9]),
+    )
+
+    # 0 (outside the atlas) and 50 (unknown) are ignored
+    np.testing.assert_array_equal(structure_ids, [8, 20, 30, 40, 997])
+    np.testing.assert_array_equal(left, [3, 1, 2, 0, 3])
+    np.testing.assert_array_equal(right, [3, 3, 0, 4, 7])
+
+
+def test_get_ancestor_index():
+    atlas = SimpleNamespace(
+        atlas_name="test_atlas",
+        metadata={"version": "0.1"},
+        structures=structures,
+    )
+    index = atlas_structures.get_ancestor_index(atlas)
+    assert atlas_structures.get_ancestor_index(atlas) is index
+
+    atlas.metadata = {"version": "0.2"}
+    assert atlas_structures.get_ancestor_index(atlas) is not index
+
+
+def test_structure_table(tmpdir):
+    tmpdir = Path(tmpdir)
+    table = atlas_structures.StructureTable.from_structures(structures)
+    index, found = table.index_of([20, 0, 997, 50, 8])
+    np.testing.assert_array_equal(found, [True, False, True, False, True])
+    assert list(table.names[index[found]]) == ["b", "root", "a, layer 1"]
+    assert list(table.acronyms[index[found]]) == ["B", "root", "A"]
+    np.testing.assert_array_equal(table.parents[index[found]], [8, -1, 997])
+    np.testing.assert_array_equal(table.depths[index[found]], [2, 0, 1])
+
+    table.save(tmpdir / "structures.npz")
+    loaded = atlas_structures.StructureTable.load(tmpdir / "structures.npz")
+    for attribute in ("structure_ids", "acronyms", "names", "parents"):
+        np.testing.assert_array_equal(
+            getattr(loaded, attribute), getattr(table, attribute)
+        )
+    assert type(loaded.names[0]) is str
+
+
+def test_get_structure_table(tmpdir):
+    tmpdir = Path(tmpdir)
+    atlas = SimpleNamespace(
+        atlas_name="test_atlas",
+        metadata={"version": "0.1"},
+        structures=structures,
+    )
+    cache_file = tmpdir / "test_atlas_v0.1.npz"
+    table = atlas_structures.get_structure_table(atlas, cache_file=cache_file)
+    assert cache_file.exists()
+    assert atlas_structures.get_structure_table(atlas) is table
+
+    # loaded from the cache, rather than built again
+    atlas.metadata = {"version": "0.2"}
+    atlas.structures = {}
+    cached = atlas_structures.get_structure_table(atlas, cache_file=cache_file)
+    np.testing.assert_array_equal(cached.structure_ids, table.structure_ids)
+
+
+annotation = np.zeros((20, 30, 40), dtype=np.uint32)
+annotation[2:18, 3:27, 4:36] = 997
+annotation[5:15, 5:25, 5:35] = 8
+annotation[8:12, 10:20, 10:20] = 20
+annotation[8:12, 10:20, 20:30] = 30
+annotation[:, 25:27, :] = 40
+annotation[10, 15, 15] = 50  # not in the atlas structures
+hemispheres = np.ones(annotation.shape, dtype=np.uint8)
+hemispheres[:, :, 20:] = 2
+
+
+def legacy_region_info(status, annotation, hemispheres, structures):
+    # region info from the viewer status, as found by
+    # atlas.utils.structure_from_viewer
+    try:
+        coords = re.findall(r"\[\d{1,5}\s+\d{1,5}\s+\d{1,5}\]", status)[0][
+            1:-1
+        ]
+        coord_list = tuple(map(int, coords.split()))
+    except (IndexError, ValueError):
+        return ""
+    try:
+        structure_no = annotation[coord_list]
+    except IndexError:
+        return ""
+    if structure_no in [0]:
+        return ""
+    try:
+        structure = structures[structure_no]["name"]
+    except KeyError:
+        return ""
+    region_info = [part.strip().capitalize() for part in structure.split(",")]
+    region_info.append(
+        ["left", "right"][hemispheres[coord_list] - 1].capitalize()
+    )
+    return " | ".join(region_info)
+
+
+def get_status(voxel):
+    return f"Annotation [{voxel[0]} {voxel[1]} {voxel[2]}]: 1"
+
+
+def test_region_info():
+    region_info = atlas_structures.RegionInfo(
+        annotation, hemispheres, structures
+    )
+    assert region_info.at((6, 6, 6)) == "A | Layer 1 | Left"
+    assert region_info.at((9, 11, 25)) == "C | Right"
+
+    for voxel in np.ndindex(annotation.shape):
+        assert region_info.at(voxel) == legacy_region_info(
+            get_status(voxel), annotation, hemispheres, structures
+        )
+    for voxel in [(-1, 5, 5), (5, 30, 5), (5, 5)]:
+        assert region_info.at(voxel) == ""
+
+
+def test_region_info_memoised():
+    region_info = atlas_structures.RegionInfo(
+        annotation.copy(), hemispheres, structures
+    )
+    assert region_info.at((9, 11, 11)) == "B | Left"
+    region_info.annotation[9, 11, 11] = 40
+    assert region_info.at((9, 11, 11)) == "B | Left"
+    assert region_info.at((9, 11, 12)) == "B | Left"
+    assert region_info.at((9, 11, 11)) == "D | Left"
+
+
+def test_region_info_at_position():
+    atlas_layer = Labels(annotation, scale=(2, 2, 2), translate=(10, 0, 0))
+    region_info = atlas_structures.RegionInfo(
+        annotation, hemispheres, structures
+    )
+    assert region_info.at_position(atlas_layer, (28, 22.8, 49.2)) == (
+        region_info.at((9, 11, 25))
+    )
+    assert region_info.at_position(atlas_layer, (0, 22, 50)) == ""
+
+
+@pytest.mark.slow
+def test_region_info_benchmark():
+    n_events = 10_000
+    rng = np.random.default_rng(0)
+    voxels = [
+        tuple(voxel)
+        for voxel in rng.integers(0, annotation.shape, (n_events, 3)).tolist()
+    ]
+    statuses = [get_status(voxel) for voxel in voxels]
+    region_info = atlas_structures.RegionInfo(
+        annotation, hemispheres, structures
+    )
+
+    start = time.perf_counter()
+    info = [region_info.at(voxel) for voxel in voxels]
+    lookup_time = time.perf_counter() - start
+
+    start = time.perf_counter()
+    expected = [
+        legacy_region_info(status, annotation, hemispheres, structures)
+        for status in statuses
+    ]
+    legacy_time = time.perf_counter() - start
+
+    print(
+        f"Region info per mouse move: {1e6 * lookup_time / n_events:.2f}us "
+        f"(previously {1e6 * legacy_time / n_events:.2f}us)"
+    )
+    assert info == expected
@@ -1,5 +1,9 @@
 import numpy as np
-from brainreg_segment.image.utils import create_KDTree_from_image
+from brainreg_segment.image.utils import (
+    create_KDTree_from_image,
+    get_bounding_box,
+    get_nearest_point,
+)
 
 image = np.array(
     (
@@ -37,3 +41,78 @@ def test_create_KDTree_from_image():
 
     tree = create_KDTree_from_image(image, value=1)
     assert (tree.data == data_1).all()
+
+
+def test_create_KDTree_from_image_cache(tmpdir):
+    cache_file = tmpdir / "surface_points" / "points.npy"
+    tree = create_KDTree_from_image(image, cache_file=cache_file)
+    assert (tree.data == data_0).all()
+    assert cache_file.exists()
+
+    # Points are loaded from the cache, rather than the (new) image
+    tree = create_KDTree_from_image(np.ones_like(image), cache_file=cache_file)
+    assert (tree.data == data_0).all()
+
+
+def test_create_KDTree_from_image_surface_only():
+    tree = create_KDTree_from_image(image, surface_only=True)
+    surface = np.array(
+        [[0, 2], [1, 1], [1, 3], [2, 0], [2, 3], [3, 1], [3, 2]]
+    )
+    assert (tree.data == surface).all()
+
+
+def test_surface_only_nearest_points():
+    # Nearest surface points (as used by "Add surface points") are unchanged
+    grid = np.indices((40, 50, 60)).transpose(1, 2, 3, 0)
+    brain = np.linalg.norm((grid - (20, 25, 30)) / (15, 20, 25), axis=-1) < 1
+    annotations = brain * 7
+
+    tree = create_KDTree_from_image(annotations)
+    surface_tree = create_KDTree_from_image(annotations, surface_only=True)
+    assert surface_tree.n < tree.n / 10
+
+    rng = np.random.default_rng(0)
+    inside = np.argwhere(brain)
+    points = inside[rng.choice(len(inside), 200)] + rng.uniform(
+        -0.49, 0.49, (200, 3)
+    )
+    for point in points:
+        distance, index = tree.query(point)
+        surface_distance, surface_index = surface_tree.query(point)
+        assert surface_distance == distance
+        assert (surface_tree.data[surface_index] == tree.data[index]).all()
+
+
+def test_get_nearest_point_outside():
+    # Also unchanged for points outside the brain, or the image
+    grid = np.indices((40, 50, 60)).transpose(1, 2, 3, 0)
+    brain = np.linalg.norm((grid - (20, 25, 30)) / (15, 20, 25), axis=-1) < 1
+    brain[:, :, :5] = True
+    annotations = brain * 7
+
+    tree = create_KDTree_from_image(annotations)
+    surface_tree = create_KDTree_from_image(annotations, surface_only=True)
+    rng = np.random.default_rng(0)
+    points = rng.uniform(-10, (50, 60, 70), (200, 3))
+    assert not brain[
+        tuple(np.clip(np.round(points), 0, (39, 49, 59)).astype(int).T)
+    ].all()
+    for point in points:
+        distance, index = tree.query(point)
+        nearest = get_nearest_point(surface_tree, annotations, point)
+        assert np.isclose(np.linalg.norm(nearest - point), distance)
+        assert (nearest == tree.data[index]).all()
+
+
+def test_get_bounding_box():
+    image = np.zeros((20, 30, 40), dtype=np.int16)
+    assert get_bounding_box(image) is None
+
+    image[3, 5:9, 39] = -2
+    image[12, 10, 20:25] = 4
+    assert get_bounding_box(image, chunk_size=4) == (
+        slice(3, 13),
+        slice(5, 11),
+        slice(20, 40),
+    )
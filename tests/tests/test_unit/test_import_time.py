@@ -0,0 +1,82 @@
+import sys
+import subprocess
+
+from pathlib import Path
+
+import brainreg_segment
+
+# Dependencies that should only be imported when they are used, not when
+# napari discovers the plugin or creates the widget
+HEAVY_DEPENDENCIES = {
+    "bg_atlasapi",
+    "bg_space",
+    "imlib",
+    "pandas",
+    "scipy",
+    "skimage",
+    "tifffile",
+    "zarr",
+}
+
+# Modules the widget needs anyway
+NAPARI_IMPORTS = "import napari, qtpy.QtWidgets, napari.qt.threading"
+
+# Generous limit on the time taken to import the plugin (seconds), to catch
+# e.g. a dependency of the widget being imported again when discovering it
+PLUGIN_IMPORT_TIME_LIMIT = 0.5
+
+
+def get_import_times(statement):
+    """
+    Run a statement in a new interpreter, with python -X importtime
+    :param statement: Python code, e.g. "import brainreg_segment"
+    :return: Dict of cumulative import time (in seconds), keyed by module
+    """
+    stderr = subprocess.run(
+        [sys.executable, "-X", "importtime", "-c", statement],
+        capture_output=True,
+        text=True,
+        check=True,
+        cwd=Path(brainreg_segment.__file__).parents[1],
+    ).stderr
+
+    import_times = {}
+    for line in stderr.splitlines():
+        if not line.startswith("import time:") or "|" not in line:
+            continue
+        _, cumulative, module = line.split("|")
+        if cumulative.strip().isdigit():
+            import_times[module.strip()] = int(cumulative) / 1e6
+    return import_times
+
+
+def get_packages(modules):
+    return {module.split(".")[0] for module in modules}
+
+
+def test_plugin_import_time():
+    import_times = get_import_times("import brainreg_segment.plugins")
+    print(
+        f"Importing the plugin took "
+        f"{import_times['brainreg_segment.plugins']:.3f}s"
+    )
+
+    assert not get_packages(import_times) & (
+        HEAVY_DEPENDENCIES | {"napari", "qtpy"}
+    )
+    assert import_times["brainreg_segment.plugins"] < PLUGIN_IMPORT_TIME_LIMIT
+
+
+def test_widget_import_time():
+    napari_modules = get_import_times(NAPARI_IMPORTS)
+    import_times = get_import_times(
+        f"{NAPARI_IMPORTS}; import brainreg_segment.segment"
+    )
+    print(
+        f"Importing the widget took "
+        f"{import_times['brainreg_segment.segment']:.3f}s "
+        f"(after importing napari)"
+    )
+
+    added = get_packages(set(import_times) - set(napari_modules))
+    assert not added & HEAVY_DEPENDENCIES
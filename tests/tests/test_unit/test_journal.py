@@ -0,0 +1,159 @@
+import numpy as np
+
+from pathlib import Path
+from types import SimpleNamespace
+from napari.layers import Labels, Points
+
+from brainreg_segment import journal
+
+
+def make_layers():
+    labels = Labels(np.zeros((100, 150, 200), dtype=np.int16), name="region")
+    points = Points(np.array([[1.0, 2.0, 3.0]]), name="track")
+    return labels, points
+
+
+def recover(journal_file, labels_shape=(100, 150, 200)):
+    label_changes, track_changes = journal.recover_journal(journal_file)
+    recovered = {}
+    for name, (shape, dtype, blocks) in label_changes.items():
+        assert shape == labels_shape
+        recovered[name] = np.zeros(shape, dtype=dtype)
+        journal.apply_blocks(recovered[name], blocks)
+    return recovered, track_changes
+
+
+def test_journal_recovery(tmpdir):
+    journal_file = Path(tmpdir) / "autosave.journal"
+    labels, points = make_layers()
+    autosave_journal = journal.Journal(journal_file, block_size=32)
+    autosave_journal.watch(labels)
+    autosave_journal.watch(points)
+
+    labels.brush_size = 5
+    labels.paint((10, 20, 30), 2, refresh=False)
+    autosave_journal.autosave([labels], [points])
+    labels.paint((70, 100, 190), 3, refresh=False)
+    points.add([4.0, 5.0, 6.0])
+    autosave_journal.autosave([labels], [points])
+    autosave_journal.wait()
+
+    recovered, track_changes = recover(journal_file)
+    np.testing.assert_array_equal(recovered["region"], labels.data)
+    np.testing.assert_array_equal(track_changes["track"], points.data)
+
+    # only the painted blocks are journaled
+    n_blocks = len(list(journal.read_journal(journal_file))) - 1
+    assert n_blocks <= 8 + 8
+    assert journal_file.stat().st_size < labels.data.nbytes / 10
+
+    autosave_journal.clear()
+    autosave_journal.wait()
+    assert journal.recover_journal(journal_file) == ({}, {})
+    autosave_journal.close()
+
+
+def test_journal_incomplete_record(tmpdir):
+    journal_file = Path(tmpdir) / "autosave.journal"
+    labels, points = make_layers()
+    autosave_journal = journal.Journal(journal_file)
+    autosave_journal.watch(labels)
+    labels.paint((10, 20, 30), 2, refresh=False)
+    autosave_journal.autosave([labels], [points])
+    autosave_journal.wait()
+    expected = labels.data.copy()
+
+    labels.paint((50, 50, 50), 4, refresh=False)
+    autosave_journal.autosave([labels], [points])
+    autosave_journal.close()
+
+    # as if writing the last record was interrupted
+    with open(journal_file, "r+b") as f:
+        f.truncate(journal_file.stat().st_size - 10)
+    recovered, track_changes = recover(journal_file)
+    np.testing.assert_array_equal(recovered["region"], expected)
+    assert track_changes == {}
+
+
+def test_journal_recovery_after_undo(tmpdir):
+    journal_file = Path(tmpdir) / "autosave.journal"
+    labels, points = make_layers()
+    autosave_journal = journal.Journal(journal_file, block_size=32)
+    autosave_journal.watch(labels)
+
+    labels.paint((10, 20, 30), 2, refresh=False)
+    autosave_journal.autosave([labels], [points])
+    labels.undo()
+    autosave_journal.autosave([labels], [points])
+    autosave_journal.wait()
+    recovered, _ = recover(journal_file)
+    assert not recovered["region"].any()
+
+    labels.redo()
+    autosave_journal.autosave([labels], [points])
+    autosave_journal.close()
+    recovered, _ = recover(journal_file)
+    np.testing.assert_array_equal(recovered["region"], labels.data)
+    assert labels.data[10, 20, 30] == 2
+
+
+def test_journal_clear_to_checkpoint(tmpdir):
+    journal_file = Path(tmpdir) / "autosave.journal"
+    labels, points = make_layers()
+    autosave_journal = journal.Journal(journal_file, block_size=32)
+    autosave_journal.watch(labels)
+
+    labels.paint((10, 20, 30), 2, refresh=False)
+    autosave_journal.autosave([labels], [points])
+    # e.g. when saving starts, and when another save starts
+    first_save = autosave_journal.checkpoint()
+    labels.paint((50, 60, 70), 3, refresh=False)
+    autosave_journal.autosave([labels], [points])
+    second_save = autosave_journal.checkpoint()
+    labels.paint((90, 100, 110), 4, refresh=False)
+    autosave_journal.autosave([labels], [points])
+
+    # changes autosaved after a save started are kept
+    autosave_journal.clear(first_save)
+    autosave_journal.wait()
+    recovered, _ = recover(journal_file)
+    assert not recovered["region"][10, 20, 30]
+    assert recovered["region"][50, 60, 70] == 3
+    assert recovered["region"][90, 100, 110] == 4
+
+    autosave_journal.clear(second_save)
+    autosave_journal.wait()
+    recovered, _ = recover(journal_file)
+    assert not recovered["region"][50, 60, 70]
+    assert recovered["region"][90, 100, 110] == 4
+
+    autosave_journal.clear()
+    autosave_journal.close()
+    assert journal.recover_journal(journal_file) == ({}, {})
+
+
+def test_journal_undo_without_history(tmpdir):
+    journal_file = Path(tmpdir) / "autosave.journal"
+    data = np.zeros((100, 150, 200), dtype=np.int16)
+    data[10, 20, 30] = 2
+    # e.g. a version of napari with a different undo history
+    layer = SimpleNamespace(name="region", data=data, ndim=data.ndim)
+    autosave_journal = journal.Journal(journal_file)
+    autosave_journal.mark_undone(layer, "undo")
+    autosave_journal.autosave([layer], [])
+    autosave_journal.close()
+
+    recovered, _ = recover(journal_file)
+    np.testing.assert_array_equal(recovered["region"], data)
+
+
+def test_get_blocks():
+    bounding_box = (slice(0, 1), slice(63, 65), slice(100, 200))
+    assert sorted(journal.get_blocks(bounding_box, 64)) == [
+        (0, 0, 1),
+        (0, 0, 2),
+        (0, 0, 3),
+        (0, 1, 1),
+        (0, 1, 2),
+        (0, 1, 3),
+    ]
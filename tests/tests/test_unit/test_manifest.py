@@ -0,0 +1,121 @@
+import numpy as np
+
+from pathlib import Path
+from napari.layers import Labels, Points
+
+from brainreg_segment import manifest
+from brainreg_segment.image import utils as image_utils
+from brainreg_segment.regions.IO import load_image, save_label_layers
+from brainreg_segment.tracks.IO import save_track_layers
+
+
+def make_label_layer(name="region"):
+    data = np.zeros((10, 20, 30), dtype=np.int16)
+    data[2:5, 5:10, 10:20] = 1
+    layer = Labels(data, name=name)
+    manifest.track_changes(layer)
+    return layer
+
+
+def count_hashes(monkeypatch):
+    hashed = []
+
+    def get_image_hash(data):
+        hashed.append(data)
+        return image_utils.get_image_hash(data)
+
+    monkeypatch.setattr(manifest, "get_image_hash", get_image_hash)
+    return hashed
+
+
+def test_save_label_layers_incrementally(tmpdir, monkeypatch):
+    tmpdir = Path(tmpdir)
+    layers = [make_label_layer("region"), make_label_layer("other")]
+    save_label_layers(tmpdir, layers)
+    assert set(manifest.load_manifest(tmpdir)) == {
+        "region.tiff",
+        "other.tiff",
+    }
+    modified = {f.name: f.stat().st_mtime_ns for f in tmpdir.glob("*.tiff")}
+
+    # unchanged, so not saved (or hashed) again
+    hashed = count_hashes(monkeypatch)
+    save_label_layers(tmpdir, layers)
+    assert not hashed
+    assert modified == {
+        f.name: f.stat().st_mtime_ns for f in tmpdir.glob("*.tiff")
+    }
+
+    layers[0].paint((3, 7, 15), 2, refresh=False)
+    save_label_layers(tmpdir, layers)
+    assert (tmpdir / "other.tiff").stat().st_mtime_ns == modified["other.tiff"]
+    assert load_image(tmpdir / "region.tiff")[3, 7, 15] == 2
+
+
+def test_save_label_layers_across_sessions(tmpdir, monkeypatch):
+    tmpdir = Path(tmpdir)
+    save_label_layers(tmpdir, [make_label_layer()])
+    modified = (tmpdir / "region.tiff").stat().st_mtime_ns
+
+    # as if loaded in a new session
+    loaded = make_label_layer()
+    manifest.record_loaded(loaded, tmpdir / "region.tiff")
+    hashed = count_hashes(monkeypatch)
+    save_label_layers(tmpdir, [loaded])
+    assert not hashed
+
+    # changes aren't tracked, but the data hasn't changed
+    untracked = Labels(loaded.data.copy(), name="region")
+    save_label_layers(tmpdir, [untracked])
+    assert len(hashed) == 1
+    assert (tmpdir / "region.tiff").stat().st_mtime_ns == modified
+
+    untracked.data[0, 0, 0] = 3
+    save_label_layers(tmpdir, [untracked])
+    assert load_image(tmpdir / "region.tiff")[0, 0, 0] == 3
+
+
+def test_save_label_layers_after_undo(tmpdir):
+    tmpdir = Path(tmpdir)
+    layer = make_label_layer()
+    layer.paint((3, 7, 15), 3, refresh=False)
+    save_label_layers(tmpdir, [layer])
+    assert load_image(tmpdir / "region.tiff")[3, 7, 15] == 3
+
+    layer.undo()
+    save_label_layers(tmpdir, [layer])
+    assert load_image(tmpdir / "region.tiff")[3, 7, 15] == 1
+
+    layer.redo()
+    save_label_layers(tmpdir, [layer])
+    assert load_image(tmpdir / "region.tiff")[3, 7, 15] == 3
+
+
+def test_connect_undo_redo():
+    layer = make_label_layer()
+    undo = layer.undo
+    called = []
+    manifest.connect_undo_redo(layer, called.append)
+    layer.paint((3, 7, 15), 3, refresh=False)
+    layer.undo()
+    layer.redo()
+    assert called == ["undo", "redo"]
+    # only wrapped once
+    assert layer.undo is undo
+
+
+def test_save_track_layers_incrementally(tmpdir):
+    tmpdir = Path(tmpdir)
+    layer = Points(np.array([[1, 2, 3], [4, 5, 6]]), name="track")
+    manifest.track_changes(layer)
+    save_track_layers(tmpdir, [layer])
+    modified = (tmpdir / "track.points").stat().st_mtime_ns
+
+    save_track_layers(tmpdir, [layer])
+    assert (tmpdir / "track.points").stat().st_mtime_ns == modified
+
+    layer.add([7, 8, 9])
+    save_track_layers(tmpdir, [layer])
+    entry = manifest.load_manifest(tmpdir)["track.points"]
+    assert entry["mtime_ns"] != modified
+    assert entry["hash"] == image_utils.get_image_hash(layer.data)
@@ -1,13 +1,31 @@
+import time
+
+import pytest
 import tifffile
+import numpy as np
 from filecmp import cmp
 
 from pathlib import Path
+from types import SimpleNamespace
+from skimage import measure
 from brainreg_segment.regions import IO as region_IO
 
 
 regions_dir = Path.cwd() / "tests" / "data" / "regions"
 VOXEL_SIZE = 100
 
+# Shape of the 10um Allen mouse atlas
+SHAPE_10UM = (1320, 800, 1140)
+BENCHMARK_PLANES = 100
+
+
+def legacy_extract_and_save_object(image, output_file_name, voxel_size):
+    verts, faces, normals, values = measure.marching_cubes(image, 0)
+    verts, faces = region_IO.convert_obj_to_br(verts, faces, voxel_size)
+    region_IO.marching_cubes_to_obj(
+        (verts, faces, normals, values), str(output_file_name)
+    )
+
 
 def test_export_regions_to_file(tmpdir):
     image = tifffile.imread(regions_dir / "region.tiff")
@@ -15,3 +33,452 @@ def test_export_regions_to_file(tmpdir):
     region_IO.export_regions_to_file(image, filename, VOXEL_SIZE)
 
     cmp(regions_dir / "region.obj", tmpdir / "region.obj")
+
+
+def test_export_label_layers(tmpdir):
+    tmpdir = Path(tmpdir)
+    image = tifffile.imread(regions_dir / "region.tiff")
+    labels = image.astype(np.int32)
+    labels[:, :, : labels.shape[2] // 2] *= 2
+    label_layers = [
+        SimpleNamespace(name="region", data=image),
+        SimpleNamespace(name="labels", data=labels),
+        SimpleNamespace(name="empty", data=np.zeros_like(image)),
+    ]
+
+    progress = list(
+        region_IO.iter_export_label_layers(
+            tmpdir / "parallel",
+            label_layers,
+            VOXEL_SIZE,
+            deal_with_regions_separately=True,
+            n_workers=2,
+        )
+    )
+    assert [n_exported for n_exported, _, _ in progress] == [1, 2, 3]
+    assert {name for _, _, name in progress} == {
+        "region_1",
+        "labels_1",
+        "labels_2",
+    }
+
+    region_IO.export_label_layers(
+        tmpdir / "serial",
+        label_layers,
+        VOXEL_SIZE,
+        deal_with_regions_separately=True,
+        n_workers=1,
+    )
+    for name in ("region_1", "labels_1", "labels_2"):
+        assert cmp(
+            tmpdir / "parallel" / (name + ".obj"),
+            tmpdir / "serial" / (name + ".obj"),
+            shallow=False,
+        )
+    assert not (tmpdir / "parallel" / "empty.obj").exists()
+
+
+@pytest.mark.parametrize("step_size, lod_step_sizes", [(1, ()), (2, (3,))])
+def test_export_label_layers_cropped(tmpdir, step_size, lod_step_sizes):
+    tmpdir = Path(tmpdir)
+    image = np.zeros((60, 70, 80), dtype=np.int16)
+    image[3:12, 20:32, 40:49] = 1
+    image[5:9, 25:29, 45:54] = 3
+    label_layers = [SimpleNamespace(name="region", data=image)]
+
+    # only the region is sent to be exported, not the whole image
+    exports = region_IO.get_region_exports(
+        tmpdir,
+        label_layers,
+        VOXEL_SIZE,
+        step_size=step_size,
+        lod_step_sizes=lod_step_sizes,
+    )
+    [(_, export)] = exports
+    assert export.args[0].size < image.size / 10
+
+    region_IO.export_label_layers(
+        tmpdir,
+        label_layers,
+        VOXEL_SIZE,
+        step_size=step_size,
+        lod_step_sizes=lod_step_sizes,
+        n_workers=2,
+    )
+    region_IO.extract_and_save_object(
+        image,
+        tmpdir / "expected.obj",
+        VOXEL_SIZE,
+        step_size=step_size,
+        lod_step_sizes=lod_step_sizes,
+    )
+    for suffix in [""] + [f"_step{lod}" for lod in lod_step_sizes]:
+        assert cmp(
+            tmpdir / f"region{suffix}.obj",
+            tmpdir / f"expected{suffix}.obj",
+            shallow=False,
+        )
+
+
+def test_pad_bounding_box():
+    image = np.zeros((20, 30, 40), dtype=np.uint8)
+    image[1:5, 10:12, 30:39] = 1
+    bounding_box = region_IO.find_object(image)
+    assert region_IO.pad_bounding_box(bounding_box, image.shape) == (
+        slice(0, 7),
+        slice(8, 14),
+        slice(28, 40),
+    )
+    # start aligned to the step size, padded by two steps
+    assert region_IO.pad_bounding_box(
+        bounding_box, image.shape, step_size=3
+    ) == (
+        slice(0, 11),
+        slice(3, 18),
+        slice(24, 40),
+    )
+    # ignored if below the threshold
+    assert region_IO.find_object(image, threshold=1) is None
+    assert region_IO.pad_bounding_box(None, image.shape) == (
+        slice(0, 20),
+        slice(0, 30),
+        slice(0, 40),
+    )
+
+
+@pytest.mark.parametrize("step_size", [1, 2])
+def test_extract_and_save_object_cropped(tmpdir, step_size):
+    tmpdir = Path(tmpdir)
+    image = np.zeros((30, 40, 50), dtype=np.int16)
+    image[3:9, 20:32, 0:7] = 1
+    image[5:8, 25:28, 5:12] = 2
+
+    region_IO.extract_and_save_object(
+        image, tmpdir / "cropped.obj", VOXEL_SIZE, step_size=step_size
+    )
+    verts, faces, normals, values = measure.marching_cubes(
+        image, 0, step_size=step_size
+    )
+    verts, faces = region_IO.convert_obj_to_br(verts, faces, VOXEL_SIZE)
+    region_IO.marching_cubes_to_obj(
+        (verts, faces, normals, values), str(tmpdir / "full.obj")
+    )
+    assert cmp(tmpdir / "cropped.obj", tmpdir / "full.obj", shallow=False)
+
+
+@pytest.mark.slow
+def test_extract_and_save_object_benchmark(tmpdir):
+    tmpdir = Path(tmpdir)
+    image = np.zeros((BENCHMARK_PLANES,) + SHAPE_10UM[1:], dtype=np.uint8)
+    image[40:60, 300:340, 500:560] = 1
+
+    start = time.perf_counter()
+    region_IO.extract_and_save_object(image, tmpdir / "cropped.obj", 10)
+    cropped_time = time.perf_counter() - start
+
+    start = time.perf_counter()
+    legacy_extract_and_save_object(image, tmpdir / "full.obj", 10)
+    legacy_time = time.perf_counter() - start
+
+    print(
+        f"Meshing a small region in {image.shape}: {cropped_time:.2f}s "
+        f"(previously {legacy_time:.2f}s)"
+    )
+    assert cropped_time < legacy_time
+    assert cmp(tmpdir / "cropped.obj", tmpdir / "full.obj", shallow=False)
+
+
+def legacy_marching_cubes_to_obj(marching_cubes_out, output_file):
+    verts, faces, normals, _ = marching_cubes_out
+    with open(output_file, "w") as f:
+        for item in verts:
+            f.write(f"v {item[0]} {item[1]} {item[2]}\n")
+        for item in normals:
+            f.write(f"vn {item[0]} {item[1]} {item[2]}\n")
+        for item in faces:
+            f.write(
+                f"f {item[0]}//{item[0]} {item[1]}//{item[1]} "
+                f"{item[2]}//{item[2]}\n"
+            )
+
+
+def make_mesh(n_faces, seed=0):
+    rng = np.random.default_rng(seed)
+    n_verts = n_faces // 2
+    # on a grid, as from marching cubes, with some arbitrary values
+    verts = (rng.integers(0, 400, (n_verts, 3)) * 12.5).astype(np.float32)
+    verts[:10] = rng.random((10, 3)).astype(np.float32)
+    normals = rng.integers(-4, 5, (n_verts, 3)).astype(np.float32) / 4
+    normals[:10] = rng.random((10, 3)).astype(np.float32)
+    faces = rng.integers(1, n_verts + 1, (n_faces, 3))
+    return verts, faces, normals, np.zeros(n_verts, dtype=np.float32)
+
+
+def read_ply(filename):
+    with open(filename, "rb") as f:
+        header = []
+        while not header or header[-1] != "end_header":
+            header.append(f.readline().decode("ascii").strip())
+        n_verts = int(header[2].split()[-1])
+        n_faces = int(header[9].split()[-1])
+        vertex_data = np.fromfile(f, dtype="<f4", count=n_verts * 6)
+        face_data = np.fromfile(f, dtype="u1, <i4, <i4, <i4", count=n_faces)
+    assert header[1] == "format binary_little_endian 1.0"
+    assert np.all(face_data["f0"] == 3)
+    faces = np.column_stack([face_data[f"f{i}"] for i in range(1, 4)])
+    return vertex_data.reshape(-1, 6), faces
+
+
+def test_marching_cubes_to_obj(tmpdir):
+    tmpdir = Path(tmpdir)
+    mesh = make_mesh(1000)
+    region_IO.marching_cubes_to_obj(mesh, tmpdir / "mesh.obj")
+    legacy_marching_cubes_to_obj(mesh, tmpdir / "legacy.obj")
+    assert cmp(tmpdir / "mesh.obj", tmpdir / "legacy.obj", shallow=False)
+
+
+def test_export_regions_to_ply(tmpdir):
+    tmpdir = Path(tmpdir)
+    image = tifffile.imread(regions_dir / "region.tiff")
+    region_IO.export_regions_to_file(image, tmpdir / "region.ply", VOXEL_SIZE)
+
+    verts, faces, normals, _ = measure.marching_cubes(image, 0)
+    vertex_data, ply_faces = read_ply(tmpdir / "region.ply")
+    np.testing.assert_array_equal(vertex_data[:, :3], verts * VOXEL_SIZE)
+    np.testing.assert_array_equal(vertex_data[:, 3:], normals)
+    np.testing.assert_array_equal(ply_faces, faces)
+
+
+@pytest.mark.slow
+def test_mesh_writer_benchmark(tmpdir):
+    tmpdir = Path(tmpdir)
+    mesh = make_mesh(1_000_000)
+
+    start = time.perf_counter()
+    region_IO.marching_cubes_to_obj(mesh, tmpdir / "mesh.obj")
+    obj_time = time.perf_counter() - start
+
+    start = time.perf_counter()
+    region_IO.marching_cubes_to_ply(mesh, tmpdir / "mesh.ply")
+    ply_time = time.perf_counter() - start
+
+    start = time.perf_counter()
+    legacy_marching_cubes_to_obj(mesh, tmpdir / "legacy.obj")
+    legacy_time = time.perf_counter() - start
+
+    print(
+        f"Writing a mesh of 1,000,000 triangles: {obj_time:.2f}s as .obj, "
+        f"{ply_time:.2f}s as .ply (previously {legacy_time:.2f}s)"
+    )
+    assert obj_time < legacy_time
+    assert ply_time < obj_time
+    assert (tmpdir / "mesh.ply").stat().st_size < (
+        tmpdir / "mesh.obj"
+    ).stat().st_size
+    assert cmp(tmpdir / "mesh.obj", tmpdir / "legacy.obj", shallow=False)
+
+
+def count_faces(obj_file):
+    with open(obj_file) as f:
+        return sum(line.startswith("f ") for line in f)
+
+
+def test_export_levels_of_detail(tmpdir):
+    tmpdir = Path(tmpdir)
+    image = tifffile.imread(regions_dir / "region.tiff")
+    label_layers = [SimpleNamespace(name="region", data=image)]
+    region_IO.export_label_layers(
+        tmpdir, label_layers, VOXEL_SIZE, lod_step_sizes=(2, 4), n_workers=1
+    )
+
+    for step_size, filename in [
+        (2, "region_step2.obj"),
+        (4, "region_step4.obj"),
+    ]:
+        region_IO.extract_and_save_object(
+            image, tmpdir / "expected.obj", VOXEL_SIZE, step_size=step_size
+        )
+        assert cmp(tmpdir / filename, tmpdir / "expected.obj", shallow=False)
+
+    n_faces = [
+        count_faces(tmpdir / filename)
+        for filename in ("region.obj", "region_step2.obj", "region_step4.obj")
+    ]
+    assert n_faces == sorted(n_faces, reverse=True)
+    assert cmp(
+        regions_dir / "region.obj", tmpdir / "region.obj", shallow=False
+    )
+
+
+def test_export_levels_of_detail_small_object(tmpdir):
+    tmpdir = Path(tmpdir)
+    image = np.zeros((20, 20, 20), dtype=np.uint8)
+    image[9, 9, 9] = 1
+    region_IO.extract_and_save_object(
+        image, tmpdir / "region.obj", VOXEL_SIZE, lod_step_sizes=(4,)
+    )
+    assert (tmpdir / "region.obj").exists()
+    assert not (tmpdir / "region_step4.obj").exists()
+
+
+@pytest.mark.parametrize("step_size, lod_step_sizes", [(1, ()), (2, (3,))])
+def test_export_labels_separately(tmpdir, step_size, lod_step_sizes):
+    tmpdir = Path(tmpdir)
+    image = np.zeros((30, 40, 50), dtype=np.int16)
+    image[3:12, 20:32, 0:9] = 1
+    image[5:9, 25:29, 5:14] = 3
+    image[20:29, 2:12, 30:49] = 2
+
+    region_IO.volume_to_vector_array_to_obj_file(
+        image,
+        tmpdir / "labels.obj",
+        voxel_size=VOXEL_SIZE,
+        step_size=step_size,
+        deal_with_regions_separately=True,
+        lod_step_sizes=lod_step_sizes,
+        n_workers=2,
+    )
+
+    for label_id in (1, 2, 3):
+        region_IO.extract_and_save_object(
+            image == label_id,
+            tmpdir / f"expected_{label_id}.obj",
+            VOXEL_SIZE,
+            step_size=step_size,
+            lod_step_sizes=lod_step_sizes,
+        )
+        filenames = [f"labels_{label_id}.obj"] + [
+            f"labels_{label_id}_step{lod}.obj" for lod in lod_step_sizes
+        ]
+        expected = [f"expected_{label_id}.obj"] + [
+            f"expected_{label_id}_step{lod}.obj" for lod in lod_step_sizes
+        ]
+        for filename, expected_filename in zip(filenames, expected):
+            assert cmp(
+                tmpdir / filename, tmpdir / expected_filename, shallow=False
+            )
+    assert not (tmpdir / "labels_0.obj").exists()
+
+
+@pytest.mark.parametrize(
+    "extension, compression",
+    [(".tiff", None), (".tiff", "zlib"), (".zarr", None)],
+)
+def test_save_and_load_regions(tmpdir, extension, compression):
+    tmpdir = Path(tmpdir)
+    image = np.zeros((40, 300, 200), dtype=np.int16)
+    image[10:20, 100:150, 50:120] = 2
+    label_layer = SimpleNamespace(name="region", data=image)
+
+    region_IO.save_regions_to_file(
+        label_layer,
+        tmpdir,
+        image_extension=extension,
+        chunk_size=8,
+        compression=compression,
+    )
+    filename = tmpdir / ("region" + extension)
+    loaded = region_IO.load_image(filename)
+    assert isinstance(loaded, np.ndarray)
+    np.testing.assert_array_equal(loaded, image)
+
+    lazy = region_IO.load_image(filename, lazy=True)
+    assert not isinstance(lazy, np.ndarray)
+    np.testing.assert_array_equal(lazy[15], image[15])
+
+    # save over the file the regions were lazily loaded from
+    region_IO.save_regions_to_file(
+        SimpleNamespace(name="region", data=lazy),
+        tmpdir,
+        image_extension=extension,
+        compression=compression,
+    )
+    np.testing.assert_array_equal(region_IO.load_image(filename), image)
+    assert not list(tmpdir.glob("*.tmp"))
+
+
+def test_saved_regions_compressed(tmpdir):
+    tmpdir = Path(tmpdir)
+    image = np.zeros((64, 512, 512), dtype=np.int16)
+    image[20:30, 100:150, 50:120] = 1
+    label_layer = SimpleNamespace(name="region", data=image)
+
+    (tmpdir / "uncompressed").mkdir()
+    (tmpdir / "zlib").mkdir()
+    region_IO.save_regions_to_file(label_layer, tmpdir / "uncompressed")
+    region_IO.save_regions_to_file(
+        label_layer, tmpdir / "zlib", compression="zlib"
+    )
+    region_IO.save_regions_to_file(
+        label_layer, tmpdir / "zarr", image_extension=".zarr"
+    )
+
+    def size(path):
+        return sum(f.stat().st_size for f in path.rglob("*") if f.is_file())
+
+    uncompressed = size(tmpdir / "uncompressed")
+    assert size(tmpdir / "zlib") < uncompressed / 20
+    assert size(tmpdir / "zarr") < uncompressed / 20
+
+
+def make_sparse_region(shape, fraction=0.01, seed=0):
+    # an ellipsoid filling a fraction of the image, with a few labels
+    centre = np.array(shape) / 2
+    radii = np.array(shape) * (fraction * 3 / (4 * np.pi)) ** (1 / 3)
+    z, y, x = np.ogrid[tuple(slice(0, s) for s in shape)]
+    inside = (
+        ((z - centre[0]) / radii[0]) ** 2
+        + ((y - centre[1]) / radii[1]) ** 2
+        + ((x - centre[2]) / radii[2]) ** 2
+    ) < 1
+    region = np.zeros(shape, dtype=np.int16)
+    region[inside] = 1
+    region[: int(centre[0]), : int(centre[1])] *= 2
+    return region
+
+
+def test_save_and_load_sparse_regions(tmpdir):
+    tmpdir = Path(tmpdir)
+    image = make_sparse_region((40, 60, 50))
+    image[0, 0, 0] = -1  # at the edge, and negative
+    label_layer = SimpleNamespace(name="region", data=image)
+
+    region_IO.save_regions_to_file(
+        label_layer, tmpdir, image_extension=".npz", chunk_size=8
+    )
+    loaded = region_IO.load_image(tmpdir / "region.npz")
+    assert loaded.dtype == np.int16
+    np.testing.assert_array_equal(loaded, image)
+
+    with np.load(tmpdir / "region.npz") as f:
+        # runs of 1, 2 and -1 along each row of the region
+        assert len(f["run_values"]) < np.count_nonzero(image) / 5
+        assert set(f["run_values"]) == {-1, 1, 2}
+
+
+@pytest.mark.slow
+def test_sparse_regions_benchmark(tmpdir):
+    tmpdir = Path(tmpdir)
+    image = make_sparse_region((BENCHMARK_PLANES,) + SHAPE_10UM[1:])
+    label_layer = SimpleNamespace(name="region", data=image)
+
+    start = time.perf_counter()
+    region_IO.save_regions_to_file(label_layer, tmpdir, image_extension=".npz")
+    loaded = region_IO.load_image(tmpdir / "region.npz")
+    sparse_time = time.perf_counter() - start
+    np.testing.assert_array_equal(loaded, image)
+
+    start = time.perf_counter()
+    region_IO.save_regions_to_file(label_layer, tmpdir)
+    region_IO.load_image(tmpdir / "region.tiff")
+    tiff_time = time.perf_counter() - start
+
+    sparse_size = (tmpdir / "region.npz").stat().st_size
+    tiff_size = (tmpdir / "region.tiff").stat().st_size
+    print(
+        f"Saving and loading a 1% filled region of {image.shape}: "
+        f"{sparse_time:.2f}s, {sparse_size / 1e6:.2f}MB "
+        f"(as .tiff, {tiff_time:.2f}s, {tiff_size / 1e6:.2f}MB)"
+    )
+    # both need a pass over the dense image, but the sparse file is tiny
+    assert sparse_size < tiff_size / 1000
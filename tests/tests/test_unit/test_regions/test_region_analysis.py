@@ -0,0 +1,334 @@
+import time
+import tracemalloc
+
+import numpy as np
+import pandas as pd
+import pytest
+
+from pathlib import Path
+from types import SimpleNamespace
+from skimage.measure import regionprops_table
+
+from brainreg_segment.regions import analysis as region_analysis
+from brainreg_segment.regions import IO as region_IO
+
+LEFT = 1
+RIGHT = 2
+VOXEL_VOLUME = 0.000125
+
+# Shape of a 10um atlas, and the number of planes used for benchmarking
+SHAPE_10UM = (1320, 800, 1140)
+BENCHMARK_PLANES = 100
+
+structures = {
+    10: {"name": "structure a"},
+    20: {"name": "structure b"},
+    30: {"name": "structure c"},
+}
+
+
+def make_volumes(shape, seed=0):
+    rng = np.random.default_rng(seed)
+    midline = shape[-1] // 2
+    annotations = np.empty(shape, dtype=np.uint32)
+    annotations[..., :midline] = rng.choice(
+        np.array([0, 10, 20], dtype=np.uint32), size=shape[:-1] + (midline,)
+    )
+    annotations[..., midline:] = rng.choice(
+        np.array([0, 20, 30], dtype=np.uint32),
+        size=shape[:-1] + (shape[-1] - midline,),
+    )
+    hemispheres = np.full(shape, LEFT, dtype=np.uint8)
+    hemispheres[..., midline:] = RIGHT
+    region = np.zeros(shape, dtype=np.uint16)
+    center = tuple(s // 2 for s in shape)
+    region[
+        tuple(slice(c - s // 8, c + s // 8) for c, s in zip(center, shape))
+    ] = 1
+    return region, annotations, hemispheres
+
+
+def legacy_voxel_counts(region, annotations, hemispheres):
+    masked_annotations = region.astype(bool) * annotations
+    unique_vals_left, counts_left = np.unique(
+        masked_annotations[hemispheres == LEFT], return_counts=True
+    )
+    unique_vals_right, counts_right = np.unique(
+        masked_annotations[hemispheres == RIGHT], return_counts=True
+    )
+    counts = {}
+    for atlas_value in np.union1d(unique_vals_left, unique_vals_right):
+        if atlas_value != 0:
+            counts[atlas_value] = []
+            for unique_vals, side_counts in (
+                (unique_vals_left, counts_left),
+                (unique_vals_right, counts_right),
+            ):
+                index = np.where(unique_vals == atlas_value)[0]
+                counts[atlas_value].append(
+                    side_counts[index[0]] if len(index) else 0
+                )
+    return counts
+
+
+def assert_counts_match(region, annotations, hemispheres):
+    ids, left, right = region_analysis.get_structure_voxel_counts(
+        region,
+        annotations,
+        hemispheres,
+        left_hemisphere_value=LEFT,
+        right_hemisphere_value=RIGHT,
+    )
+    expected = legacy_voxel_counts(region, annotations, hemispheres)
+    counts = {
+        structure_id: [counts_left, counts_right]
+        for structure_id, counts_left, counts_right in zip(ids, left, right)
+        if structure_id != 0
+    }
+    assert counts == expected
+
+
+def test_get_structure_voxel_counts():
+    assert_counts_match(*make_volumes((40, 30, 50)))
+
+
+def test_get_structure_voxel_counts_batched():
+    region, annotations, hemispheres = make_volumes((40, 30, 50))
+    regions = [region, np.roll(region, 7, axis=0), np.zeros_like(region)]
+    batched_counts = region_analysis.get_structure_voxel_counts_batched(
+        regions,
+        annotations,
+        hemispheres,
+        left_hemisphere_value=LEFT,
+        right_hemisphere_value=RIGHT,
+        chunk_size=6,
+    )
+
+    assert batched_counts[2] is None
+    for data, counts in zip(regions[:2], batched_counts[:2]):
+        expected = region_analysis.get_structure_voxel_counts(
+            data,
+            annotations,
+            hemispheres,
+            left_hemisphere_value=LEFT,
+            right_hemisphere_value=RIGHT,
+        )
+        for array, expected_array in zip(counts, expected):
+            np.testing.assert_array_equal(array, expected_array)
+
+
+def test_get_structure_volumes_df():
+    ids = np.array([0, 10, 20, 30, 40])
+    left = np.array([5, 0, 3, 0, 1])
+    right = np.array([2, 4, 1, 2, 0])
+    df = region_analysis.get_structure_volumes_df(
+        ids, left, right, structures, VOXEL_VOLUME
+    )
+
+    # left hemisphere first, then right only. 40 is not in the atlas
+    assert list(df["structure_name"]) == [
+        "structure b",
+        "structure a",
+        "structure c",
+    ]
+    total = 3 + 1 + 4 + 1 + 2
+    np.testing.assert_allclose(
+        df["left_volume_mm3"].astype(float), [3 * VOXEL_VOLUME, 0, 0]
+    )
+    np.testing.assert_allclose(
+        df["percentage_of_total"].astype(float),
+        [100 * 4 / total, 100 * 4 / total, 100 * 2 / total],
+    )
+    assert df["left_volume_mm3"][1] == 0
+
+
+def test_array_api_matches_layers(tmpdir):
+    tmpdir = Path(tmpdir)
+    region, annotations, hemispheres = make_volumes((40, 30, 50))
+    regions = [("region", region), ("other", np.roll(region, 7, axis=0))]
+    label_layers = [SimpleNamespace(name=n, data=d) for n, d in regions]
+    atlas = SimpleNamespace(
+        left_hemisphere_value=LEFT,
+        right_hemisphere_value=RIGHT,
+        resolution=(50, 50, 50),
+        structures=structures,
+    )
+
+    region_analysis.analyse_region_brain_areas_batched(
+        label_layers, annotations, hemispheres, tmpdir, atlas
+    )
+    volumes = region_analysis.get_region_brain_area_volumes(
+        regions, annotations, hemispheres, atlas
+    )
+    assert list(volumes) == ["region", "other"]
+    for name, df in volumes.items():
+        pd.testing.assert_frame_equal(
+            df.reset_index(drop=True),
+            pd.read_csv(tmpdir / (name + ".csv")),
+            check_dtype=False,
+        )
+
+    region_analysis.summarise_brain_regions(
+        label_layers, tmpdir / "summary.csv", atlas.resolution
+    )
+    pd.testing.assert_frame_equal(
+        region_analysis.get_regions_summary(
+            regions, atlas.resolution
+        ).reset_index(drop=True),
+        pd.read_csv(tmpdir / "summary.csv"),
+        check_dtype=False,
+    )
+
+    assert region_IO.save_region(
+        "region", region, tmpdir
+    ) == region_IO.save_regions_to_file(label_layers[0], tmpdir)
+
+
+def test_get_region_brain_area_volumes_roll_up():
+    region, annotations, hemispheres = make_volumes((40, 30, 50))
+    # root (997) -> a (10), b (20) -> c (30)
+    atlas = SimpleNamespace(
+        left_hemisphere_value=LEFT,
+        right_hemisphere_value=RIGHT,
+        resolution=(50, 50, 50),
+        structures={
+            997: {"name": "root", "structure_id_path": [997]},
+            10: {"name": "structure a", "structure_id_path": [997, 10]},
+            20: {"name": "structure b", "structure_id_path": [997, 20]},
+            30: {"name": "structure c", "structure_id_path": [997, 20, 30]},
+        },
+    )
+    regions = [("region", region)]
+    volumes = region_analysis.get_region_brain_area_volumes(
+        regions, annotations, hemispheres, atlas
+    )["region"].set_index("structure_name")
+    rolled_up = region_analysis.get_region_brain_area_volumes(
+        regions, annotations, hemispheres, atlas, roll_up=True
+    )["region"].set_index("structure_name")
+
+    assert set(rolled_up.index) == {
+        "root",
+        "structure a",
+        "structure b",
+        "structure c",
+    }
+    for column in ("left_volume_mm3", "right_volume_mm3"):
+        volume = volumes[column].astype(float)
+        rolled_up_volume = rolled_up[column].astype(float)
+        np.testing.assert_allclose(rolled_up_volume["root"], volume.sum())
+        np.testing.assert_allclose(
+            rolled_up_volume["structure b"],
+            volume["structure b"] + volume["structure c"],
+        )
+        for name in ("structure a", "structure c"):
+            np.testing.assert_allclose(rolled_up_volume[name], volume[name])
+
+
+def test_get_region_properties():
+    image = np.zeros((30, 20, 25), dtype=np.int16)
+    image[3:17, 4:9, 2:20] = 1
+    image[10:29, 12:19, 5:7] = 3
+    image[5, 5, 5] = 0
+    expected = pd.DataFrame(
+        regionprops_table(
+            image.astype(np.uint16), properties=["area", "bbox", "centroid"]
+        )
+    )
+    for chunk_size in (1, 4, 64):
+        properties = region_analysis.get_region_properties(
+            image, chunk_size=chunk_size
+        )
+        pd.testing.assert_frame_equal(
+            properties.astype(float), expected.astype(float)
+        )
+
+
+def test_chunked_analysis_memory(tmpdir):
+    shape = (256, 256, 256)
+    chunk_size = 8
+
+    def memmap(filename, dtype):
+        return np.lib.format.open_memmap(
+            str(tmpdir / filename), mode="w+", dtype=dtype, shape=shape
+        )
+
+    region = memmap("region.npy", np.int16)
+    annotations = memmap("annotations.npy", np.uint32)
+    hemispheres = memmap("hemispheres.npy", np.uint8)
+    rng = np.random.default_rng(0)
+    for start in range(0, shape[0], chunk_size):
+        chunk = slice(start, start + chunk_size)
+        annotations[chunk] = rng.choice(
+            np.array([0, 10, 20, 30], dtype=np.uint32),
+            size=(chunk_size,) + shape[1:],
+        )
+        hemispheres[chunk, :, : shape[2] // 2] = LEFT
+        hemispheres[chunk, :, shape[2] // 2 :] = RIGHT
+    region[20:200, 50:200, 30:220] = 1
+
+    atlas = SimpleNamespace(
+        left_hemisphere_value=LEFT,
+        right_hemisphere_value=RIGHT,
+        resolution=(50, 50, 50),
+        structures=structures,
+    )
+    label_layer = SimpleNamespace(name="region", data=region)
+    budget = (region.nbytes + annotations.nbytes + hemispheres.nbytes) / 4
+
+    tracemalloc.start()
+    try:
+        region_analysis.analyse_region_brain_areas_batched(
+            [label_layer],
+            annotations,
+            hemispheres,
+            tmpdir,
+            atlas,
+            chunk_size=chunk_size,
+        )
+        region_analysis.summarise_brain_regions(
+            [label_layer],
+            tmpdir / "summary.csv",
+            atlas.resolution,
+            chunk_size=chunk_size,
+        )
+        region_IO.save_regions_to_file(
+            label_layer, tmpdir, chunk_size=chunk_size
+        )
+        _, peak = tracemalloc.get_traced_memory()
+    finally:
+        tracemalloc.stop()
+
+    assert peak < budget
+    summary = pd.read_csv(tmpdir / "summary.csv")
+    assert summary["volume_mm3"][0] == pytest.approx(
+        180 * 150 * 190 * VOXEL_VOLUME
+    )
+    assert (tmpdir / "region.csv").exists()
+    assert (tmpdir / "region.tiff").exists()
+
+
+@pytest.mark.slow
+def test_structure_voxel_counts_benchmark():
+    shape = (BENCHMARK_PLANES,) + SHAPE_10UM[1:]
+    region, annotations, hemispheres = make_volumes(shape)
+
+    start = time.perf_counter()
+    region_analysis.get_structure_voxel_counts(
+        region,
+        annotations,
+        hemispheres,
+        left_hemisphere_value=LEFT,
+        right_hemisphere_value=RIGHT,
+    )
+    vectorised_time = time.perf_counter() - start
+
+    start = time.perf_counter()
+    legacy_voxel_counts(region, annotations, hemispheres)
+    legacy_time = time.perf_counter() - start
+
+    print(
+        f"Structure voxel counts for {shape}: {vectorised_time:.2f}s "
+        f"(previously {legacy_time:.2f}s)"
+    )
+    assert vectorised_time < legacy_time
+    assert_counts_match(region, annotations, hemispheres)
@@ -0,0 +1,40 @@
+import numpy as np
+import pytest
+
+from pathlib import Path
+
+from brainreg_segment.regions.IO import save_image
+from brainreg_segment.regions.layers import (
+    get_region_files,
+    load_region_files,
+)
+
+
+@pytest.mark.parametrize("n_threads", [1, 3])
+def test_load_region_files(tmpdir, qtbot, n_threads):
+    tmpdir = Path(tmpdir)
+    images = {}
+    for i in range(3):
+        label_file = str(tmpdir / f"region_{i}.tiff")
+        images[label_file] = np.full((4, 5, 6), i, dtype=np.int16)
+        save_image(images[label_file], label_file)
+
+    loaded = {}
+    progress = []
+
+    def add_loaded(value):
+        n, n_files, label_file, image = value
+        progress.append((n, n_files))
+        loaded[label_file] = image
+
+    worker = load_region_files(
+        get_region_files(tmpdir, ".tiff"), n_threads=n_threads
+    )
+    worker.yielded.connect(add_loaded)
+    with qtbot.waitSignal(worker.finished, timeout=10000):
+        worker.start()
+
+    assert set(loaded) == set(images)
+    for label_file, image in images.items():
+        np.testing.assert_array_equal(loaded[label_file], image)
+    assert progress == [(n, len(images)) for n in range(1, len(images) + 1)]
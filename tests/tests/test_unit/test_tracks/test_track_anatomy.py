@@ -0,0 +1,108 @@
+import time
+
+import numpy as np
+import pandas as pd
+import pytest
+
+from pathlib import Path
+from types import SimpleNamespace
+
+from brainreg_segment.tracks.analysis import (
+    fit_tracks,
+    get_track_anatomy,
+    run_track_analysis,
+)
+
+NOT_FOUND = "Not found in brain"
+
+annotation = np.zeros((20, 30, 40), dtype=np.uint32)
+annotation[5:15, 5:25, 5:35] = 10
+annotation[8:12, 10:20, 10:30] = 20
+annotation[9, 15, 20] = 99  # not in the atlas structures
+
+structures = {
+    10: {"id": 10, "acronym": "A", "name": "Structure a"},
+    20: {"id": 20, "acronym": "B", "name": "Structure b"},
+}
+
+atlas = SimpleNamespace(annotation=annotation, structures=structures)
+
+
+def legacy_track_anatomy(atlas, spline):
+    rows = []
+    for idx, p in enumerate(spline.tolist()):
+        try:
+            region = atlas.structures[
+                atlas.annotation[tuple(int(c) for c in p)]
+            ]
+            rows.append([idx, region["id"], region["acronym"], region["name"]])
+        except KeyError:
+            rows.append([idx, NOT_FOUND, NOT_FOUND, NOT_FOUND])
+    return pd.DataFrame(
+        rows,
+        columns=["Position", "Region ID", "Region acronym", "Region name"],
+    )
+
+
+def make_spline(n_points):
+    return np.linspace([0.5, 0.5, 0.5], [19.5, 29.5, 39.5], n_points)
+
+
+def test_get_track_anatomy():
+    spline = np.vstack((make_spline(50), [[9.2, 15.7, 20.1], [25, 3, 3]]))
+    anatomy = get_track_anatomy(atlas, spline)
+
+    assert list(anatomy.columns) == [
+        "Position",
+        "Region ID",
+        "Region acronym",
+        "Region name",
+    ]
+    pd.testing.assert_frame_equal(
+        anatomy.iloc[:-1], legacy_track_anatomy(atlas, spline[:-1])
+    )
+    # unknown structure, and outside the image
+    assert list(anatomy["Region ID"].iloc[-2:]) == [NOT_FOUND, NOT_FOUND]
+
+
+def test_fit_tracks(tmpdir):
+    tmpdir = Path(tmpdir)
+    points = np.array(
+        [[3, 5, 8], [5, 8, 12], [8, 12, 17], [10, 16, 21], [13, 19, 26]]
+    )
+    tracks = [(f"track_{i}", points + i) for i in range(4)]
+    splines, spline_names = fit_tracks(
+        tracks, atlas, tmpdir, spline_points=20, n_workers=2
+    )
+
+    assert spline_names == [name for name, _ in tracks]
+    for (name, track_points), spline in zip(tracks, splines):
+        expected = run_track_analysis(
+            track_points, "expected", tmpdir, atlas, spline_points=20
+        )
+        np.testing.assert_array_equal(spline, expected)
+        pd.testing.assert_frame_equal(
+            pd.read_csv(tmpdir / (name + ".csv")),
+            pd.read_csv(tmpdir / "expected.csv"),
+        )
+
+
+@pytest.mark.slow
+@pytest.mark.parametrize("n_points", [10_000, 100_000])
+def test_track_anatomy_benchmark(n_points):
+    spline = make_spline(n_points)
+
+    start = time.perf_counter()
+    anatomy = get_track_anatomy(atlas, spline)
+    vectorised_time = time.perf_counter() - start
+
+    start = time.perf_counter()
+    expected = legacy_track_anatomy(atlas, spline)
+    legacy_time = time.perf_counter() - start
+
+    print(
+        f"Track anatomy for {n_points} points: {vectorised_time:.3f}s "
+        f"(previously {legacy_time:.3f}s)"
+    )
+    assert vectorised_time < legacy_time
+    pd.testing.assert_frame_equal(anatomy, expected)